@@ -0,0 +1,54 @@
+"""
+add_stock_metrics の並列実行 (metrics_parallel.run_per_code_parallel) のスケーリングを測る
+
+    python benchmarks/bench_parallel_metrics.py --codes 4000 --days 500 --workers 1 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from jquants_free_mcp_server.calc_stock_metrics import add_stock_metrics
+from jquants_free_mcp_server.metrics_parallel import run_per_code_parallel
+
+
+def make_prices(codes: int, days: int, seed: int = 0) -> pd.DataFrame:
+    """日付ごとに全銘柄が並ぶ株価データを作る"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2022-01-04", periods=days).strftime("%Y-%m-%d")
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, (days, codes)), axis=0))
+    return pd.DataFrame({
+        "Date": np.repeat(dates, codes),
+        "Code": np.tile(np.arange(codes) * 10 + 10000, days),
+        "AdjustmentClose": close.ravel(),
+        "AdjustmentLow": (close * (1 - rng.uniform(0, 0.02, close.shape))).ravel(),
+        "AdjustmentVolume": rng.lognormal(10, 1, close.size),
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codes", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    df = make_prices(args.codes, args.days)
+    print(f"rows: {len(df):,}")
+
+    started = time.perf_counter()
+    expected = add_stock_metrics(df.copy())
+    baseline = time.perf_counter() - started
+    print(f"serial      : {baseline:7.2f}s")
+
+    for workers in args.workers:
+        started = time.perf_counter()
+        result = run_per_code_parallel(df.copy(), workers=workers)
+        elapsed = time.perf_counter() - started
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        print(f"workers={workers:<4d}: {elapsed:7.2f}s  (x{baseline / elapsed:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+合成したTSE規模のデータで主な処理の速度とピークメモリを測り、結果をJSONで出力する
+
+    python benchmarks/run_benchmarks.py --codes 4000 --days 500 --output results.json
+    # 前回の結果と比べ、20%以上遅くなったベンチマークがあれば終了コード1で終わる
+    python benchmarks/run_benchmarks.py --output current.json --compare results.json --threshold 0.2
+
+処理時間は repeat 回のうち最短の値、ピークメモリは tracemalloc を有効にした別の1回で測る
+(tracemalloc は処理時間を遅くするため、時間の計測とは分ける)。
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from jquants_free_mcp_server import json_backend
+from jquants_free_mcp_server.calc_stock_metrics import PRICE_INPUT_COLUMNS, add_stock_metrics
+from jquants_free_mcp_server.company_search import CompanySearchIndex
+from jquants_free_mcp_server.custom_metrics.credit_reverse_signal import credit_reverse_signal
+from jquants_free_mcp_server.custom_metrics.foreigners_flow_signal import foreigners_flow_signal
+from jquants_free_mcp_server.custom_metrics.quality_value_signal import quality_value_signal
+from jquants_free_mcp_server.custom_metrics.sector_momentum_signal import sector_momentum_signal
+from jquants_free_mcp_server.custom_metrics.short_squeeze_signal import short_squeeze_signal
+from jquants_free_mcp_server.indicators import compute_indicators
+from jquants_free_mcp_server.server import shape_records
+
+from synthetic_data import make_datasets
+
+RESULT_VERSION = 1
+
+# JSONのシリアライズで使うレコード数の上限 (get_daily_quotes_batch で100銘柄×1年分程度)
+JSON_RECORDS = 25_000
+
+# indicators.compute_indicators で計算する指標 (移動平均の窓を増やしても走査回数は増えない)
+INDICATORS = {
+    "sma": [5, 25, 75, 200],
+    "ema": [12, 26],
+    "volume_mean": [5, 25],
+    "deviation": [5, 25, 75, 200],
+    "perfect_order": [5, 25, 75],
+}
+
+# (ベンチマーク名, 処理した行数, 処理)
+Case = tuple[str, int, Callable[[], Any]]
+
+
+def _per_group(signal: Any, df: pd.DataFrame, by: str) -> Callable[[], pd.Series]:
+    """銘柄 (または市場区分) ごとの時系列にシグナルを適用する処理"""
+    def run() -> pd.Series:
+        return pd.concat([signal.calculate(group) for _, group in df.groupby(by, sort=False)])
+    return run
+
+
+def _search_queries(listed: pd.DataFrame, n: int = 1000, seed: int = 0) -> list[str]:
+    """銘柄コード・社名の完全一致/前方一致/部分一致・英語名を混ぜた検索語"""
+    rng = np.random.default_rng(seed)
+    rows = listed.iloc[rng.integers(0, len(listed), n)]
+    kinds = rng.integers(0, 5, n)
+    queries = []
+    for kind, (_, row) in zip(kinds, rows.iterrows()):
+        name = row["CompanyName"]
+        queries.append([
+            row["Code"][:4],
+            name,
+            name[:2],
+            name[2:5],
+            row["CompanyNameEnglish"].split()[0].lower(),
+        ][kind])
+    return queries
+
+
+def build_cases(datasets: dict[str, pd.DataFrame]) -> list[Case]:
+    """データセットからベンチマークの一覧を作る (入力の準備は計測に含めない)"""
+    quotes = datasets["stock_price"]
+    listed = datasets["stock_list"]
+    prices = quotes[PRICE_INPUT_COLUMNS]
+
+    sectors = listed.set_index(listed["Code"].astype(int))["Sector33Code"]
+    sector_quotes = quotes[["Date", "Code", "Close"]].assign(Sector33Code=quotes["Code"].map(sectors))
+
+    closes = quotes[["Date", "Code", "Close"]].rename(columns={"Date": "DisclosedDate"})
+    statements = datasets["stock_fin"].assign(Code=datasets["stock_fin"]["LocalCode"].astype(int))
+    statements = statements.merge(closes, on=["DisclosedDate", "Code"], how="left")
+
+    records = quotes.head(JSON_RECORDS).to_dict("records")
+    search_records = listed.to_dict("records")
+    index = CompanySearchIndex(search_records)
+    queries = _search_queries(listed)
+
+    return [
+        ("calc_stock_metrics.add_stock_metrics", len(prices), lambda: add_stock_metrics(prices.copy())),
+        ("indicators.compute_indicators", len(prices), lambda: compute_indicators(prices, INDICATORS, by="Code")),
+        ("custom_metrics.credit_reverse_signal", len(datasets["margin_interest"]),
+         _per_group(credit_reverse_signal, datasets["margin_interest"], "Code")),
+        ("custom_metrics.short_squeeze_signal", len(datasets["short_selling"]),
+         _per_group(short_squeeze_signal, datasets["short_selling"], "Code")),
+        ("custom_metrics.foreigners_flow_signal", len(datasets["markets_trades_spec"]),
+         _per_group(foreigners_flow_signal, datasets["markets_trades_spec"].rename(columns={"PublishedDate": "Date"}),
+                    "Section")),
+        ("custom_metrics.quality_value_signal", len(statements), lambda: quality_value_signal.calculate(statements)),
+        ("custom_metrics.sector_momentum_signal", len(sector_quotes),
+         lambda: sector_momentum_signal.calculate(sector_quotes)),
+        ("json.daily_quotes.records", len(records), lambda: json_backend.dumps({"daily_quotes": records})),
+        ("json.daily_quotes.columnar", len(records),
+         lambda: json_backend.dumps({"daily_quotes": shape_records(records, output_format="columnar")})),
+        ("company_search.build_index", len(search_records), lambda: CompanySearchIndex(search_records)),
+        ("company_search.search", len(queries), lambda: [index.search(query) for query in queries]),
+    ]
+
+
+def measure(name: str, rows: int, func: Callable[[], Any], repeat: int = 3) -> dict[str, Any]:
+    """
+    処理時間 (repeat回の最短・平均) とピークメモリを測る
+
+    Returns:
+        dict[str, Any]: 計測結果 (rows_per_second は最短の処理時間から計算する)
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "name": name,
+        "rows": rows,
+        "seconds": best,
+        "mean_seconds": sum(times) / len(times),
+        "rows_per_second": rows / best if best > 0 else None,
+        "peak_memory_mb": peak / 1024 / 1024,
+    }
+
+
+def run_suite(codes: int = 4000, days: int = 500, seed: int = 0, repeat: int = 3,
+              only: list[str] | None = None) -> dict[str, Any]:
+    """
+    データを作り、全ベンチマークを実行する
+
+    Args:
+        codes (int, optional): 銘柄数. Defaults to 4000.
+        days (int, optional): 営業日数. Defaults to 500.
+        seed (int, optional): 乱数のシード. Defaults to 0.
+        repeat (int, optional): 処理時間を測る回数. Defaults to 3.
+        only (list[str] | None, optional): 名前がこのいずれかで始まるベンチマークだけを実行する
+
+    Returns:
+        dict[str, Any]: 実行環境・データ量・計測結果
+    """
+    started = time.perf_counter()
+    datasets = make_datasets(codes, days, seed)
+    generate_seconds = time.perf_counter() - started
+
+    results = []
+    for name, rows, func in build_cases(datasets):
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results.append(measure(name, rows, func, repeat))
+
+    return {
+        "version": RESULT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "json_backend": json_backend.backend_name,
+        },
+        "parameters": {"codes": codes, "days": days, "seed": seed, "repeat": repeat},
+        "datasets": {name: len(df) for name, df in datasets.items()},
+        "generate_seconds": generate_seconds,
+        "results": results,
+    }
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], threshold: float = 0.2) -> list[dict[str, Any]]:
+    """
+    前回の結果と比べて、処理時間が threshold (割合) を超えて増えたベンチマークを返す
+
+    データ量 (parameters) が異なる結果とは比較できないため ValueError を送出する。
+    """
+    if current["parameters"]["codes"] != baseline["parameters"]["codes"] or \
+            current["parameters"]["days"] != baseline["parameters"]["days"]:
+        raise ValueError("データ量 (codes, days) が異なる結果とは比較できません")
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result["name"])
+        if before is None or before["seconds"] <= 0:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        if ratio > 1 + threshold:
+            regressions.append({"name": result["name"], "baseline_seconds": before["seconds"],
+                                "seconds": result["seconds"], "ratio": ratio})
+    return regressions
+
+
+def format_results(suite: dict[str, Any]) -> str:
+    lines = [f"{'benchmark':<40} {'rows':>10} {'seconds':>9} {'rows/s':>12} {'peak MB':>9}"]
+    for r in suite["results"]:
+        lines.append(
+            f"{r['name']:<40} {r['rows']:>10,} {r['seconds']:>9.3f} {r['rows_per_second'] or 0:>12,.0f} "
+            f"{r['peak_memory_mb']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codes", type=int, default=4000)
+    parser.add_argument("--days", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="名前がこれで始まるベンチマークだけを実行する")
+    parser.add_argument("--output", help="結果のJSONの保存先 (省略時は標準出力)")
+    parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="遅くなったとみなす割合")
+    args = parser.parse_args()
+
+    suite = run_suite(args.codes, args.days, args.seed, args.repeat, args.only)
+    print(format_results(suite), file=sys.stderr)
+    text = json.dumps(suite, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(suite, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"regression: {r['name']} {r['baseline_seconds']:.3f}s -> {r['seconds']:.3f}s "
+                  f"(x{r['ratio']:.2f})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+ベンチマーク用に、東証全体に近い規模・形式の合成データを作る
+
+列名と型はJ-Quants APIのレスポンス (get_data_with_jqapi.py で保存するCSV) に合わせる。
+財務情報の数値はAPIと同じく文字列で返す。乱数のシードが同じなら同じデータになる。
+"""
+import numpy as np
+import pandas as pd
+
+START_DATE = "2022-01-04"
+
+SECTOR33_CODES = [str(code) for code in range(50, 9100, 50)][:33]
+MARKET_CODES = ["0111", "0112", "0113"]  # プライム / スタンダード / グロース
+SECTIONS = ["TSEPrime", "TSEStandard", "TSEGrowth"]
+
+NAME_PREFIXES = ["トヨタ", "日本", "東京", "三菱", "住友", "大和", "関西", "北海道", "ソニー", "アサヒ",
+                 "キリン", "富士", "日立", "新日本", "中央", "第一", "エヌ・ティ・ティ", "ヤマト", "セブン", "イオン"]
+NAME_SUFFIXES = ["自動車", "銀行", "電機", "商事", "製薬", "建設", "化学", "不動産", "証券", "食品",
+                 "ホールディングス", "システム", "工業", "物産", "電力", "運輸", "精機", "通信", "鉄鋼", "興産"]
+ENGLISH_PREFIXES = ["Toyota", "Nippon", "Tokyo", "Mitsubishi", "Sumitomo", "Daiwa", "Kansai", "Hokkaido", "Sony",
+                    "Asahi", "Kirin", "Fuji", "Hitachi", "Shin Nippon", "Chuo", "Daiichi", "NTT", "Yamato", "Seven",
+                    "Aeon"]
+ENGLISH_SUFFIXES = ["Motor", "Bank", "Electric", "Trading", "Pharmaceutical", "Construction", "Chemical", "Realty",
+                    "Securities", "Foods", "Holdings", "Systems", "Industries", "Bussan", "Power", "Transport",
+                    "Precision", "Telecom", "Steel", "Kosan"]
+
+
+def make_codes(codes: int, seed: int = 0) -> np.ndarray:
+    """5桁 (4桁 + 末尾0) の銘柄コードを昇順で返す"""
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(np.arange(1300, 10000), size=codes, replace=False)) * 10
+
+
+def make_listed_info(codes: np.ndarray, seed: int = 0) -> pd.DataFrame:
+    """上場銘柄一覧 (/listed/info)"""
+    rng = np.random.default_rng(seed)
+    n = len(codes)
+    prefix, suffix = rng.integers(0, len(NAME_PREFIXES), n), rng.integers(0, len(NAME_SUFFIXES), n)
+    # 同じ社名にならないよう通し番号を付ける
+    names = [f"{NAME_PREFIXES[p]}{NAME_SUFFIXES[s]}{i}" for i, (p, s) in enumerate(zip(prefix, suffix))]
+    english = [f"{ENGLISH_PREFIXES[p]} {ENGLISH_SUFFIXES[s]} {i} Co.,Ltd." for i, (p, s) in enumerate(zip(prefix, suffix))]
+    return pd.DataFrame({
+        "Date": START_DATE,
+        "Code": codes.astype(str),
+        "CompanyName": names,
+        "CompanyNameEnglish": english,
+        "Sector17Code": rng.integers(1, 18, n).astype(str),
+        "Sector33Code": rng.choice(SECTOR33_CODES, n),
+        "MarketCode": rng.choice(MARKET_CODES, n, p=[0.45, 0.4, 0.15]),
+        "ScaleCategory": rng.choice(["TOPIX Core30", "TOPIX Mid400", "TOPIX Small 1", "-"], n),
+    })
+
+
+def make_daily_quotes(codes: np.ndarray, days: int, seed: int = 0) -> pd.DataFrame:
+    """
+    日次株価 (/prices/daily_quotes)
+
+    日付ごとに全銘柄が並ぶ (日付指定で取得した場合と同じ並び)。1割の銘柄は期間の途中で上場し、
+    売買が成立しなかった日は四本値が欠損・出来高0になる。
+    """
+    rng = np.random.default_rng(seed)
+    n = len(codes)
+    dates = pd.bdate_range(START_DATE, periods=days).strftime("%Y-%m-%d")
+    close = rng.lognormal(7, 1, n) * np.exp(np.cumsum(rng.normal(0, 0.02, (days, n)), axis=0))
+    open_ = close * np.exp(rng.normal(0, 0.01, close.shape))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.02, close.shape))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.02, close.shape))
+    volume = np.round(rng.lognormal(11, 1.5, close.shape), -2)
+
+    no_trade = rng.random(close.shape) < 0.005
+    for array in (open_, high, low, close):
+        array[no_trade] = np.nan
+    volume[no_trade] = 0
+
+    df = pd.DataFrame({
+        "Date": np.repeat(dates, n),
+        "Code": np.tile(codes, days),
+        "Open": open_.ravel(),
+        "High": high.ravel(),
+        "Low": low.ravel(),
+        "Close": close.ravel(),
+        "Volume": volume.ravel(),
+        "TurnoverValue": (close * volume).ravel(),
+        "AdjustmentFactor": 1.0,
+    })
+    for col in ("Open", "High", "Low", "Close", "Volume"):
+        df[f"Adjustment{col}"] = df[col]
+
+    listed_from = np.where(rng.random(n) < 0.1, rng.integers(0, days, n), 0)
+    listed = np.arange(days)[:, None] >= listed_from[None, :]
+    return df[listed.ravel()].reset_index(drop=True)
+
+
+def _weekly_dates(days: int) -> pd.Index:
+    dates = pd.bdate_range(START_DATE, periods=days)
+    return dates[dates.dayofweek == 4].strftime("%Y-%m-%d")
+
+
+def make_statements(codes: np.ndarray, days: int, seed: int = 0) -> pd.DataFrame:
+    """決算短信 (/fins/statements)。各銘柄が四半期ごとに開示する"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(START_DATE, periods=days).strftime("%Y-%m-%d")
+    quarter = 63
+    offsets = rng.integers(0, quarter, len(codes))
+    code_idx, date_idx = [], []
+    for i, offset in enumerate(offsets):
+        positions = np.arange(offset, days, quarter)
+        code_idx.append(np.full(len(positions), i))
+        date_idx.append(positions)
+    code_idx, date_idx = np.concatenate(code_idx), np.concatenate(date_idx)
+    n = len(code_idx)
+
+    net_sales = rng.lognormal(10, 1.5, n) * 1e6
+    operating_profit = net_sales * rng.normal(0.08, 0.06, n)
+    equity_ratio = rng.uniform(0.1, 0.8, n)
+    total_assets = net_sales * rng.uniform(0.5, 3, n)
+    shares = rng.lognormal(17, 1, n)
+    df = pd.DataFrame({
+        "DisclosedDate": dates[date_idx],
+        "LocalCode": codes[code_idx].astype(str),
+        "TypeOfDocument": rng.choice(["FYFinancialStatements_Consolidated_JP",
+                                      "1QFinancialStatements_Consolidated_JP"], n),
+        "TypeOfCurrentPeriod": rng.choice(["FY", "1Q", "2Q", "3Q"], n),
+        "NetSales": net_sales,
+        "OperatingProfit": operating_profit,
+        "OrdinaryProfit": operating_profit * rng.uniform(0.9, 1.1, n),
+        "Profit": operating_profit * 0.7,
+        "EarningsPerShare": operating_profit * 0.7 / shares,
+        "BookValuePerShare": total_assets * equity_ratio / shares,
+        "TotalAssets": total_assets,
+        "Equity": total_assets * equity_ratio,
+        "EquityToAssetRatio": equity_ratio * 100,
+    })
+    numeric = df.columns[4:]
+    df[numeric] = df[numeric].round(2).astype(str)
+    return df.sort_values("DisclosedDate", kind="stable").reset_index(drop=True)
+
+
+def make_margin_interest(codes: np.ndarray, days: int, seed: int = 0) -> pd.DataFrame:
+    """信用取引週末残高 (/markets/weekly_margin_interest)"""
+    rng = np.random.default_rng(seed)
+    weeks = _weekly_dates(days)
+    shape = (len(weeks), len(codes))
+    long_margin = rng.lognormal(11, 1.5, len(codes)) * np.exp(np.cumsum(rng.normal(0, 0.15, shape), axis=0))
+    short_margin = long_margin * rng.uniform(0.05, 0.6, shape)
+    return pd.DataFrame({
+        "Date": np.repeat(weeks, len(codes)),
+        "Code": np.tile(codes, len(weeks)),
+        "ShortMarginTradeVolume": np.round(short_margin.ravel(), -2),
+        "LongMarginTradeVolume": np.round(long_margin.ravel(), -2),
+        "ShortNegotiableMarginTradeVolume": np.round(short_margin.ravel() * 0.3, -2),
+        "LongNegotiableMarginTradeVolume": np.round(long_margin.ravel() * 0.2, -2),
+        "ShortStandardizedMarginTradeVolume": np.round(short_margin.ravel() * 0.7, -2),
+        "LongStandardizedMarginTradeVolume": np.round(long_margin.ravel() * 0.8, -2),
+        "IssueType": "2",
+    })
+
+
+def make_short_selling_positions(codes: np.ndarray, days: int, seed: int = 0) -> pd.DataFrame:
+    """空売り残高 (/markets/short_selling_positions)。4分の1の銘柄に毎週の報告がある"""
+    rng = np.random.default_rng(seed)
+    weeks = _weekly_dates(days)
+    reported = codes[rng.random(len(codes)) < 0.25]
+    shape = (len(weeks), len(reported))
+    ratio = rng.uniform(0.005, 0.02, len(reported)) * np.exp(np.cumsum(rng.normal(0, 0.3, shape), axis=0))
+    return pd.DataFrame({
+        "DisclosedDate": np.repeat(weeks, len(reported)),
+        "CalculatedDate": np.repeat(weeks, len(reported)),
+        "Code": np.tile(reported, len(weeks)),
+        "ShortSellerName": rng.choice(["Goldman Sachs International", "Morgan Stanley & Co. International plc",
+                                       "Merrill Lynch International"], ratio.size),
+        "ShortPositionsToSharesOutstandingRatio": ratio.ravel(),
+        "ShortPositionsInSharesNumber": np.round(ratio.ravel() * 1e8, -2),
+    })
+
+
+def make_trades_spec(days: int, seed: int = 0) -> pd.DataFrame:
+    """投資部門別売買状況 (/markets/trades_spec)。市場区分ごとの週次データ"""
+    rng = np.random.default_rng(seed)
+    weeks = _weekly_dates(days)
+    n = len(weeks) * len(SECTIONS)
+    sales, purchases = rng.lognormal(27, 0.3, n), rng.lognormal(27, 0.3, n)
+    return pd.DataFrame({
+        "PublishedDate": np.repeat(weeks, len(SECTIONS)),
+        "Section": np.tile(SECTIONS, len(weeks)),
+        "ForeignersSales": sales,
+        "ForeignersPurchases": purchases,
+        "ForeignersTotal": sales + purchases,
+        "ForeignersBalance": purchases - sales,
+    })
+
+
+def make_datasets(codes: int = 4000, days: int = 500, seed: int = 0) -> dict[str, pd.DataFrame]:
+    """
+    ベンチマークで使う全データセットを作る
+
+    Args:
+        codes (int, optional): 銘柄数. Defaults to 4000 (東証の上場銘柄数程度).
+        days (int, optional): 営業日数. Defaults to 500 (約2年).
+        seed (int, optional): 乱数のシード. Defaults to 0.
+
+    Returns:
+        dict[str, pd.DataFrame]: データセット名 (get_data_with_jqapi.py のCSV名) -> データ
+    """
+    code_list = make_codes(codes, seed)
+    return {
+        "stock_list": make_listed_info(code_list, seed),
+        "stock_price": make_daily_quotes(code_list, days, seed),
+        "stock_fin": make_statements(code_list, days, seed),
+        "margin_interest": make_margin_interest(code_list, days, seed),
+        "short_selling": make_short_selling_positions(code_list, days, seed),
+        "markets_trades_spec": make_trades_spec(days, seed),
+    }
@@ -0,0 +1,234 @@
+from typing import Any, Iterator
+
+import pandas as pd
+
+# 保存先のDB (SQLAlchemyのURL)。get_data_with_jqapi.py で使う
+DB_URL_ENV = "JQUANTS_DB_URL"
+
+# テーブルごとに、読み込み後に作成する索引の列 (銘柄コード, 日付)
+INDEX_COLUMNS = {
+    "stock_price": ["Code", "Date"],
+    "stock_fin": ["LocalCode", "DisclosedDate"],
+    "markets_trades_spec": ["Section", "PublishedDate"],
+    "topix": ["Date"],
+    "option": ["Code", "Date"],
+    "margin_interest": ["Code", "Date"],
+    "short_selling": ["Sector33Code", "Date"],
+    "stock_list": ["Code"],
+}
+
+# 1回に送る行数 (COPYのCSVやexecutemanyを作るときに、全行を一度に文字列・タプルにしない)
+CHUNK_ROWS = 50_000
+
+# COPYのCSVで欠損を表す文字列 (空文字と区別するため)
+COPY_NULL = "\\N"
+
+
+def _to_pandas(df: Any) -> pd.DataFrame:
+    return df.to_pandas() if hasattr(df, "to_pandas") else df
+
+
+def _is_date_only(series: pd.Series) -> bool:
+    values = series.dropna()
+    return bool((values == values.dt.normalize()).all())
+
+
+def column_types(df: pd.DataFrame, dialect: str) -> dict[str, str]:
+    """
+    DataFrameの列の型からCREATE TABLEの型を決める
+
+    時刻を含まない日時の列はDATE、それ以外の日時はTIMESTAMPにする。
+    """
+    double = "DOUBLE PRECISION" if dialect == "postgresql" else "DOUBLE"
+    types = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            types[col] = "BOOLEAN"
+        elif pd.api.types.is_integer_dtype(series):
+            types[col] = "BIGINT"
+        elif pd.api.types.is_float_dtype(series):
+            types[col] = double if dialect != "sqlite" else "REAL"
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            types[col] = "DATE" if _is_date_only(series) else "TIMESTAMP"
+        else:
+            types[col] = "TEXT"
+    return types
+
+
+def _quote(conn: Any, name: str) -> str:
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def _create_table(df: pd.DataFrame, table: str, conn: Any) -> None:
+    from sqlalchemy import text
+
+    types = column_types(df, conn.dialect.name)
+    columns = ", ".join(f"{_quote(conn, col)} {types[col]}" for col in df.columns)
+    conn.execute(text(f"CREATE TABLE {_quote(conn, table)} ({columns})"))
+
+
+def create_index(table: str, conn: Any, columns: list[str] | None = None) -> None:
+    """
+    テーブルに索引を作成する (既にあれば何もしない)
+
+    Args:
+        table (str): テーブル名
+        conn (Any): SQLAlchemyのConnection
+        columns (list[str] | None, optional): 索引の列. Noneの場合は INDEX_COLUMNS の定義を使う (なければ作成しない)
+    """
+    from sqlalchemy import text
+
+    columns = INDEX_COLUMNS.get(table) if columns is None else columns
+    if not columns:
+        return
+    name = _quote(conn, f"ix_{table}_{'_'.join(columns).lower()}")
+    column_list = ", ".join(_quote(conn, col) for col in columns)
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {_quote(conn, table)} ({column_list})"))
+
+
+def iter_csv_chunks(df: pd.DataFrame, chunk_rows: int = CHUNK_ROWS) -> Iterator[str]:
+    """COPY ... FROM STDIN (FORMAT csv) に送るCSVを、chunk_rows行ずつの文字列で返す (ヘッダーなし)"""
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(index=False, header=False, na_rep=COPY_NULL, date_format="%Y-%m-%d %H:%M:%S")
+
+
+class CsvStream:
+    """iter_csv_chunks をファイルのように read(size) で読めるようにする (psycopg2の copy_expert 用)"""
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def copy_from_stdin(raw_connection: Any, table: str, df: pd.DataFrame, quote: Any = None,
+                    chunk_rows: int = CHUNK_ROWS) -> None:
+    """
+    PostgreSQLの COPY FROM STDIN でdfを読み込む (psycopg2 / psycopg 3)
+
+    CSVはchunk_rows行ずつ作って送るので、全行分の文字列を一度に作らない。
+    """
+    quote = quote or (lambda name: '"' + name.replace('"', '""') + '"')
+    columns = ", ".join(quote(col) for col in df.columns)
+    sql = f"COPY {quote(table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    cursor = raw_connection.cursor()
+    try:
+        if hasattr(cursor, "copy_expert"):  # psycopg2
+            cursor.copy_expert(sql, CsvStream(iter_csv_chunks(df, chunk_rows)))
+        else:  # psycopg 3
+            with cursor.copy(sql) as copy:
+                for chunk in iter_csv_chunks(df, chunk_rows):
+                    copy.write(chunk)
+    finally:
+        cursor.close()
+
+
+def _sqlite_value_frame(df: pd.DataFrame) -> pd.DataFrame:
+    # sqlite3は日時型を変換しないため、日付は YYYY-MM-DD、日時は ISO 形式の文字列にする
+    converted = {}
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            fmt = "%Y-%m-%d" if _is_date_only(df[col]) else "%Y-%m-%d %H:%M:%S"
+            converted[col] = df[col].dt.strftime(fmt)
+    return df.assign(**converted) if converted else df
+
+
+def _insert_executemany(df: pd.DataFrame, table: str, conn: Any, chunk_rows: int) -> None:
+    """SQLite: 1つのINSERT文をchunk_rows行ずつexecutemanyで実行する"""
+    df = _sqlite_value_frame(df)
+    columns = ", ".join(_quote(conn, col) for col in df.columns)
+    sql = f"INSERT INTO {_quote(conn, table)} ({columns}) VALUES ({', '.join('?' * len(df.columns))})"
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            rows = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+            cursor.executemany(sql, rows)
+    finally:
+        cursor.close()
+
+
+def _insert_duckdb(df: pd.DataFrame, table: str, conn: Any) -> None:
+    """DuckDB: DataFrameを登録して INSERT ... SELECT で一括で読み込む"""
+    raw = conn.connection.dbapi_connection
+    view = "_bulk_writer_source"
+    raw.register(view, df)
+    try:
+        columns = ", ".join(_quote(conn, col) for col in df.columns)
+        raw.execute(f"INSERT INTO {_quote(conn, table)} ({columns}) SELECT {columns} FROM {view}")
+    finally:
+        raw.unregister(view)
+
+
+def write_table(
+    df: Any,
+    table: str,
+    connectable: Any,
+    if_exists: str = "append",
+    index_columns: list[str] | None = None,
+    chunk_rows: int = CHUNK_ROWS,
+) -> int:
+    """
+    DataFrameをDBのテーブルに一括で書き込む
+
+    PostgreSQLは COPY FROM STDIN (CSV)、SQLiteはexecutemany、DuckDBはDataFrameから直接
+    INSERT ... SELECT で読み込む。それ以外のDBは to_sql で書き込む。
+    テーブルがなければ列の型を決めて作成し、索引は行を読み込んだ後に作成する。
+
+    Args:
+        df (Any): pandasまたはpolarsのDataFrame
+        table (str): テーブル名
+        connectable (Any): SQLAlchemyのEngineまたはConnection (Connectionの場合は呼び出し側のトランザクションで書き込む)
+        if_exists (str, optional): "append" (既存のテーブルに追加) または "replace" (作り直す). Defaults to "append".
+        index_columns (list[str] | None, optional): 索引の列. Noneの場合は INDEX_COLUMNS の定義を使う
+            (空のリストの場合は作成しない。複数回に分けて書き込む場合は最後に create_index を呼ぶ)
+        chunk_rows (int, optional): 1回に送る行数. Defaults to CHUNK_ROWS.
+
+    Returns:
+        int: 書き込んだ行数
+    """
+    from sqlalchemy import Engine, inspect, text
+
+    if if_exists not in ("append", "replace"):
+        raise ValueError(f"if_existsには append または replace を指定してください: {if_exists}")
+    if isinstance(connectable, Engine):
+        with connectable.begin() as conn:
+            return write_table(df, table, conn, if_exists, index_columns, chunk_rows)
+    conn = connectable
+    df = _to_pandas(df)
+
+    exists = inspect(conn).has_table(table)
+    if exists and if_exists == "replace":
+        conn.execute(text(f"DROP TABLE {_quote(conn, table)}"))
+        exists = False
+    if not exists:
+        _create_table(df, table, conn)
+
+    if len(df):
+        dialect = conn.dialect.name
+        if dialect == "postgresql":
+            copy_from_stdin(conn.connection.dbapi_connection, table, df,
+                            quote=lambda name: _quote(conn, name), chunk_rows=chunk_rows)
+        elif dialect == "sqlite":
+            _insert_executemany(df, table, conn, chunk_rows)
+        elif dialect == "duckdb":
+            _insert_duckdb(df, table, conn)
+        else:
+            df.to_sql(table, con=conn, if_exists="append", index=False, method="multi", chunksize=1000)
+
+    columns = INDEX_COLUMNS.get(table, []) if index_columns is None else index_columns
+    if columns and all(col in df.columns for col in columns):
+        create_index(table, conn, columns)
+    return len(df)
@@ -5,9 +5,10 @@ from requests import HTTPError
 import requests
 import json
 import numpy as np
-from tqdm import tqdm
 from pathlib import Path
 
+from jquants_free_mcp_server.indicators import add_indicators, compute_indicators
+
 # 将来のダウンキャスト挙動を明示的に有効化
 pd.set_option('future.no_silent_downcasting', True)
 
@@ -37,98 +38,223 @@ STR_KAIDAN_DAYS = "HigherLowDays"
 STR_HIGHER_VOL_DATE = "HighVolumeDates"
 
 
-def add_ma_dev_rate(df, short=25, middle=75, long=200):
-    """ 移動平均および乖離率、パーフェクトオーダーかどうかをメトリクスとして追加する。 """
-    df[f"SMA{short}"] = df[CLOSE_COL].rolling(window=short).mean()
-    df[f"SMA{middle}"] = df[CLOSE_COL].rolling(window=middle).mean()
-    df[f"SMA{long}"] = df[CLOSE_COL].rolling(window=long).mean()
+# add_stock_metrics で使う日数
+SHORT_DAYS = 5
+MIDDLE_DAYS = 25
+LONG_DAYS = 75
+DAYS_OF_TARGET = 30
+
+
+def _rolling_mean(df, col, window, by=None):
+    """ 移動平均を計算する。byを指定した場合は銘柄などのグループごとに計算する。 """
+    means = compute_indicators(df, {"sma": [window]}, by, close_col=col)
+    return pd.Series(means[f"SMA{window}"], index=df.index)
+
 
-    # 移動平均線乖離率
-    df[f"SMA{short}_乖離率"] = (df[CLOSE_COL] - df[f"SMA{short}"]) / df[f"SMA{short}"] * 100
-    df[f"SMA{middle}_乖離率"] = (df[CLOSE_COL] - df[f"SMA{middle}"]) / df[f"SMA{middle}"] * 100
-    df[f"SMA{long}_乖離率"] = (df[CLOSE_COL] - df[f"SMA{long}"]) / df[f"SMA{long}"] * 100
+def add_ma_dev_rate(df, short=25, middle=75, long=200, by=None):
+    """ 移動平均および乖離率、パーフェクトオーダーかどうかをメトリクスとして追加する。
 
-    df["PerfectOrder"] = np.where((df[f"SMA{short}"] > df[f"SMA{middle}"]) &
-                                  (df[f"SMA{middle}"] > df[f"SMA{long}"]), 1, 0)
+    3本の移動平均は終値の累積和を1回だけ作って求める (indicators.compute_indicators)。
+    """
+    windows = [short, middle, long]
+    add_indicators(df, {"sma": windows, "deviation": windows, "perfect_order": windows}, by, close_col=CLOSE_COL)
 
 
-def add_metrics_kaidan(stock_df, days):  # 230510追加
+def add_metrics_kaidan(stock_df, days, by=None):  # 230510追加
     # 前日の安値より当日の安値のほうが高い日数を計算する(前日の安値が数値として存在しない場合は前日安値でfillする)
-    stock_df[LOW_COL] = stock_df[LOW_COL].ffill()  # 修正: fillna(method="ffill") を ffill() に変更
-    stock_df["HigherLowDays"] = (stock_df[LOW_COL] >= stock_df[LOW_COL].shift(1)).cumsum()
+    if by is None:
+        stock_df[LOW_COL] = stock_df[LOW_COL].ffill()  # 修正: fillna(method="ffill") を ffill() に変更
+        stock_df["HigherLowDays"] = (stock_df[LOW_COL] >= stock_df[LOW_COL].shift(1)).cumsum()
+    else:
+        grouped = stock_df.groupby(by, sort=False)
+        stock_df[LOW_COL] = grouped[LOW_COL].ffill()
+        higher_low = stock_df[LOW_COL] >= stock_df.groupby(by, sort=False)[LOW_COL].shift(1)
+        stock_df["HigherLowDays"] = higher_low.groupby(stock_df[by], sort=False).cumsum()
     # 指定した日数の出来高の平均値のX倍が発生した時の日付を格納する
-    volume_mean = stock_df[VOLUME_COL].rolling(days).mean()
+    volume_mean = _rolling_mean(stock_df, VOLUME_COL, days, by)
     X = 5  # ここでXの値を設定する
     stock_df["HighVolumeDates"] = stock_df["Date"].where(stock_df["AdjustmentVolume"] >= volume_mean * X)
-    stock_df["HighVolumeDates"] = stock_df["HighVolumeDates"].ffill()  # 修正: infer_objectsを削除
+    if by is None:
+        stock_df["HighVolumeDates"] = stock_df["HighVolumeDates"].ffill()  # 修正: infer_objectsを削除
+    else:
+        stock_df["HighVolumeDates"] = stock_df.groupby(by, sort=False)["HighVolumeDates"].ffill()
     # メトリクスを追加した新しいDataFrameを作る
     new_df = stock_df.copy()
     return new_df
 
 
-def add_stock_metrics(df):
-    """ 全銘柄分に、メトリクスを追加して結合していく。"""
-    sc_list = df[RAW_STOCK_CODE].unique()
-    concat_df = pd.DataFrame([], columns=df.columns)
-    SHORT_DAYS = 5
-    for sc in tqdm(sc_list):
-
-        # if int(sc) / 10 > 1500:  # テスト的に一部銘柄コードのデータだけ動かしたいときの処理
-        #     break
-        df_filter = df.query(f"{RAW_STOCK_CODE} == @sc").copy()
-        add_ma_dev_rate(df_filter, short=SHORT_DAYS, middle=25, long=75)  # 5,25,75のパーフェクトオーダを算出する
-        DAYS_OF_TARGET = 30
-        if len(df_filter):
-            pass
-        else:
-            print(f"データ:{df_filter}は空です, {type(df_filter)}")
-            # continue()
-        tmp_df = add_metrics_kaidan(df_filter, DAYS_OF_TARGET)  # 階段チャート状態のものを確認ver.1
-        tmp_df = SMA_over(tmp_df, SHORT_DAYS)  # 5日移動平均を上回るかどうか
+def sort_by_code(df):
+    """ 銘柄の出現順に行を並べ替えたコピーを返す(銘柄内の行順とindexは元のまま)。 """
+    # factorizeのコードは出現順 (categorical型の列でもカテゴリの並びではなく出現順になる)
+    codes, _ = pd.factorize(df[RAW_STOCK_CODE])
+    return df.iloc[np.argsort(codes, kind="stable")].copy()
 
-        # 空でないデータフレームのみ結合
-        if not tmp_df.empty:
-            concat_df = pd.concat([concat_df, tmp_df])
 
-    return concat_df
+def add_stock_metrics(df, distance="index"):
+    """ 全銘柄分に、メトリクスを追加する。
 
+    銘柄ごとに行を抜き出して結合し直すのではなく、銘柄の出現順に一度だけ並べ替えてから
+    グループ単位のrolling/ffill/cumsumでまとめて計算する(各行のindexは元のまま)。
+    distanceはterms_SMA_overの数え方 ("index" または "trading_days")。
+    """
+    df = sort_by_code(df)
 
-def SMA_over(df_stock, n):
+    add_ma_dev_rate(df, short=SHORT_DAYS, middle=MIDDLE_DAYS, long=LONG_DAYS, by=RAW_STOCK_CODE)  # 5,25,75のパーフェクトオーダを算出する
+    df = add_metrics_kaidan(df, DAYS_OF_TARGET, by=RAW_STOCK_CODE)  # 階段チャート状態のものを確認ver.1
+    df = SMA_over(df, SHORT_DAYS, by=RAW_STOCK_CODE, distance=distance)  # 5日移動平均を上回るかどうか
+    return df
 
-    # 経過日数を計算
-    def get_days(x):
-        # xよりも前の日付でis_tanki_SMA_overが1となるものが存在するかどうかをチェック
-        if dates_SMA_over[dates_SMA_over <= x].size > 0:
-            # 存在する場合は、その最後の日付との差分を返す
-            # return (x - dates_SMA_over[dates_SMA_over <= x][-1]).days
-            return (x - dates_SMA_over[dates_SMA_over <= x][-1])
+
+# terms_SMA_over の距離の数え方 (index: 行ラベルの差 / trading_days: 銘柄内の行数の差)
+SMA_OVER_DISTANCES = ("index", "trading_days")
+
+
+def _terms_SMA_over(df_stock, distance="index", by=None):
+    """ 各行について、直近でSMAを上回った行からの距離を返す(なければNaN)。
+
+    上回った行の位置を前方埋め(ffill)するだけなので行数に対して線形。
+    行は銘柄内で日付順(index昇順)に並んでいる前提。
+    """
+    if distance == "index":
+        position = pd.Series(df_stock.index.astype("int"), index=df_stock.index, dtype=float)
+    elif distance == "trading_days":
+        if by is None:
+            position = pd.Series(np.arange(len(df_stock), dtype=float), index=df_stock.index)
         else:
-            # 存在しない場合は、Noneを返す
-            return None
+            position = df_stock.groupby(by, sort=False).cumcount().astype(float)
+    else:
+        raise ValueError(f"distanceは {SMA_OVER_DISTANCES} のいずれかを指定してください: {distance}")
+
+    # is_tanki_SMA_overが1となる行の位置を、次に1となる行まで引き継ぐ
+    last_over = position.where(df_stock['is_tanki_SMA_over'] == 1)
+    if by is None:
+        last_over = last_over.ffill()
+    else:
+        last_over = last_over.groupby(df_stock[by], sort=False).ffill()
+    return position - last_over
+
+
+def SMA_over(df_stock, n, by=None, distance="index"):
 
     # n日の移動平均を計算
-    df_stock['tanki_SMA'] = df_stock[CLOSE_COL].rolling(n).mean()
+    df_stock['tanki_SMA'] = _rolling_mean(df_stock, CLOSE_COL, n, by)
 
     # closeが移動平均より上回っているかどうかを判定
     df_stock['is_tanki_SMA_over'] = (df_stock[CLOSE_COL] > df_stock['tanki_SMA']).astype(int)
 
-    # is_tanki_SMA_overが1となる日付(index)を取得
-    dates_SMA_over = df_stock.index[df_stock['is_tanki_SMA_over'] == 1]
-
-    # dates_SMA_overをint型に変換
-    dates_SMA_over = dates_SMA_over.astype('int')
-    # # dates_SMA_overをdatetime型に変換
-    # dates_SMA_over = pd.to_datetime(dates_SMA_over)
-
     # 経過日数を計算
-    # df_stock['terms_SMA_over'] = df_stock.index.to_series().apply(lambda x: (x - dates_SMA_over[dates_SMA_over <= x][-1]).days)
-    df_stock['terms_SMA_over'] = df_stock.index.to_series().apply(get_days)
+    df_stock['terms_SMA_over'] = _terms_SMA_over(df_stock, distance, by)
     return df_stock
 
+
+# add_stock_metrics の実装 (pandas: 本モジュール / polars: metrics_polars の遅延評価版)
+METRICS_BACKENDS = ("pandas", "polars")
+
+# 株価の保存形式 (csv: data/stock_price.csv / parquet: data/parquet/stock_price)
+STORAGE_FORMATS = ("csv", "parquet")
+
+# Parquetから読み込む列 (メトリクスの計算に使う列だけを読む)
+PRICE_INPUT_COLUMNS = ["Date", RAW_STOCK_CODE, OPEN_COL, HIGH_COL, LOW_COL, CLOSE_COL, VOLUME_COL]
+
+
+def load_stock_prices(price_path):
+    """ 株価を読み込む。price_pathがディレクトリの場合はParquetデータセットとして読み込む。 """
+    price_path = Path(price_path)
+    if not price_path.is_dir():
+        return pd.read_csv(price_path, dtype={'user_id': int})
+
+    from jquants_free_mcp_server import parquet_storage
+    df = parquet_storage.read_dataset(price_path.name, columns=PRICE_INPUT_COLUMNS, root=price_path.parent)
+    # 保存時はfloat32だが、計算はCSVから読み込んだ場合と同じくfloat64で行う
+    return df.astype({col: "float64" for col in PRICE_INPUT_COLUMNS[2:]})
+
+
+def calc_stock_metrics_file(price_path, backend="pandas", distance="index", workers=1):
+    """ 株価(CSVまたはParquetデータセット)を読み込み、メトリクスを追加したpandas.DataFrameを返す。
+
+    pandas版はworkersに2以上 (0はCPU数) を指定すると、銘柄単位に分けてプロセスプールで計算する。
+    """
+    if backend == "pandas":
+        df = load_stock_prices(price_path)
+        if workers != 1:
+            from jquants_free_mcp_server.metrics_parallel import run_per_code_parallel
+            return run_per_code_parallel(df, workers=workers, distance=distance)
+        return add_stock_metrics(df, distance=distance)
+    if backend == "polars":
+        from jquants_free_mcp_server import metrics_polars
+        lf = metrics_polars.add_stock_metrics(metrics_polars.scan_stock_prices(price_path), distance=distance)
+        return metrics_polars.to_pandas(lf.collect())
+    raise ValueError(f"backendは {METRICS_BACKENDS} のいずれかを指定してください: {backend}")
+
+
 if __name__ == '__main__':
-    # 指標追加(株価データを読み込んで列追加する)
-    df_p = pd.read_csv(STOCK_PRICE_FILENAME, dtype={'user_id': int})
+    import argparse
+
+    parser = argparse.ArgumentParser(description="株価データにメトリクスを追加する")
+    parser.add_argument("--backend", choices=METRICS_BACKENDS, default="pandas")
+    parser.add_argument("--distance", choices=SMA_OVER_DISTANCES, default="index")
+    parser.add_argument("--verify", action="store_true", help="polars版の結果をpandas版と突き合わせる")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="pandas版の並列プロセス数 (0: METRICS_WORKERS環境変数またはCPU数)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回からの追加分だけを計算して結果に追記する (pandas・CSVのみ)")
+    parser.add_argument("--storage", choices=STORAGE_FORMATS, default="csv",
+                        help="株価の読み込み元と結果の保存形式")
+    parser.add_argument("--streaming", action="store_true",
+                        help="株価を全件メモリに載せず、銘柄のグループごとに計算して書き出す (pandasのみ)")
+    parser.add_argument("--memory-limit-mb", type=float, default=512,
+                        help="--streaming で1回に計算するデータのメモリ上限の目安 (MB)")
+    args = parser.parse_args()
+    if args.incremental and args.storage != "csv":
+        parser.error("--incremental はCSVのみ対応しています")
+    if args.streaming and (args.incremental or args.backend != "pandas"):
+        parser.error("--streaming はpandas版の全件計算でのみ使えます")
 
-    df_p = add_stock_metrics(df_p)
-    df_p.to_csv(DATA_PATH / Path("stock_metrics_result.csv"))
+    if args.storage == "parquet":
+        from jquants_free_mcp_server import parquet_storage
+        price_path = parquet_storage.PARQUET_PATH / "stock_price"
+    else:
+        price_path = STOCK_PRICE_FILENAME
+    result_path = DATA_PATH / Path("stock_metrics_result.csv")
+    state_path = DATA_PATH / Path("stock_metrics_state.pkl")
+    if args.streaming:
+        from jquants_free_mcp_server.metrics_streaming import stream_stock_metrics
 
+        output_path = result_path.with_suffix(".parquet") if args.storage == "parquet" else result_path
+        stats = stream_stock_metrics(price_path, output_path, memory_limit_mb=args.memory_limit_mb,
+                                     distance=args.distance)
+        state_path.unlink(missing_ok=True)
+        print(f"{stats['rows']}行を{stats['batches']}回に分けて計算しました: {output_path}")
+    elif args.incremental:
+        from jquants_free_mcp_server import metrics_incremental
+
+        state = metrics_incremental.load_state(state_path)
+        if state is not None and state["distance"] != args.distance:
+            parser.error(f"前回は --distance {state['distance']} で計算しています")
+        if state is not None and not metrics_incremental.state_matches(state, STOCK_PRICE_FILENAME):
+            # 処理済みの行が書き換えられている (直近の取り直し・--full-rebuild) ため、全件を計算し直す
+            print("株価データの処理済みの行が変更されているため、全件を再計算します")
+            state = None
+        df_new, position = metrics_incremental.read_new_prices(STOCK_PRICE_FILENAME, state)
+        df_p, state = metrics_incremental.update_stock_metrics(df_new, state, distance=args.distance)
+        state.update(position)
+        # 状態がない(初回)場合は結果を作り直す
+        append = state["rows"] > len(df_new)
+        df_p.to_csv(result_path, mode="a" if append else "w", header=not append)
+        metrics_incremental.save_state(state, state_path)
+        print(f"{len(df_new)}行を追加しました")
+    else:
+        # 指標追加(株価データを読み込んで列追加する)
+        df_p = calc_stock_metrics_file(price_path, backend=args.backend, distance=args.distance,
+                                       workers=args.workers)
+        if args.verify and args.backend != "pandas":
+            from jquants_free_mcp_server.metrics_polars import verify_against_pandas
+            verify_against_pandas(calc_stock_metrics_file(price_path, distance=args.distance), df_p)
+            print("pandas版の結果と一致しました")
+
+        if args.storage == "parquet":
+            parquet_storage.write_dataset(df_p, "stock_metrics")
+        else:
+            df_p.to_csv(result_path)
+        # 全件を計算し直したので、差分計算の状態は次回の --incremental で作り直す
+        state_path.unlink(missing_ok=True)
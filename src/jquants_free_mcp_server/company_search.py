@@ -0,0 +1,165 @@
+import unicodedata
+from datetime import datetime, time, timedelta, timezone
+from typing import Any
+
+JST = timezone(timedelta(hours=9))
+
+# 検索結果の順位 (小さいほど上位)
+RANK_CODE = 0
+RANK_EXACT = 1
+RANK_PREFIX = 2
+RANK_SUBSTRING = 3
+
+NAME_FIELDS = ("CompanyName", "CompanyNameEnglish")
+
+
+def normalize_text(text: str) -> str:
+    """
+    検索用に文字列を正規化する
+
+    全角/半角の統一 (NFKC)、小文字化、カタカナのひらがな化、空白除去を行う。
+
+    Args:
+        text (str): 正規化対象の文字列
+
+    Returns:
+        str: 正規化後の文字列
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    chars = []
+    for ch in text:
+        if ch.isspace():
+            continue
+        code = ord(ch)
+        # カタカナ(ァ-ヶ)をひらがなに寄せる
+        if 0x30A1 <= code <= 0x30F6:
+            ch = chr(code - 0x60)
+        chars.append(ch)
+    return "".join(chars)
+
+
+def _ngrams(text: str, n: int) -> set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def next_daily_refresh(now: datetime, refresh_time: time) -> datetime:
+    """
+    次の日次更新時刻 (JST) を返す
+
+    Args:
+        now (datetime): 基準時刻 (タイムゾーン付き)
+        refresh_time (time): 日次更新時刻 (JST)
+
+    Returns:
+        datetime: nowより後で最初の更新時刻
+    """
+    now_jst = now.astimezone(JST)
+    refresh = datetime.combine(now_jst.date(), refresh_time, tzinfo=JST)
+    if refresh <= now_jst:
+        refresh += timedelta(days=1)
+    return refresh
+
+
+class CompanySearchIndex:
+    """
+    上場銘柄一覧 (/v1/listed/info) の検索インデックス
+
+    銘柄コードの完全一致表と、正規化した社名 (日本語/英語) の
+    1文字・2文字インデックスを構築し、上流APIへ問い合わせずに検索する。
+    """
+
+    def __init__(self, records: list[dict[str, Any]], expires_at: datetime | None = None):
+        self.records = records
+        self.expires_at = expires_at
+        self._names: list[tuple[str, ...]] = []
+        self._codes: dict[str, int] = {}
+        self._unigrams: dict[str, set[int]] = {}
+        self._bigrams: dict[str, set[int]] = {}
+
+        for i, record in enumerate(records):
+            names = tuple(normalize_text(record.get(field, "")) for field in NAME_FIELDS)
+            self._names.append(names)
+
+            # クエリと同じ正規化をかける (英字を含むコード "130A0" なども一致させるため)
+            code = normalize_text(str(record.get("Code", "")))
+            if code:
+                self._codes.setdefault(code, i)
+                # 5桁コード末尾の0を省いた4桁コードでも引けるようにする
+                if len(code) == 5 and code.endswith("0"):
+                    self._codes.setdefault(code[:4], i)
+
+            for name in names:
+                for gram in _ngrams(name, 1):
+                    self._unigrams.setdefault(gram, set()).add(i)
+                for gram in _ngrams(name, 2):
+                    self._bigrams.setdefault(gram, set()).add(i)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def is_expired(self, now: datetime) -> bool:
+        """有効期限を過ぎているかどうか"""
+        return self.expires_at is not None and now >= self.expires_at
+
+    def _candidates(self, query: str) -> set[int]:
+        if len(query) == 1:
+            return self._unigrams.get(query, set())
+        postings = []
+        for gram in _ngrams(query, 2):
+            posting = self._bigrams.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        return set.intersection(*postings)
+
+    def _rank(self, i: int, query: str) -> tuple[int, int, int, int] | None:
+        best = None
+        for name in self._names[i]:
+            pos = name.find(query)
+            if pos < 0:
+                continue
+            if name == query:
+                rank = RANK_EXACT
+            elif pos == 0:
+                rank = RANK_PREFIX
+            else:
+                rank = RANK_SUBSTRING
+            key = (rank, pos, len(name), i)
+            if best is None or key < best:
+                best = key
+        return best
+
+    def search(self, query: str, limit: int = 10, start_position: int = 0) -> list[dict[str, Any]]:
+        """
+        銘柄コードまたは社名で検索し、関連度順に返す
+
+        順位: 銘柄コード完全一致 > 社名完全一致 > 前方一致 > 部分一致。
+        同順位では一致位置が前のもの、社名が短いもの、一覧の順に並べる。
+
+        Args:
+            query (str): 検索文字列
+            limit (int, optional): 最大件数. Defaults to 10.
+            start_position (int, optional): 開始位置. Defaults to 0.
+
+        Returns:
+            list[dict[str, Any]]: 一致した銘柄情報
+        """
+        normalized = normalize_text(query)
+        if not normalized:
+            return []
+
+        ranked = []
+        code_hit = self._codes.get(normalized)
+        if code_hit is not None:
+            ranked.append((RANK_CODE, 0, 0, code_hit))
+
+        for i in self._candidates(normalized):
+            if i == code_hit:
+                continue
+            key = self._rank(i, normalized)
+            if key is not None:
+                ranked.append(key)
+
+        ranked.sort()
+        return [self.records[key[3]] for key in ranked[start_position:start_position + limit]]
@@ -0,0 +1,24 @@
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+
+class CustomMetricBase(ABC):
+    """
+    カスタム指標 (シグナル) の基底クラス
+
+    サブクラスは calculate を実装し、モジュールにはクラス名をスネークケースにした
+    変数名でインスタンスをエクスポートする (例: credit_reverse_signal = CreditReverseSignal())。
+    """
+
+    @abstractmethod
+    def calculate(self, df: pd.DataFrame) -> pd.Series:
+        """
+        シグナルを計算する
+
+        Args:
+            df (pd.DataFrame): 計算に使うデータ (必要な列はサブクラスのdocstringを参照)
+
+        Returns:
+            pd.Series: dfと同じindexのシグナル (+1: 買い, -1: 売り, 0: なし)
+        """
@@ -1,4 +1,4 @@
-from mcp_server.custom_metrics.base import CustomMetricBase
+from jquants_free_mcp_server.custom_metrics.base import CustomMetricBase
 import pandas as pd
 
 class ForeignersFlowSignal(CustomMetricBase):
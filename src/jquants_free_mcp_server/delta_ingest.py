@@ -0,0 +1,283 @@
+import json
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable
+
+import pandas as pd
+
+from jquants_free_mcp_server import bulk_writer, parquet_storage
+
+# データセットごとの取得済みの最終日 (ハイウォーターマーク) の保存先
+WATERMARKS_PATH = Path("data") / Path("watermarks.json")
+
+# 期間を指定して取得するデータセットと、その期間の基準になる日付列
+DATASET_DATE_COLUMNS = {
+    "stock_price": "Date",
+    "stock_fin": "DisclosedDate",
+    "markets_trades_spec": "PublishedDate",
+    "topix": "Date",
+    "option": "Date",
+    "margin_interest": "Date",
+    "short_selling": "Date",
+}
+
+# 前回の最終日より何日前から取り直すか。週次のデータ (信用取引残高・投資部門別) は
+# 翌週に公表され、訂正が入ることもあるため、直近の1週間分は毎回置き換える
+REFETCH_DAYS = 7
+
+# (開始日, 終了日) -> 取得したデータ (pandas/polarsのDataFrame)
+Fetcher = Callable[[datetime, datetime], Any]
+
+# 複数のデータセットを並行して保存する場合に、ハイウォーターマークの読み込みから保存までを排他する
+_watermarks_lock = threading.Lock()
+
+
+def date_column(dataset: str) -> str:
+    """データセットの期間の基準になる日付列 (期間を指定して取得できないデータセットはValueError)"""
+    try:
+        return DATASET_DATE_COLUMNS[dataset]
+    except KeyError:
+        raise ValueError(f"期間を指定して取得できないデータセットです: {dataset} "
+                         f"(対応: {', '.join(DATASET_DATE_COLUMNS)})") from None
+
+
+def load_watermarks(path: str | Path = WATERMARKS_PATH) -> dict[str, str]:
+    """保存済みのハイウォーターマーク (データセット名 -> YYYY-MM-DD) を読み込む (なければ空)"""
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_watermarks(watermarks: dict[str, str], path: str | Path = WATERMARKS_PATH) -> None:
+    """ハイウォーターマークを保存する (書き込み途中で中断しても既存のファイルを壊さない)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(watermarks, f, ensure_ascii=False, indent=2, sort_keys=True)
+    tmp_path.replace(path)
+
+
+def delta_range(
+    dataset: str,
+    watermarks: dict[str, str],
+    start_dt: datetime,
+    end_dt: datetime,
+    full_rebuild: bool = False,
+) -> tuple[datetime, datetime] | None:
+    """
+    今回取得する期間を返す
+
+    前回の最終日から REFETCH_DAYS 日さかのぼった日を開始日にする。
+    最初の実行や full_rebuild の場合は start_dt から取得する。
+
+    Returns:
+        tuple[datetime, datetime] | None: (開始日, 終了日)。取得するものがなければNone
+    """
+    date_column(dataset)
+    if full_rebuild or dataset not in watermarks:
+        return start_dt, end_dt
+    watermark = datetime.fromisoformat(watermarks[dataset]).replace(
+        hour=start_dt.hour, minute=start_dt.minute, second=start_dt.second, microsecond=start_dt.microsecond
+    )
+    from_dt = max(start_dt, watermark - timedelta(days=REFETCH_DAYS))
+    if from_dt > end_dt:
+        return None
+    return from_dt, end_dt
+
+
+def _to_pandas(df: Any) -> pd.DataFrame:
+    return df.to_pandas() if hasattr(df, "to_pandas") else df
+
+
+def to_dates(series: pd.Series) -> pd.Series:
+    """日付列 (文字列・日付型) を日付型にする (変換できない値はNaT)"""
+    return pd.to_datetime(series, errors="coerce").dt.normalize()
+
+
+def dates_to_str(df: pd.DataFrame) -> pd.DataFrame:
+    """日付型の列を、CSVから読み込んだ場合と同じ YYYY-MM-DD の文字列にする"""
+    converted = {
+        col: df[col].dt.strftime("%Y-%m-%d") for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])
+    }
+    return df.assign(**converted) if converted else df
+
+
+def upsert_csv(df: pd.DataFrame, csv_path: str | Path, date_col: str, from_date: date | None) -> int:
+    """
+    CSVの from_date 以降の行を df で置き換える (from_dateがNoneなら全体を置き換える)
+
+    同じ期間を何度書き込んでも行が重複しない。既存の行は文字列のまま読み書きするので、
+    置き換えない部分の内容は変わらない。
+
+    Returns:
+        int: 書き込み後の行数
+    """
+    csv_path = Path(csv_path)
+    new = dates_to_str(df)
+    if from_date is not None and csv_path.exists():
+        existing = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+        keep = existing[~(to_dates(existing[date_col]) >= pd.Timestamp(from_date))]
+        new = pd.concat([keep, new], ignore_index=True)
+        new = new.iloc[to_dates(new[date_col]).argsort(kind="stable")]
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = csv_path.with_name(csv_path.name + ".tmp")
+    new.to_csv(tmp_path, index=False)
+    tmp_path.replace(csv_path)
+    return len(new)
+
+
+def upsert_parquet(df: pd.DataFrame, dataset: str, from_date: date | None,
+                   root: str | Path = parquet_storage.PARQUET_PATH) -> None:
+    """
+    Parquetデータセットの from_date 以降の行を df で置き換える (from_dateがNoneなら全体を置き換える)
+
+    write_dataset は書き込む年月のパーティションを丸ごと置き換えるため、
+    from_date を含む月の from_date より前の行を読み込んで一緒に書き直す。
+    """
+    path = Path(root) / dataset
+    if from_date is None:
+        shutil.rmtree(path, ignore_errors=True)
+    elif path.exists():
+        month_start = from_date.replace(day=1)
+        head = parquet_storage.read_dataset(dataset, start=month_start, end=from_date - timedelta(days=1), root=root)
+        if len(head):
+            df = pd.concat([head.astype({c: "object" for c in head.select_dtypes("category")}), dates_to_str(df)],
+                           ignore_index=True)
+    if len(df):
+        parquet_storage.write_dataset(df, dataset, root=root)
+
+
+def upsert_db(df: pd.DataFrame, table: str, engine: Any, date_col: str, from_date: date | None) -> None:
+    """
+    DBのテーブルの from_date 以降の行を df で置き換える (from_dateがNoneならテーブルを作り直す)
+
+    削除と追加は1つのトランザクションで行う。追加は bulk_writer.write_table で一括で書き込む。
+    """
+    from sqlalchemy import inspect, text
+
+    with engine.begin() as conn:
+        if from_date is None or not inspect(conn).has_table(table):
+            bulk_writer.write_table(df, table, conn, if_exists="replace")
+            return
+        quote = conn.dialect.identifier_preparer.quote
+        conn.execute(text(f"DELETE FROM {quote(table)} WHERE {quote(date_col)} >= :from_date"),
+                     {"from_date": from_date.isoformat()})
+        bulk_writer.write_table(df, table, conn, if_exists="append")
+
+
+def ingest(
+    dataset: str,
+    fetch: Fetcher,
+    start_dt: datetime,
+    end_dt: datetime,
+    csv_path: str | Path | None = None,
+    engine: Any = None,
+    formats: list[str] | tuple[str, ...] = ("csv",),
+    full_rebuild: bool = False,
+    watermarks_path: str | Path = WATERMARKS_PATH,
+    parquet_root: str | Path = parquet_storage.PARQUET_PATH,
+) -> int:
+    """
+    前回の続きの期間だけを取得して、CSV/Parquet/DBに反映する
+
+    ハイウォーターマーク (取得済みデータの最終日) は全ての保存先に書き終えてから更新するので、
+    途中で失敗しても次回は同じ期間から取り直す。
+
+    Args:
+        dataset (str): データセット名 (DATASET_DATE_COLUMNS のキー、DBのテーブル名)
+        fetch (Fetcher): 開始日・終了日を受け取ってデータ (pandas/polars) を返す関数
+        start_dt (datetime): 最初の実行で取得する開始日
+        end_dt (datetime): 終了日
+        csv_path (str | Path | None, optional): CSVの保存先 (formatsに"csv"がある場合)
+        engine (Any, optional): SQLAlchemyのエンジン. Noneの場合はDBに書き込まない
+        formats (list[str] | tuple[str, ...], optional): ローカルの保存形式 ("csv", "parquet")
+        full_rebuild (bool, optional): Trueの場合はstart_dtから全て取り直して置き換える
+        watermarks_path (str | Path, optional): ハイウォーターマークの保存先
+        parquet_root (str | Path, optional): Parquetの保存先
+
+    Returns:
+        int: 今回取得した行数
+    """
+    delta = fetch_delta(dataset, fetch, start_dt, end_dt, full_rebuild, watermarks_path)
+    if delta is None:
+        return 0
+    return store_delta(dataset, *delta, csv_path=csv_path, engine=engine, formats=formats,
+                       watermarks_path=watermarks_path, parquet_root=parquet_root)
+
+
+def fetch_delta(
+    dataset: str,
+    fetch: Fetcher,
+    start_dt: datetime,
+    end_dt: datetime,
+    full_rebuild: bool = False,
+    watermarks_path: str | Path = WATERMARKS_PATH,
+) -> tuple[pd.DataFrame, date | None] | None:
+    """
+    ingest の取得部分 (取得と保存を別のスレッドで行う場合に使う)
+
+    Returns:
+        tuple[pd.DataFrame, date | None] | None: (取得したデータ, 置き換える開始日)。
+            置き換える開始日がNoneの場合は全体を置き換える。取得するものがなければNone
+    """
+    date_column(dataset)
+    watermarks = load_watermarks(watermarks_path)
+    window = delta_range(dataset, watermarks, start_dt, end_dt, full_rebuild)
+    if window is None:
+        return None
+    from_dt, to_dt = window
+    df = _to_pandas(fetch(from_dt, to_dt))
+    if len(df) == 0:
+        return None
+    # 初回・全件取り直しは全体を置き換え、それ以外は開始日以降を置き換える
+    replace_from = None if full_rebuild or dataset not in watermarks else from_dt.date()
+    return df, replace_from
+
+
+def store_delta(
+    dataset: str,
+    df: pd.DataFrame,
+    replace_from: date | None,
+    csv_path: str | Path | None = None,
+    engine: Any = None,
+    formats: list[str] | tuple[str, ...] = ("csv",),
+    watermarks_path: str | Path = WATERMARKS_PATH,
+    parquet_root: str | Path = parquet_storage.PARQUET_PATH,
+) -> int:
+    """
+    ingest の保存部分。fetch_delta の結果を各保存先に書き込んでから、ハイウォーターマークを更新する
+
+    Returns:
+        int: 書き込んだ行数
+    """
+    date_col = date_column(dataset)
+    if "csv" in formats and csv_path is not None:
+        upsert_csv(df, csv_path, date_col, replace_from)
+    if "parquet" in formats:
+        upsert_parquet(df, dataset, replace_from, root=parquet_root)
+    if engine is not None:
+        upsert_db(df, dataset, engine, date_col, replace_from)
+
+    update_watermark(dataset, to_dates(df[date_col]).max().date(), replace_from is not None, watermarks_path)
+    return len(df)
+
+
+def update_watermark(dataset: str, latest: date, partial: bool, watermarks_path: str | Path = WATERMARKS_PATH) -> None:
+    """
+    データセットのハイウォーターマークを latest にする
+
+    partial (開始日以降だけを置き換えた) の場合は、記録済みの日付より前には戻さない。
+    """
+    with _watermarks_lock:
+        # 他のデータセットの更新を消さないよう、保存直前に読み直す
+        watermarks = load_watermarks(watermarks_path)
+        value = latest.isoformat()
+        if partial and dataset in watermarks:
+            value = max(value, watermarks[dataset])
+        watermarks[dataset] = value
+        save_watermarks(watermarks, watermarks_path)
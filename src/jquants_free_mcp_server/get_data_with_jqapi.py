@@ -1,3 +1,4 @@
+import argparse
 from datetime import datetime, timedelta
 import jquantsapi
 import pandas as pd
@@ -9,9 +10,11 @@ from tqdm import tqdm
 from pathlib import Path
 from sqlalchemy import create_engine  # 英語列名版データもそのまま格納するようにする。
 import polars as pl
-import time_recorder
 from dateutil import tz
 import os
+import sys
+from jquants_free_mcp_server import bulk_writer, delta_ingest, ingest_pipeline, parquet_storage, sharded_download, streaming_ingest
+from jquants_free_mcp_server.rate_limiter import BlockingTokenBucket, requests_per_minute_from_env
 
 # リフレッシュトークンが記載されているファイルを指定します
 DATA_PATH = Path("data")
@@ -20,7 +23,7 @@ STOCK_PRICE_FILENAME = DATA_PATH / Path("stock_price.csv")
 STOCK_LIST_FILENAME = DATA_PATH / Path("stock_list.csv")
 STOCK_FINANCE_FILENAME = DATA_PATH / Path("stock_fin.csv")
 TRADE_SPEC_FILENAME = DATA_PATH / Path("markets_trades_spec.csv")
-TOPIX_FILENAME = DATA_PATH / Path("option.csv")
+TOPIX_FILENAME = DATA_PATH / Path("topix.csv")
 OP_FILENAME = DATA_PATH / Path("option.csv")
 MERGIN_FILENAME = DATA_PATH / Path("margin_interest.csv")
 SHORT_FILENAME = DATA_PATH / Path("short_selling.csv")
@@ -38,6 +41,12 @@ RAW_STOCK_CODE = "Code"  # ベースデータの銘柄コード(ETF共存との
 STR_KAIDAN_DAYS = "HigherLowDays"
 STR_HIGHER_VOL_DATE = "HighVolumeDates"
 
+# ローカルに保存する形式 (カンマ区切りで csv / parquet。parquetは data/parquet 以下に年月で分割して保存)
+STORAGE_FORMATS = [f.strip() for f in os.environ.get("JQUANTS_STORAGE_FORMATS", "csv,parquet").split(",") if f.strip()]
+
+# 全スレッドで連続して送信できるリクエスト数 (1分あたりの上限は JQUANTS_RATE_LIMIT_PER_MINUTE / JQUANTS_PLAN)
+RATE_LIMIT_BURST = float(os.environ.get("JQUANTS_RATE_LIMIT_BURST", "1"))
+
 # IDトークンのファイルパスを定義
 ID_TOKEN_FILE_PATH = "jquantsapi-id-token.txt"
 ID_TOKEN_EXPIRY_FILE_PATH = "jquantsapi-id-token-expiry.txt"
@@ -70,6 +79,17 @@ def save_id_token(id_token):
         f.write(expiry_time.isoformat())
 
 
+def save_local(df, filename, csv_path):
+    """取得したデータ(pandas/polars)をSTORAGE_FORMATSの形式でローカルに保存する"""
+    if "csv" in STORAGE_FORMATS:
+        if isinstance(df, pl.DataFrame):
+            df.write_csv(csv_path)
+        else:
+            df.to_csv(csv_path, index=False)
+    if "parquet" in STORAGE_FORMATS:
+        parquet_storage.write_dataset(df, filename)
+
+
 def get_id_token_from_file():
     """ファイルからIDトークンを読み込み、有効期限内であれば返す"""
     if not os.path.exists(ID_TOKEN_FILE_PATH) or not os.path.exists(ID_TOKEN_EXPIRY_FILE_PATH):
@@ -90,10 +110,22 @@ def get_id_token_from_file():
 
 if __name__ == '__main__':
 	
+    parser = argparse.ArgumentParser(description="J-Quants APIからデータを取得して保存する")
+    parser.add_argument("--start", default="2024-08-01",
+                        help="最初の実行 (または --full-rebuild) で取得する開始日 (YYYY-MM-DD)")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="前回の取得状況 (data/watermarks.json) を無視して、開始日から全て取り直す")
+    parser.add_argument("--sequential", action="store_true",
+                        help="データセットを並行して取得せず、1つずつ取得・保存する")
+    parser.add_argument("--streaming", action="store_true",
+                        help="株価・財務情報を1日ずつ取得してそのまま書き込み、期間全体をメモリに置かない "
+                             "(1回に書き込む行数は JQUANTS_STREAM_BATCH_ROWS)")
+    args = parser.parse_args()
+
     # J-Quants API から取得するデータの期間
-    # 取得開始日
+    # 取得開始日 (2回目以降は data/watermarks.json に記録した前回の最終日の続きから取得する)
     
-    start_dt: datetime = datetime(2024, 8, 1).replace(hour=9, minute=0, second=0, microsecond=0)
+    start_dt: datetime = datetime.fromisoformat(args.start).replace(hour=9, minute=0, second=0, microsecond=0)
     # 現在の日時を取得
     end_dt: datetime = datetime.now().replace(hour=9, minute=0,
                                               second=0, microsecond=0)
@@ -114,7 +146,8 @@ if __name__ == '__main__':
 
     # engineを指定(241104:postgresに変更)
     # engine = create_engine(f'mysql+pymysql://{USER}:{PASSWORD}@{HOST}/{DATABASE}')
-    engine = create_engine(f'postgresql://{USER}:{PASSWORD}@{HOST}/{DATABASE}')
+    # JQUANTS_DB_URL で保存先のDBを変更できる (例: sqlite:///data/jquants.sqlite3)
+    engine = create_engine(os.environ.get(bulk_writer.DB_URL_ENV, f'postgresql://{USER}:{PASSWORD}@{HOST}/{DATABASE}'))
 
     # リフレッシュトークン
     # refresh_token = ''
@@ -155,159 +188,78 @@ if __name__ == '__main__':
     
     # フリープラン
     print(f"start:{str(start_dt)[0:10]}, end:{str(end_dt)[0:10]}")
-    @time_recorder.time_recorder
-    # 銘柄一覧(listed_info)
-    def get_stock_list():
-        filename = "stock_list"
-        stock_list_load: pd.DataFrame = cli.get_list()
-        stock_list_load.to_csv(STOCK_LIST_FILENAME, index=False)
-        stock_list_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        # stock_list_load = pl.DataFrame(cli.get_list()) # データの取得
-        # stock_list_load = pl.from_pandas(cli.get_list()) # データの取得
-
-        # stock_list_load.write_csv(STOCK_LIST_FILENAME) # CSVファイルに保存
-        # stock_list_load.to_pandas().to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")
-        # stock_list_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'stock list end,  length:{len(stock_list_load)}')
-
-    print("stock_list start")
-    get_stock_list()
-
-    @time_recorder.time_recorder
-    # 株価情報(daily_quote)
-    def get_daily_quote():
-        filename = "stock_price"
-        stock_price_load: pd.DataFrame = cli.get_price_range(start_dt, end_dt)
-        stock_price_load.to_csv(STOCK_PRICE_FILENAME, index=False)
-        stock_price_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        # print(f'quote 1_1')
-        # # stock_price_load = pl.DataFrame(cli.get_price_range(start_dt, end_dt)) # データの取得
-        # df = cli.get_price_range(start_dt, end_dt)
-        # print(f'quote 1_2')
-        # df_cleaned = df.dropna(axis=1, how='all')
-        # print(f'quote 1_3')
-        # stock_price_load = pl.from_pandas(df_cleaned) # データの取得
-        # print(f'quote 2')
-        # stock_price_load.write_csv(STOCK_PRICE_FILENAME) # CSVファイルに保存
-        # print(f'quote 3')
-        # stock_price_load.to_pandas().to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")
-        # print(f'quote 4')
-        # stock_price_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'stock price end,  length:{len(stock_price_load)}')
-
-    print("stock_quote start")
-    get_daily_quote()
-
-    @time_recorder.time_recorder
-    # 財務情報(statements)
-    def get_statements():
-        stock_fin_load: pd.DataFrame = cli.get_statements_range(start_dt, end_dt)
-        stock_fin_load.to_csv(STOCK_FINANCE_FILENAME, index=False)
-        filename = "stock_fin"
-        stock_fin_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        # print(f'fin 1')
-        # # stock_fin_load = pl.DataFrame(cli.get_statements_range(start_dt, end_dt))
-        # df = cli.get_statements_range(start_dt, end_dt)
-        # df_cleaned = df.dropna(axis=1, how='all')
-        # stock_fin_load = pl.from_pandas(df_cleaned)
-        # # 'NumberOfIssuedAndOutstandingSharesAtTheEndOfFiscalYearIncludingTreasuryStock'列を除外(64byte超)
-        # print(f'fin 2')
-        # stock_fin_load = stock_fin_load.drop('NumberOfIssuedAndOutstandingSharesAtTheEndOfFiscalYearIncludingTreasuryStock')
-        # print(f'fin 3')
-        # stock_fin_load.write_csv(STOCK_FINANCE_FILENAME) # CSVファイルに保存
-        # # 今は64byte超過のものがあるからいったんDB保存はコメント
-        # print(f'fin 4')
-        # stock_fin_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'stock fin end,  length:{len(stock_fin_load)}')
 
-    print("stock_fin start")
-    get_statements()
-
-    # ライトプラン
-    @time_recorder.time_recorder
-    # 投資部門別情報(trades_spec)
-    def get_trades_spec():
-        section_str: str = "TSEPrime"  # sectionを指定しないとデータが取れない模様
-        # markets_trades_spec_load: pd.DataFrame = cli.get_markets_trades_spec(section=section_str, from_yyyymmdd=str(start_dt)[0:10], to_yyyymmdd=str(end_dt)[0:10])
-        # markets_trades_spec_load.to_csv(TRADE_SPEC_FILENAME, index=False)
-        filename = "markets_trades_spec"
-        # markets_trades_spec_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        markets_trades_spec_load=pl.DataFrame(cli.get_markets_trades_spec(section=section_str, from_yyyymmdd=str(start_dt)[0:10], to_yyyymmdd=str(end_dt)[0:10]))
-        markets_trades_spec_load.write_csv(TRADE_SPEC_FILENAME) # CSVファイルに保存
-        markets_trades_spec_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'markets trades spec end,  length:{len(markets_trades_spec_load)}')
-        # print(end_dt)
-
-    print("stock_trades_spec start")
-    get_trades_spec()
-
-    # Topix(indices)
-    @time_recorder.time_recorder
-    def get_indices():
-        filename = "topix"
-        # stock_topix_load: pd.DataFrame = cli.get_indices_topix(str(start_dt)[0:10], str(end_dt)[0:10])
-        # stock_topix_load.to_csv(TOPIX_FILENAME, index=False)
-        # stock_topix_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        stock_topix_load = pl.DataFrame(cli.get_indices_topix(str(start_dt)[0:10], str(end_dt)[0:10]))
-        stock_topix_load.write_csv(TOPIX_FILENAME) # CSVファイルに保存
-        stock_topix_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'topix end,  length:{len(stock_topix_load)}')
-
-    print("stock_topix start")
-    get_indices()
-
-    # スタンダードプラン
-    @time_recorder.time_recorder
-    def get_option():
+    # 複数のデータセットを並行して取得するため、APIへのリクエストは全スレッドの合計でレート制限内に抑える
+    cli._get = BlockingTokenBucket.per_minute(requests_per_minute_from_env(), RATE_LIMIT_BURST).wrap(cli._get)
+
+    def delta_job(dataset, fetch, csv_path):
+        """前回の続きの期間だけを取得し、CSV/Parquet/DBの該当期間を置き換えるジョブ"""
+        return (
+            dataset,
+            lambda: delta_ingest.fetch_delta(dataset, fetch, start_dt, end_dt, args.full_rebuild),
+            lambda delta: delta_ingest.store_delta(dataset, *delta, csv_path=csv_path, engine=engine,
+                                                   formats=STORAGE_FORMATS),
+        )
+
+    def store_stock_list(stock_list_load):
+        save_local(stock_list_load, "stock_list", STOCK_LIST_FILENAME)
+        bulk_writer.write_table(stock_list_load, "stock_list", engine, if_exists="replace")  # COPY (PostgreSQL) で一括で書き込む
+        return len(stock_list_load)
+
+    def daily_job(dataset, fetch_day, csv_path):
+        """期間を1日ずつに分けて並行して取得するジョブ"""
+        if args.streaming:
+            # 取得した日からそのままCSV/Parquet/DBに追記する (取得は保存のスレッドで行われる)
+            return (
+                dataset,
+                lambda: streaming_ingest.fetch_stream(dataset, fetch_day, start_dt, end_dt, args.full_rebuild),
+                lambda stream: streaming_ingest.store_stream(dataset, *stream, csv_path=csv_path, engine=engine,
+                                                             formats=STORAGE_FORMATS),
+            )
+        # 全ての日を取得してから書き込む (中断しても data/shards から続きを取得する)
+        return delta_job(
+            dataset, lambda from_dt, to_dt: sharded_download.download_range(dataset, fetch_day, from_dt, to_dt), csv_path
+        )
+
+    section_str: str = "TSEPrime"  # 投資部門別情報はsectionを指定しないとデータが取れない模様
+    jobs = [
+        # 銘柄一覧(listed_info)
+        ("stock_list", cli.get_list, store_stock_list),
+        # フリープラン
+        # 株価情報(daily_quote)
+        daily_job(
+            "stock_price",
+            lambda day: cli.get_prices_daily_quotes(date_yyyymmdd=day.strftime("%Y%m%d")),
+            STOCK_PRICE_FILENAME,
+        ),
+        # 財務情報(statements)
+        daily_job(
+            "stock_fin",
+            lambda day: cli.get_fins_statements(date_yyyymmdd=day.strftime("%Y%m%d")),
+            STOCK_FINANCE_FILENAME,
+        ),
+        # ライトプラン
+        # 投資部門別情報(trades_spec)
+        delta_job(
+            "markets_trades_spec",
+            lambda from_dt, to_dt: cli.get_markets_trades_spec(section=section_str, from_yyyymmdd=str(from_dt)[0:10], to_yyyymmdd=str(to_dt)[0:10]),
+            TRADE_SPEC_FILENAME,
+        ),
+        # Topix(indices)
+        delta_job("topix", lambda from_dt, to_dt: cli.get_indices_topix(str(from_dt)[0:10], str(to_dt)[0:10]), TOPIX_FILENAME),
+        # スタンダードプラン
         # オプション四本値(option)
-        filename = "option"
-        option_load: pd.DataFrame = cli.get_index_option_range(str(start_dt)[0:10], str(end_dt)[0:10])
-        option_load.to_csv(OP_FILENAME, index=False)
-        option_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        # print(f'op 1')
-        # # option_load=pl.DataFrame(cli.get_index_option_range(str(start_dt)[0:10], str(end_dt)[0:10]))
-        # option_load=pl.DataFrame(cli.get_index_option_range(start_dt, end_dt))
-        # print(f'op 2')
-        # option_load.write_csv(OP_FILENAME) # CSVファイルに保存
-        # print(f'op 3')
-        # option_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'option end,  length:{len(option_load)}')
-
-    print("stock_op start")
-    get_option()
-
-    @time_recorder.time_recorder
-    # 信用取引週末残高(mergin_interest)
-    def get_mergin_interest():
-        filename = "margin_interest"
-        # markets_weekly_margin_interest_load: pd.DataFrame = cli.get_weekly_margin_range(str(start_dt)[0:10], str(end_dt)[0:10])
-        # markets_weekly_margin_interest_load.to_csv(MERGIN_FILENAME, index=False)
-        # markets_weekly_margin_interest_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        print(f'mi 1')
-        markets_weekly_margin_interest_load=pl.DataFrame(cli.get_weekly_margin_range(start_dt, end_dt))
-        print(f'mi 2')
-        markets_weekly_margin_interest_load.write_csv(MERGIN_FILENAME) # CSVファイルに保存
-        print(f'mi 3')
-        markets_weekly_margin_interest_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'margin interest end,  length:{len(markets_weekly_margin_interest_load)}')
-
-    print("stock_margin_interest start")
-    get_mergin_interest()
-
-    @time_recorder.time_recorder
-    # 業種別空売り比率(short_selling)
-    def get_short_selling():
-        filename = "short_selling"
-        # markets_short_selling_load: pd.DataFrame = cli.get_short_selling_range(str(start_dt)[0:10], str(end_dt)[0:10])
-        # markets_short_selling_load.to_csv(SHORT_FILENAME, index=False)
-        # markets_short_selling_load.to_sql(filename, con=engine, if_exists="replace", index=False, method="multi")  # polarsのデータフレームをpandasのデータフレームに変換してto_sqlメソッドを使用
-        print(f'ss 1')
-        markets_short_selling_load=pl.DataFrame(cli.get_short_selling_range(start_dt, end_dt))
-        print(f'ss 2')
-        markets_short_selling_load.write_csv(SHORT_FILENAME) # CSVファイルに保存
-        print(f'ss 3')
-        markets_short_selling_load.write_database(table_name=filename, connection=engine, if_table_exists="replace")
-        print(f'short selling end,  length:{len(markets_short_selling_load)}')
-
-    print("stock_short_selling start")
-    get_short_selling()
+        delta_job("option", lambda from_dt, to_dt: cli.get_index_option_range(str(from_dt)[0:10], str(to_dt)[0:10]), OP_FILENAME),
+        # 信用取引週末残高(mergin_interest)
+        delta_job("margin_interest", cli.get_weekly_margin_range, MERGIN_FILENAME),
+        # 業種別空売り比率(short_selling)
+        delta_job("short_selling", cli.get_short_selling_range, SHORT_FILENAME),
+    ]
+
+    # 取得と保存を並行して行い、データセットごとに取得・保存待ち・保存の時間を表示する
+    # (--sequential の場合は1つずつ取得・保存する)
+    workers = {"fetch_workers": 1, "write_workers": 1, "queue_size": 1} if args.sequential else {}
+    report = ingest_pipeline.run_pipeline(jobs, **workers)
+    print(ingest_pipeline.format_timings(report))
+    if any(r["error"] for r in report["datasets"]):
+        sys.exit(1)
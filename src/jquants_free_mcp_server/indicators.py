@@ -0,0 +1,159 @@
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+# 指定できる指標の種類 -> 出力する列名 (windowは日数)
+#   sma: 終値の単純移動平均 / ema: 終値の指数移動平均 / volume_mean: 出来高の単純移動平均
+#   deviation: 終値の単純移動平均からの乖離率(%) / perfect_order: 指定した順に短期 > ... > 長期 なら1
+INDICATOR_COLUMNS = {
+    "sma": "SMA{window}",
+    "ema": "EMA{window}",
+    "volume_mean": "VolumeMean{window}",
+    "deviation": "SMA{window}_乖離率",
+    "perfect_order": "PerfectOrder",
+}
+
+DEFAULT_CLOSE_COL = "AdjustmentClose"
+DEFAULT_VOLUME_COL = "AdjustmentVolume"
+
+
+def _validate(indicators: dict[str, list[int]]) -> None:
+    for kind, windows in indicators.items():
+        if kind not in INDICATOR_COLUMNS:
+            raise ValueError(f"未知の指標です: {kind} (対応: {', '.join(INDICATOR_COLUMNS)})")
+        if any(int(w) < 1 for w in windows):
+            raise ValueError(f"{kind}の日数は1以上を指定してください: {windows}")
+    if "perfect_order" in indicators and len(indicators["perfect_order"]) < 2:
+        raise ValueError("perfect_orderには2つ以上の日数を短い順に指定してください")
+
+
+class _Groups:
+    """
+    銘柄ごとに連続して並べた行の配置 (位置の並べ替えと、各行の銘柄内での位置)
+
+    すでに銘柄ごとに連続している場合は並べ替えない。
+    """
+
+    def __init__(self, df: pd.DataFrame, by: str | None):
+        n = len(df)
+        ids = pd.factorize(df[by])[0] if by is not None else np.zeros(n, dtype=np.int64)
+        # factorizeは出現順に番号を振るので、連続して並んでいれば単調増加になる
+        self.order = None if n == 0 or (np.diff(ids) >= 0).all() else np.argsort(ids, kind="stable")
+        self.ids = ids if self.order is None else ids[self.order]
+        index = np.arange(n)
+        is_start = np.r_[True, self.ids[1:] != self.ids[:-1]] if n else np.zeros(0, dtype=bool)
+        self.position = index - np.maximum.accumulate(np.where(is_start, index, 0)) if n else index
+
+    def take(self, values: np.ndarray) -> np.ndarray:
+        return values if self.order is None else values[self.order]
+
+    def restore(self, values: np.ndarray) -> np.ndarray:
+        if self.order is None:
+            return values
+        restored = np.empty_like(values)
+        restored[self.order] = values
+        return restored
+
+    def cumsum(self, values: np.ndarray) -> np.ndarray:
+        return pd.Series(values).groupby(self.ids, sort=False).cumsum().to_numpy()
+
+
+def _window_means(values: np.ndarray, windows: list[int], groups: _Groups) -> dict[int, np.ndarray]:
+    """
+    銘柄ごとの累積和を1回だけ計算し、そこから全ての窓の移動平均を求める
+
+    窓の途中に欠損があればNaN (rolling(window).mean() と同じ)。累積の桁落ちを抑えるため、
+    銘柄ごとに最初の値を引いてから足し合わせる。
+    """
+    if len(values) == 0:
+        return {window: values.copy() for window in windows}
+    missing = np.isnan(values)
+    offset = pd.Series(values).groupby(groups.ids, sort=False).transform("first").to_numpy()
+    sums = groups.cumsum(np.where(missing, 0.0, values - offset))
+    missing_counts = groups.cumsum(missing.astype(np.int64))
+
+    # 同じ値が続いている行数。窓の中が全て同じ値なら、rolling().mean() と同じくその値を厳密に返す
+    # (値が動かない期間に短期と長期の移動平均が丸め誤差で食い違い、パーフェクトオーダーになるのを防ぐ)
+    index = np.arange(len(values))
+    same = np.r_[False, (values[1:] == values[:-1]) & (groups.ids[1:] == groups.ids[:-1])]
+    run_length = index - np.maximum.accumulate(np.where(same, 0, index)) + 1
+    means = {}
+    for window in dict.fromkeys(windows):
+        # 窓の直前の行の累積値 (窓が銘柄の先頭から始まる場合は0)
+        before = np.maximum(index - window, 0)
+        has_before = groups.position >= window
+        window_sum = sums - np.where(has_before, sums[before], 0.0)
+        window_missing = missing_counts - np.where(has_before, missing_counts[before], 0)
+        valid = (groups.position >= window - 1) & (window_missing == 0)
+        mean = np.where(run_length >= window, values, window_sum / window + offset)
+        means[window] = np.where(valid, mean, np.nan)
+    return means
+
+
+def _ema(values: np.ndarray, window: int, groups: _Groups) -> np.ndarray:
+    # 指数移動平均は再帰的に求めるため累積和を共有できない (全銘柄を1回のgroupby.ewmで計算する)
+    ema = pd.Series(values).groupby(groups.ids, sort=False).ewm(span=window, adjust=False, min_periods=window).mean()
+    return ema.droplevel(0).sort_index().to_numpy()
+
+
+def compute_indicators(
+    df: pd.DataFrame,
+    indicators: dict[str, list[int]],
+    by: str | None = None,
+    close_col: str = DEFAULT_CLOSE_COL,
+    volume_col: str = DEFAULT_VOLUME_COL,
+) -> dict[str, np.ndarray]:
+    """
+    指定した指標をまとめて計算する
+
+    単純移動平均は列ごとに銘柄単位の累積和を1回だけ作り、全ての窓をその差分で求める。
+    乖離率・パーフェクトオーダーは同じ移動平均を使い回すので、指標を増やしても
+    データ全体を走査する回数は列の数 (終値・出来高) とEMAの窓の数しか増えない。
+
+    Args:
+        df (pd.DataFrame): 株価データ (銘柄内は日付順)
+        indicators (dict[str, list[int]]): 指標の種類 -> 日数のリスト
+            例: {"sma": [5, 25, 75], "deviation": [5, 25, 75], "perfect_order": [5, 25, 75]}
+        by (str | None, optional): 銘柄コードの列. Noneの場合は全体を1銘柄として扱う
+        close_col (str, optional): 終値の列. Defaults to DEFAULT_CLOSE_COL.
+        volume_col (str, optional): 出来高の列. Defaults to DEFAULT_VOLUME_COL.
+
+    Returns:
+        dict[str, np.ndarray]: 列名 -> 値 (dfの行順)。列はindicatorsの指定順、日数は指定順に並ぶ
+    """
+    _validate(indicators)
+    groups = _Groups(df, by)
+    close = groups.take(df[close_col].to_numpy(dtype="float64"))
+
+    close_windows = [w for kind in ("sma", "deviation", "perfect_order") for w in indicators.get(kind, [])]
+    sma = _window_means(close, close_windows, groups) if close_windows else {}
+
+    columns: dict[str, np.ndarray] = {}
+    for kind, windows in indicators.items():
+        if kind == "sma":
+            for w in windows:
+                columns[f"SMA{w}"] = sma[w]
+        elif kind == "ema":
+            for w in windows:
+                columns[f"EMA{w}"] = _ema(close, w, groups)
+        elif kind == "volume_mean":
+            volume = groups.take(df[volume_col].to_numpy(dtype="float64"))
+            for w, mean in _window_means(volume, windows, groups).items():
+                columns[f"VolumeMean{w}"] = mean
+        elif kind == "deviation":
+            for w in windows:
+                columns[f"SMA{w}_乖離率"] = (close - sma[w]) / sma[w] * 100
+        elif kind == "perfect_order":
+            ordered = np.ones(len(close), dtype=bool)
+            for shorter, longer in zip(windows[:-1], windows[1:]):
+                ordered &= sma[shorter] > sma[longer]
+            columns["PerfectOrder"] = ordered.astype(np.int64)
+    return {name: groups.restore(values) for name, values in columns.items()}
+
+
+def add_indicators(df: pd.DataFrame, indicators: dict[str, list[int]], by: str | None = None, **kwargs: Any) -> pd.DataFrame:
+    """compute_indicators の結果をdfの列として追加する (dfを書き換えて返す)"""
+    for name, values in compute_indicators(df, indicators, by, **kwargs).items():
+        df[name] = values
+    return df
@@ -0,0 +1,108 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+# 同時に取得するデータセット数 (APIのリクエスト数はクライアント側のレートリミッタで抑える)
+FETCH_WORKERS = int(os.environ.get("JQUANTS_INGEST_FETCH_WORKERS", "4"))
+# 同時に保存するデータセット数 (保存先のファイル・テーブルはデータセットごとに別)
+WRITE_WORKERS = int(os.environ.get("JQUANTS_INGEST_WRITE_WORKERS", "2"))
+# 取得済みで保存待ちのデータセットをいくつまでメモリに置くか (これを超えると取得側が待つ)
+QUEUE_SIZE = int(os.environ.get("JQUANTS_INGEST_QUEUE_SIZE", "2"))
+
+# (データセット名, 取得する関数, 保存する関数)
+#   取得する関数は引数なしでデータを返す (保存するものがなければNone)
+#   保存する関数は取得したデータを受け取って書き込んだ行数を返す
+Job = tuple[str, Callable[[], Any], Callable[[Any], int]]
+
+
+def _error(e: Exception) -> str:
+    return f"{type(e).__name__}: {e}"
+
+
+def run_pipeline(
+    jobs: list[Job],
+    fetch_workers: int = FETCH_WORKERS,
+    write_workers: int = WRITE_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+) -> dict[str, Any]:
+    """
+    複数のデータセットの取得と保存を並行して行う
+
+    取得はfetch_workers個のスレッドで並行して行い、取得が終わったものから上限付きのキューを通して
+    保存用のスレッドに渡す。あるデータセットの保存中に他のデータセットを取得するので、全体の時間は
+    各データセットの時間の合計ではなく、最も時間のかかるデータセットの時間に近づく。
+    1つのデータセットが失敗しても他のデータセットは続ける。
+
+    Args:
+        jobs (list[Job]): (データセット名, 取得する関数, 保存する関数) のリスト
+        fetch_workers (int, optional): 取得のスレッド数. Defaults to FETCH_WORKERS.
+        write_workers (int, optional): 保存のスレッド数. Defaults to WRITE_WORKERS.
+        queue_size (int, optional): 保存待ちのデータセット数の上限. Defaults to QUEUE_SIZE.
+
+    Returns:
+        dict[str, Any]: {"datasets": データセットごとの行数・段階ごとの秒数・エラー (jobsの順),
+                         "wall_seconds": 全体の秒数, "serial_seconds": 各段階の秒数の合計}
+    """
+    if min(fetch_workers, write_workers, queue_size) < 1:
+        raise ValueError("fetch_workers, write_workers, queue_size は1以上を指定してください")
+    results = [
+        {"dataset": name, "rows": 0, "fetch_seconds": 0.0, "queue_seconds": 0.0, "write_seconds": 0.0, "error": None}
+        for name, _, _ in jobs
+    ]
+    fetched: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    def fetch_one(i: int) -> None:
+        started = time.perf_counter()
+        try:
+            data = jobs[i][1]()
+        except Exception as e:
+            results[i]["error"] = _error(e)
+            return
+        finally:
+            results[i]["fetch_seconds"] = time.perf_counter() - started
+        if data is not None:
+            # キューが一杯なら保存が追いつくまで待つ (取得済みのデータがメモリに溜まり続けない)
+            fetched.put((i, data, time.perf_counter()))
+
+    def write_loop() -> None:
+        while (item := fetched.get()) is not None:
+            i, data, queued_at = item
+            started = time.perf_counter()
+            results[i]["queue_seconds"] = started - queued_at
+            try:
+                results[i]["rows"] = jobs[i][2](data)
+            except Exception as e:
+                results[i]["error"] = _error(e)
+            results[i]["write_seconds"] = time.perf_counter() - started
+            del data, item
+
+    started = time.perf_counter()
+    writers = [threading.Thread(target=write_loop, name=f"ingest-writer-{n}") for n in range(write_workers)]
+    for writer in writers:
+        writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="ingest-fetch") as pool:
+            list(pool.map(fetch_one, range(len(jobs))))
+    finally:
+        for _ in writers:
+            fetched.put(None)
+        for writer in writers:
+            writer.join()
+    return {
+        "datasets": results,
+        "wall_seconds": time.perf_counter() - started,
+        "serial_seconds": sum(r["fetch_seconds"] + r["write_seconds"] for r in results),
+    }
+
+
+def format_timings(report: dict[str, Any]) -> str:
+    """run_pipeline の結果を表にする"""
+    lines = [f"{'dataset':<22}{'rows':>10}{'fetch[s]':>10}{'queue[s]':>10}{'write[s]':>10}  error"]
+    for r in report["datasets"]:
+        lines.append(f"{r['dataset']:<22}{r['rows']:>10}{r['fetch_seconds']:>10.2f}{r['queue_seconds']:>10.2f}"
+                     f"{r['write_seconds']:>10.2f}  {r['error'] or ''}")
+    lines.append(f"wall: {report['wall_seconds']:.2f}s (sum of stages: {report['serial_seconds']:.2f}s)")
+    return "\n".join(lines)
@@ -0,0 +1,61 @@
+import json
+import os
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 使用するJSONライブラリ (auto: orjsonがあれば使用 / orjson / stdlib)
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "auto").lower()
+
+if JSON_BACKEND == "orjson" and orjson is None:
+    raise ImportError("JSON_BACKEND=orjson が指定されていますが、orjsonがインストールされていません")
+
+_use_orjson = orjson is not None and JSON_BACKEND in ("auto", "orjson")
+
+backend_name = "orjson" if _use_orjson else "stdlib"
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    JSONをデコードする
+
+    orjson使用時はbytesを文字列に変換せず直接パースする。
+
+    Args:
+        data (bytes | str): JSONデータ
+
+    Returns:
+        Any: デコード結果
+    """
+    if _use_orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """
+    UTF-8のJSONバイト列にエンコードする (非ASCII文字はエスケープしない)
+
+    orjsonで扱えない値 (64bitを超える整数など) は標準ライブラリにフォールバックする。
+    """
+    if _use_orjson:
+        try:
+            return orjson.dumps(obj)
+        except (orjson.JSONEncodeError, TypeError):
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode()
+
+
+def dumps(obj: Any) -> str:
+    """
+    JSON文字列にエンコードする (json.dumps(obj, ensure_ascii=False) 相当)
+    """
+    if _use_orjson:
+        try:
+            return orjson.dumps(obj).decode()
+        except (orjson.JSONEncodeError, TypeError):
+            pass
+    return json.dumps(obj, ensure_ascii=False)
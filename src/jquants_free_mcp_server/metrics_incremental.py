@@ -0,0 +1,222 @@
+import hashlib
+import io
+import pickle
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+from jquants_free_mcp_server.calc_stock_metrics import (
+    CLOSE_COL,
+    DAYS_OF_TARGET,
+    LONG_DAYS,
+    LOW_COL,
+    MIDDLE_DAYS,
+    RAW_STOCK_CODE,
+    SHORT_DAYS,
+    SMA_OVER_DISTANCES,
+    VOLUME_COL,
+    _rolling_mean,
+    add_ma_dev_rate,
+    sort_by_code,
+)
+
+# 移動平均の計算に必要な直近の行数 (最長の窓 - 1)
+TAIL_DAYS = max(SHORT_DAYS, MIDDLE_DAYS, LONG_DAYS, DAYS_OF_TARGET) - 1
+
+# 銘柄ごとに引き継ぐ直近の行の列
+TAIL_COLUMNS = [RAW_STOCK_CODE, CLOSE_COL, LOW_COL, VOLUME_COL]
+
+STATE_VERSION = 2
+
+# 株価CSVが書き換えられていないかの確認に使う、処理済みの末尾のバイト数。
+# get_data_with_jqapi は直近 REFETCH_DAYS 日分を毎回書き直すので、その分 (全銘柄で数MB) より大きくする
+FINGERPRINT_BYTES = 16 * 1024 * 1024
+
+
+def empty_state(distance: str = "index") -> dict[str, Any]:
+    """
+    何も計算していない状態を返す
+
+    状態は次のキーを持つ。
+        rows: これまでに処理した行数 (次の行のindex)
+        offset: 株価CSVの処理済みの位置 (バイト数。次の行の先頭)
+        fingerprint: 株価CSVの先頭行と、offsetまでの末尾 FINGERPRINT_BYTES バイトのハッシュ
+        distance: terms_SMA_overの数え方
+        tail: 銘柄ごとの直近TAIL_DAYS行 (終値・安値(前方埋め済み)・出来高)
+        codes: 銘柄ごとの累積値 (HigherLowDays, HighVolumeDates, 最後にSMAを上回った位置, 行数)
+    """
+    if distance not in SMA_OVER_DISTANCES:
+        raise ValueError(f"distanceは {SMA_OVER_DISTANCES} のいずれかを指定してください: {distance}")
+    return {
+        "version": STATE_VERSION,
+        "rows": 0,
+        "offset": 0,
+        "fingerprint": None,
+        "distance": distance,
+        "tail": pd.DataFrame(columns=TAIL_COLUMNS),
+        "codes": pd.DataFrame(
+            {
+                "HigherLowDays": pd.Series(dtype="int64"),
+                "HighVolumeDates": pd.Series(dtype="object"),
+                "last_over": pd.Series(dtype="float64"),
+                "count": pd.Series(dtype="int64"),
+            }
+        ),
+    }
+
+
+def load_state(path: str | Path) -> dict[str, Any] | None:
+    """保存済みの状態を読み込む (ファイルがなければNone)"""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != STATE_VERSION:
+        raise ValueError(f"状態ファイルの形式が古いため、全件を再計算してください: {path}")
+    return state
+
+
+def save_state(state: dict[str, Any], path: str | Path) -> None:
+    """状態を保存する (書き込み途中で中断しても既存のファイルを壊さない)"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+
+
+def update_stock_metrics(
+    df_new: pd.DataFrame, state: dict[str, Any] | None = None, distance: str = "index"
+) -> tuple[pd.DataFrame, dict[str, Any]]:
+    """
+    前回の状態を引き継ぎ、新しく追加された行だけにメトリクスを追加する
+
+    各銘柄の直近TAIL_DAYS行を新しい行の前に付けて移動平均を計算し、累積値
+    (HigherLowDays, HighVolumeDates, terms_SMA_over) は状態の値から続けて数える。
+    全件をadd_stock_metricsで計算した結果と、新しい行の部分が一致する
+    (移動平均は計算の起点が異なるため、最下位桁の誤差を除く)。
+
+    Args:
+        df_new (pd.DataFrame): 追加分の株価データ。indexは全体での行番号 (state["rows"]から始まる)
+        state (dict[str, Any] | None, optional): 前回の状態。Noneの場合は最初から計算する
+        distance (str, optional): terms_SMA_overの数え方 (状態がある場合は状態の値を使う)
+
+    Returns:
+        tuple[pd.DataFrame, dict[str, Any]]: 追加分のメトリクスと、更新後の状態
+    """
+    if state is None:
+        state = empty_state(distance)
+    distance = state["distance"]
+    codes_state = state["codes"]
+
+    new = sort_by_code(df_new)
+    new["_new"] = True
+    tail = state["tail"].assign(_new=False)
+    # 銘柄ごとに 引き継いだ行 -> 追加分 の順に並べる
+    df = sort_by_code(pd.concat([tail, new])[list(new.columns)]) if len(tail) else new
+
+    by = RAW_STOCK_CODE
+    code = df[by]
+    is_new = df["_new"].astype(bool)
+
+    add_ma_dev_rate(df, short=SHORT_DAYS, middle=MIDDLE_DAYS, long=LONG_DAYS, by=by)
+
+    # 階段 (安値の切り上がり日数) は状態の累積値に追加分を足す
+    df[LOW_COL] = df.groupby(by, sort=False)[LOW_COL].ffill()
+    higher_low = (df[LOW_COL] >= df.groupby(by, sort=False)[LOW_COL].shift(1)) & is_new
+    base_higher_low = code.map(codes_state["HigherLowDays"]).fillna(0).astype("int64")
+    df["HigherLowDays"] = higher_low.groupby(code, sort=False).cumsum() + base_higher_low
+
+    # 出来高急増日は追加分の中で判定し、なければ前回の日付を引き継ぐ
+    volume_mean = _rolling_mean(df, VOLUME_COL, DAYS_OF_TARGET, by)
+    high_volume = df["Date"].where((df[VOLUME_COL] >= volume_mean * 5) & is_new)
+    df["HighVolumeDates"] = high_volume.groupby(code, sort=False).ffill().fillna(
+        code.map(codes_state["HighVolumeDates"])
+    )
+
+    # SMAを上回ってからの距離も、前回最後に上回った位置から数える
+    df["tanki_SMA"] = _rolling_mean(df, CLOSE_COL, SHORT_DAYS, by)
+    df["is_tanki_SMA_over"] = (df[CLOSE_COL] > df["tanki_SMA"]).astype(int)
+    if distance == "index":
+        position = pd.Series(df.index.astype("int"), index=df.index, dtype=float)
+    else:
+        base_count = code.map(codes_state["count"]).fillna(0)
+        position = is_new.groupby(code, sort=False).cumsum() - 1 + base_count
+    last_over = position.where((df["is_tanki_SMA_over"] == 1) & is_new)
+    last_over = last_over.groupby(code, sort=False).ffill().fillna(code.map(codes_state["last_over"]))
+    df["terms_SMA_over"] = position - last_over
+
+    result = df.loc[new.index].drop(columns="_new")
+
+    # 状態を更新する (今回出てこなかった銘柄は前回の値のまま)
+    last = df[is_new].assign(last_over=last_over[is_new]).groupby(by, sort=False).tail(1).set_index(by)
+    count = result.groupby(by, sort=False).size() + codes_state["count"].reindex(last.index).fillna(0)
+    updated_codes = pd.DataFrame(
+        {
+            "HigherLowDays": last["HigherLowDays"].astype("int64"),
+            "HighVolumeDates": last["HighVolumeDates"].astype("object"),
+            "last_over": last["last_over"],
+            "count": count.astype("int64"),
+        }
+    )
+    new_state = {
+        "version": STATE_VERSION,
+        "rows": max(state["rows"], int(df_new.index.max()) + 1) if len(df_new) else state["rows"],
+        # 読み込んだ位置は read_new_prices の結果で更新する
+        "offset": state["offset"],
+        "fingerprint": state["fingerprint"],
+        "distance": distance,
+        "tail": df[TAIL_COLUMNS].groupby(by, sort=False).tail(TAIL_DAYS),
+        "codes": pd.concat([codes_state.drop(updated_codes.index, errors="ignore"), updated_codes]),
+    }
+    return result, new_state
+
+
+def _fingerprint(f: Any, offset: int) -> str:
+    f.seek(0)
+    digest = hashlib.sha256(f.readline())
+    start = max(0, offset - FINGERPRINT_BYTES)
+    f.seek(start)
+    digest.update(f.read(offset - start))
+    return digest.hexdigest()
+
+
+def state_matches(state: dict[str, Any], path: str | Path) -> bool:
+    """
+    状態を保存した後に、処理済みの行が書き換えられていないか
+
+    末尾に行が追加されただけならTrue。処理済みの行が書き換えられた・削除された場合
+    (直近の取り直しで値が変わった、--full-rebuild で作り直した等) はFalseになるので、全件を再計算する。
+    """
+    path = Path(path)
+    if not path.exists() or path.stat().st_size < state["offset"]:
+        return False
+    with open(path, "rb") as f:
+        return _fingerprint(f, state["offset"]) == state["fingerprint"]
+
+
+def read_new_prices(path: str | Path, state: dict[str, Any] | None) -> tuple[pd.DataFrame, dict[str, Any]]:
+    """
+    株価CSVのうち、状態に記録された位置より後の行だけを読み込む
+
+    処理済みの位置までseekするので、読み込む量は追加された行の分だけになる。
+    indexは全体での行番号になる (pd.read_csvで全件読み込んだ場合と同じ)。
+    先に state_matches で、処理済みの行が書き換えられていないことを確認すること。
+
+    Returns:
+        tuple[pd.DataFrame, dict[str, Any]]: 追加された行と、状態に反映する読み込み位置 (offset, fingerprint)
+    """
+    offset = state["offset"] if state else 0
+    with open(path, "rb") as f:
+        header = f.readline()
+        f.seek(max(offset, len(header)))
+        data = f.read()
+        # 書き込み途中の最後の行は次回に読む
+        data = data[:data.rfind(b"\n") + 1]
+        end = max(offset, len(header)) + len(data)
+        position = {"offset": end, "fingerprint": _fingerprint(f, end)}
+    df = pd.read_csv(io.BytesIO(header + data))
+    df.index += state["rows"] if state else 0
+    return df, position
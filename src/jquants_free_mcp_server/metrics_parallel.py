@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable
+
+import numpy as np
+import pandas as pd
+
+from jquants_free_mcp_server.calc_stock_metrics import RAW_STOCK_CODE, add_stock_metrics, sort_by_code
+
+# 文字列のままではなく日付型にして共有メモリへ載せる列 (結果の日付型の列は同じ書式の文字列に戻す)
+DATE_COLUMNS = ("Date",)
+DATE_FORMAT = "%Y-%m-%d"
+
+# 1ワーカーあたりのチャンク数 (大きな銘柄が偏っても待ち時間がならされるよう、少し細かく分ける)
+CHUNKS_PER_WORKER = 4
+
+INDEX_KEY = "__index__"
+
+# 列名 -> (オフセット, dtype, 要素数)
+Layout = dict[str, tuple[int, str, int]]
+
+
+def default_workers() -> int:
+    """既定のワーカー数 (METRICS_WORKERS 環境変数、未指定ならCPU数)"""
+    return int(os.environ.get("METRICS_WORKERS", 0)) or os.cpu_count() or 1
+
+
+def _to_shared(arrays: dict[str, np.ndarray], track: bool = True) -> tuple[SharedMemory, Layout]:
+    """配列を1つの共有メモリブロックに詰めて、ブロックと配置情報を返す"""
+    layout: Layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = (offset, array.dtype.str, len(array))
+        offset += -(-array.nbytes // 8) * 8  # 8バイト境界に揃える
+    shm = SharedMemory(create=True, size=max(offset, 1), track=track)
+    for name, array in arrays.items():
+        start, dtype, length = layout[name]
+        np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=start)[:] = array
+    return shm, layout
+
+
+def _views(shm: SharedMemory, layout: Layout) -> dict[str, np.ndarray]:
+    return {
+        name: np.ndarray(length, dtype=dtype, buffer=shm.buf, offset=start)
+        for name, (start, dtype, length) in layout.items()
+    }
+
+
+def partition_codes(codes: np.ndarray, n_chunks: int) -> list[tuple[int, int]]:
+    """
+    銘柄ごとに連続した行を、行数がなるべく均等になるようにn_chunks個の範囲に分ける
+
+    範囲の境界は必ず銘柄の切れ目になる (1銘柄を複数のチャンクに分けない)。
+
+    Args:
+        codes (np.ndarray): 銘柄ごとに連続して並んだ銘柄コード
+        n_chunks (int): チャンク数
+
+    Returns:
+        list[tuple[int, int]]: 行範囲 [start, stop) のリスト (行順)
+    """
+    n = len(codes)
+    if n == 0:
+        return []
+    # 各銘柄の先頭行の位置
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    targets = np.arange(1, n_chunks) * n / n_chunks
+    cuts = starts[np.clip(np.searchsorted(starts, targets), 0, len(starts) - 1)]
+    bounds = np.unique(np.r_[0, cuts, n])
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def _encode(df: pd.DataFrame) -> tuple[dict[str, np.ndarray], dict[str, pd.Index]]:
+    """DataFrameを共有メモリに載せられる数値配列にする (文字列列は整数コード化する)"""
+    arrays = {INDEX_KEY: df.index.to_numpy(dtype="int64")}
+    categories: dict[str, pd.Index] = {}
+    for col in df.columns:
+        series = df[col]
+        if col in DATE_COLUMNS:
+            arrays[col] = pd.to_datetime(series, format=DATE_FORMAT).to_numpy(dtype="datetime64[ns]")
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            arrays[col] = series.to_numpy()
+        else:
+            codes, uniques = pd.factorize(series)
+            arrays[col] = codes
+            categories[col] = uniques
+    return arrays, categories
+
+
+def _decode(df: pd.DataFrame, categories: dict[str, pd.Index]) -> pd.DataFrame:
+    for col in df.columns:
+        if col in categories:
+            codes = df[col].to_numpy()
+            df[col] = categories[col].take(codes, allow_fill=True, fill_value=None)
+        elif pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime(DATE_FORMAT)
+    return df
+
+
+def _run_chunk(
+    shm_name: str, layout: Layout, start: int, stop: int, func: Callable[..., pd.DataFrame], kwargs: dict[str, Any]
+) -> tuple[str, Layout, list[str]]:
+    """ワーカー側: 共有メモリの行範囲をDataFrameにしてfuncを実行し、結果を別の共有メモリに書く"""
+    shm = SharedMemory(name=shm_name, track=False)
+    try:
+        # 親のデータを書き換えないよう、チャンク分だけコピーしてから計算する
+        columns = {name: view[start:stop].copy() for name, view in _views(shm, layout).items()}
+    finally:
+        shm.close()
+    index = pd.Index(columns.pop(INDEX_KEY))
+    result = func(pd.DataFrame(columns, index=index), **kwargs)
+
+    arrays = {INDEX_KEY: result.index.to_numpy(dtype="int64")}
+    for col in result.columns:
+        array = result[col].to_numpy()
+        if array.dtype.kind == "O":
+            raise TypeError(f"並列実行では数値・日付以外の列を返せません: {col}")
+        arrays[col] = array
+    out, out_layout = _to_shared(arrays, track=False)
+    out.close()
+    return out.name, out_layout, list(result.columns)
+
+
+def _collect(name: str, layout: Layout, columns: list[str]) -> pd.DataFrame:
+    """親側: ワーカーが書いた共有メモリを読み込んで破棄する"""
+    shm = SharedMemory(name=name, track=False)
+    try:
+        arrays = {col: view.copy() for col, view in _views(shm, layout).items()}
+    finally:
+        shm.close()
+        shm.unlink()
+    index = pd.Index(arrays.pop(INDEX_KEY))
+    return pd.DataFrame({col: arrays[col] for col in columns}, index=index)
+
+
+def run_per_code_parallel(
+    df: pd.DataFrame,
+    func: Callable[..., pd.DataFrame] = add_stock_metrics,
+    workers: int | None = None,
+    **kwargs: Any,
+) -> pd.DataFrame:
+    """
+    銘柄ごとに独立した計算を、銘柄単位のチャンクに分けてプロセスプールで実行する
+
+    DataFrameはpickleせず、列の配列を共有メモリに1度だけ書いて各ワーカーから参照させる。
+    結果もワーカーが共有メモリに書き、親はチャンク順 (= 銘柄の出現順) に連結する。
+    funcは複数銘柄を含むDataFrameを受け取り、数値・日付の列だけを返すトップレベル関数であること。
+
+    Args:
+        df (pd.DataFrame): 株価データ (indexは整数)
+        func (Callable[..., pd.DataFrame], optional): 計算関数. Defaults to add_stock_metrics.
+        workers (int | None, optional): ワーカー数. Noneの場合は default_workers()
+        **kwargs: funcに渡す引数
+
+    Returns:
+        pd.DataFrame: 結果 (workers=1でfuncを直接呼んだ場合と同じ並び)
+    """
+    workers = workers or default_workers()
+    df = sort_by_code(df)
+    if workers <= 1:
+        return func(df, **kwargs)
+
+    arrays, categories = _encode(df)
+    chunks = partition_codes(arrays[RAW_STOCK_CODE], workers * CHUNKS_PER_WORKER)
+    shm, layout = _to_shared(arrays)
+    del arrays
+    try:
+        # forkはスレッドを使うライブラリ (polars, BLAS) と相性が悪いため、常にspawnで起動する
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_run_chunk, shm.name, layout, start, stop, func, kwargs) for start, stop in chunks]
+            outputs, errors = [], []
+            for future in futures:
+                try:
+                    outputs.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # 失敗したチャンクがあっても、成功したチャンクの共有メモリは必ず破棄する
+    frames = [_collect(*output) for output in outputs]
+    if errors:
+        raise errors[0]
+
+    if not frames:
+        return func(df, **kwargs)
+    return _decode(pd.concat(frames), categories)
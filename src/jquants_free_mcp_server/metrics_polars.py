@@ -0,0 +1,137 @@
+from pathlib import Path
+
+import pandas as pd
+import polars as pl
+
+from jquants_free_mcp_server.calc_stock_metrics import (
+    CLOSE_COL,
+    DAYS_OF_TARGET,
+    LONG_DAYS,
+    LOW_COL,
+    MIDDLE_DAYS,
+    PRICE_INPUT_COLUMNS,
+    RAW_STOCK_CODE,
+    SHORT_DAYS,
+    SMA_OVER_DISTANCES,
+    VOLUME_COL,
+)
+
+# 元のCSVの行番号 (pandas版のindexに相当する)
+ROW_INDEX_COL = "_row"
+
+
+def scan_stock_prices(path: str | Path) -> pl.LazyFrame:
+    """
+    株価CSVまたはParquetデータセット (parquet_storage) を遅延読み込みする
+
+    pandas版 (calc_stock_metrics.load_stock_prices) と結果を揃えるため、行番号を
+    ROW_INDEX_COL 列として付与する。Parquetは必要な列だけを読み、日付順に並べ、
+    日付は文字列・価格はfloat64に戻す。
+
+    Args:
+        path (str | Path): 株価CSVのパス、またはデータセットのディレクトリ
+
+    Returns:
+        pl.LazyFrame: 株価データ
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return pl.scan_csv(path).with_row_index(ROW_INDEX_COL)
+
+    lf = pl.scan_parquet(path / "**" / "*.parquet", hive_partitioning=True).select(PRICE_INPUT_COLUMNS)
+    lf = lf.sort("Date", maintain_order=True).with_columns(
+        pl.col("Date").dt.to_string("%Y-%m-%d"),
+        pl.col(RAW_STOCK_CODE).cast(pl.String),
+        pl.col(PRICE_INPUT_COLUMNS[2:]).cast(pl.Float64),
+    )
+    return lf.with_row_index(ROW_INDEX_COL)
+
+
+def _sma(col: str, window: int) -> pl.Expr:
+    return pl.col(col).rolling_mean(window_size=window, min_samples=window).over(RAW_STOCK_CODE)
+
+
+def add_ma_dev_rate(lf: pl.LazyFrame, short: int = 25, middle: int = 75, long: int = 200) -> pl.LazyFrame:
+    """移動平均および乖離率、パーフェクトオーダーかどうかを追加する (calc_stock_metrics.add_ma_dev_rate と同じ列)"""
+    lf = lf.with_columns(
+        _sma(CLOSE_COL, short).alias(f"SMA{short}"),
+        _sma(CLOSE_COL, middle).alias(f"SMA{middle}"),
+        _sma(CLOSE_COL, long).alias(f"SMA{long}"),
+    )
+    return lf.with_columns(
+        *[
+            ((pl.col(CLOSE_COL) - pl.col(f"SMA{n}")) / pl.col(f"SMA{n}") * 100).alias(f"SMA{n}_乖離率")
+            for n in (short, middle, long)
+        ],
+        ((pl.col(f"SMA{short}") > pl.col(f"SMA{middle}")) & (pl.col(f"SMA{middle}") > pl.col(f"SMA{long}")))
+        .fill_null(False)
+        .cast(pl.Int64)
+        .alias("PerfectOrder"),
+    )
+
+
+def add_metrics_kaidan(lf: pl.LazyFrame, days: int) -> pl.LazyFrame:
+    """HigherLowDays と HighVolumeDates を追加する (calc_stock_metrics.add_metrics_kaidan と同じ列)"""
+    lf = lf.with_columns(pl.col(LOW_COL).forward_fill().over(RAW_STOCK_CODE))
+    higher_low = (pl.col(LOW_COL) >= pl.col(LOW_COL).shift(1)).fill_null(False).cast(pl.Int64)
+    high_volume = pl.col(VOLUME_COL) >= _sma(VOLUME_COL, days) * 5
+    return lf.with_columns(
+        higher_low.cum_sum().over(RAW_STOCK_CODE).alias("HigherLowDays"),
+        pl.when(high_volume).then(pl.col("Date")).forward_fill().over(RAW_STOCK_CODE).alias("HighVolumeDates"),
+    )
+
+
+def SMA_over(lf: pl.LazyFrame, n: int, distance: str = "index") -> pl.LazyFrame:
+    """tanki_SMA, is_tanki_SMA_over, terms_SMA_over を追加する (calc_stock_metrics.SMA_over と同じ列)"""
+    if distance == "index":
+        position = pl.col(ROW_INDEX_COL).cast(pl.Float64)
+    elif distance == "trading_days":
+        position = pl.int_range(pl.len()).over(RAW_STOCK_CODE).cast(pl.Float64)
+    else:
+        raise ValueError(f"distanceは {SMA_OVER_DISTANCES} のいずれかを指定してください: {distance}")
+
+    lf = lf.with_columns(_sma(CLOSE_COL, n).alias("tanki_SMA"))
+    lf = lf.with_columns(
+        (pl.col(CLOSE_COL) > pl.col("tanki_SMA")).fill_null(False).cast(pl.Int64).alias("is_tanki_SMA_over")
+    )
+    last_over = pl.when(pl.col("is_tanki_SMA_over") == 1).then(position).forward_fill()
+    return lf.with_columns((position - last_over).over(RAW_STOCK_CODE).alias("terms_SMA_over"))
+
+
+def add_stock_metrics(lf: pl.LazyFrame, distance: str = "index") -> pl.LazyFrame:
+    """
+    全銘柄分にメトリクスを追加する (pandas版 add_stock_metrics のpolars実装)
+
+    銘柄ごとの計算はすべて over(Code) のウィンドウ式で表し、collect時に全コアで実行される。
+    行の並びはpandas版と同じく、銘柄の出現順・元の行順になる。
+
+    Args:
+        lf (pl.LazyFrame): scan_stock_prices で読み込んだ株価データ
+        distance (str, optional): terms_SMA_overの数え方. Defaults to "index".
+
+    Returns:
+        pl.LazyFrame: メトリクス追加後のデータ
+    """
+    if ROW_INDEX_COL not in lf.collect_schema().names():
+        lf = lf.with_row_index(ROW_INDEX_COL)
+    first_row = pl.col(ROW_INDEX_COL).min().over(RAW_STOCK_CODE)
+    lf = lf.sort(first_row, ROW_INDEX_COL)
+
+    lf = add_ma_dev_rate(lf, short=SHORT_DAYS, middle=MIDDLE_DAYS, long=LONG_DAYS)
+    lf = add_metrics_kaidan(lf, DAYS_OF_TARGET)
+    return SMA_over(lf, SHORT_DAYS, distance=distance)
+
+
+def to_pandas(df: pl.DataFrame) -> pd.DataFrame:
+    """ROW_INDEX_COL をindexに戻してpandas.DataFrameに変換する"""
+    pdf = df.with_columns(pl.col(ROW_INDEX_COL).cast(pl.Int64)).to_pandas()
+    return pdf.set_index(ROW_INDEX_COL).rename_axis(None)
+
+
+def verify_against_pandas(expected: pd.DataFrame, actual: pd.DataFrame, rtol: float = 1e-9) -> None:
+    """
+    polars版の結果がpandas版と一致することを確認する (不一致ならAssertionError)
+
+    移動平均は加算順の違いで最下位桁が揺れるため、浮動小数点の列は相対誤差rtolで比較する。
+    """
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_categorical=False, rtol=rtol)
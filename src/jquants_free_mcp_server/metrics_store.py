@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+# pandasはストアの作成時だけ使う (サーバーは読み込みだけなのでpandasなしで動く)
+if TYPE_CHECKING:
+    import pandas as pd
+
+TABLE = "stock_metrics"
+KEY_COLUMNS = ("Code", "Date")
+
+# screen の条件で使える比較 (数値の列のみ)
+RANGE_OPERATORS = {"min": ">=", "max": "<=", "gt": ">", "lt": "<"}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def normalize_code(code: str | int) -> str:
+    """4桁の銘柄コードを、株価データと同じ5桁 (末尾0) にそろえる"""
+    code = str(code).strip()
+    return code + "0" if len(code) == 4 else code
+
+
+def _sql_type(series: "pd.Series") -> str:
+    import pandas as pd
+
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(series):
+        return "REAL"
+    return "TEXT"
+
+
+def build_metrics_store(df: "pd.DataFrame", path: str | Path) -> Path:
+    """
+    calc_stock_metrics の結果から (Code, Date) を主キーとするSQLiteのストアを作る
+
+    作成中のファイルに書き込んでから置き換えるので、サーバーが読み込み中でも壊れない。
+
+    Args:
+        df (pd.DataFrame): メトリクス (Code, Date列を含む)
+        path (str | Path): 保存先
+
+    Returns:
+        Path: 保存先
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df = df.drop(columns=[c for c in df.columns if str(c).startswith("Unnamed") or c == "_row"])
+    df = df.assign(Code=df["Code"].astype(str).map(normalize_code), Date=df["Date"].astype(str))
+    df = df.drop_duplicates(subset=list(KEY_COLUMNS), keep="last")
+    value_columns = [c for c in df.columns if c not in KEY_COLUMNS]
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        columns_sql = ", ".join(
+            ["Code TEXT NOT NULL", "Date TEXT NOT NULL"]
+            + [f"{_quote(c)} {_sql_type(df[c])}" for c in value_columns]
+        )
+        conn.execute(f"CREATE TABLE {TABLE} ({columns_sql}, PRIMARY KEY (Code, Date)) WITHOUT ROWID")
+        ordered = df[list(KEY_COLUMNS) + value_columns]
+        # NaNはNULLとして保存する
+        rows = ordered.astype(object).where(ordered.notna(), None).itertuples(index=False, name=None)
+        placeholders = ", ".join("?" * len(ordered.columns))
+        conn.executemany(f"INSERT INTO {TABLE} VALUES ({placeholders})", rows)
+        # 日付を指定したスクリーニング用の索引 (データを入れた後に作る)
+        conn.execute(f"CREATE INDEX ix_{TABLE}_date ON {TABLE} (Date)")
+        conn.commit()
+    finally:
+        conn.close()
+    tmp_path.replace(path)
+    return path
+
+
+class MetricsStore:
+    """
+    計算済みテクニカル指標のストア (SQLite、(Code, Date) の主キー)
+
+    銘柄・期間の取得は主キー、日付を指定したスクリーニングはDateの索引で引く。
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"メトリクスのストアがありません: {self.path}")
+        self._lock = threading.Lock()
+        self._file_id = self._stat()
+        self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        columns = self._conn.execute(f"PRAGMA table_info({TABLE})").fetchall()
+        self.fields = [c["name"] for c in columns]
+        self.numeric_fields = {c["name"] for c in columns if c["type"] in ("INTEGER", "REAL")}
+
+    def _stat(self) -> tuple[int, int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def is_stale(self) -> bool:
+        """
+        開いた後にファイルが置き換えられたか (build_metrics_store で作り直された・削除された)
+
+        開いている接続は置き換える前のファイルを読み続けるので、Trueなら開き直す。
+        """
+        return self._stat() != self._file_id
+
+    def _select(self, fields: list[str] | None) -> str:
+        if fields is None:
+            return "*"
+        return ", ".join(_quote(f) for f in dict.fromkeys([*KEY_COLUMNS, *fields]))
+
+    def unknown_fields(self, fields: list[str] | None) -> list[str]:
+        """存在しない列名を返す"""
+        return [f for f in fields or [] if f not in self.fields]
+
+    def get(
+        self,
+        code: str,
+        from_date: str | None = None,
+        to_date: str | None = None,
+        fields: list[str] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        銘柄の指標を日付順に返す
+
+        Args:
+            code (str): 銘柄コード (4桁/5桁)
+            from_date (str | None, optional): 開始日 (YYYY-MM-DD、この日を含む)
+            to_date (str | None, optional): 終了日 (YYYY-MM-DD、この日を含む)
+            fields (list[str] | None, optional): 返す列. Noneの場合は全列
+
+        Returns:
+            list[dict[str, Any]]: 指標のレコード
+        """
+        sql = f"SELECT {self._select(fields)} FROM {TABLE} WHERE Code = ? AND Date BETWEEN ? AND ? ORDER BY Date"
+        params = (normalize_code(code), from_date or "0000-00-00", to_date or "9999-99-99")
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def screen(
+        self,
+        date: str,
+        conditions: dict[str, Any],
+        fields: list[str] | None = None,
+        limit: int = 100,
+    ) -> list[dict[str, Any]]:
+        """
+        指定日に条件を満たす銘柄を返す
+
+        Args:
+            date (str): 日付 (YYYY-MM-DD)
+            conditions (dict[str, Any]): 列名 -> 値 (一致) または {"min"/"max"/"gt"/"lt": 値} (範囲)
+            fields (list[str] | None, optional): 返す列. Noneの場合は条件に使った列
+            limit (int, optional): 最大件数. Defaults to 100.
+
+        Returns:
+            list[dict[str, Any]]: 条件を満たす銘柄のレコード (銘柄コード順)
+        """
+        where = ["Date = ?"]
+        params: list[Any] = [date]
+        for name, condition in conditions.items():
+            if name not in self.fields:
+                raise ValueError(f"不明な列です: {name}")
+            if isinstance(condition, dict):
+                if name not in self.numeric_fields:
+                    raise ValueError(f"範囲の条件は数値の列にのみ指定できます: {name}")
+                for op, value in condition.items():
+                    if op not in RANGE_OPERATORS:
+                        raise ValueError(f"不明な比較です: {op} (対応: {', '.join(RANGE_OPERATORS)})")
+                    where.append(f"{_quote(name)} {RANGE_OPERATORS[op]} ?")
+                    params.append(value)
+            else:
+                where.append(f"{_quote(name)} = ?")
+                params.append(condition)
+
+        sql = (
+            f"SELECT {self._select(fields if fields is not None else list(conditions))} FROM {TABLE} "
+            f"WHERE {' AND '.join(where)} ORDER BY Code LIMIT ?"
+        )
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, [*params, limit])]
+
+    def latest_date(self) -> str | None:
+        """ストアに含まれる最新の日付"""
+        with self._lock:
+            return self._conn.execute(f"SELECT MAX(Date) FROM {TABLE}").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="calc_stock_metrics の結果からメトリクスのストアを作る")
+    parser.add_argument("source", help="結果のCSV、Parquetファイル、またはParquetデータセットのディレクトリ")
+    parser.add_argument("--output", default="data/stock_metrics.sqlite3")
+    args = parser.parse_args()
+
+    source = Path(args.source)
+    if source.is_dir():
+        from jquants_free_mcp_server import parquet_storage
+        metrics = parquet_storage.read_dataset(source.name, root=source.parent)
+    elif source.suffix == ".parquet":
+        metrics = pd.read_parquet(source)
+    else:
+        metrics = pd.read_csv(source, index_col=0)
+    print(f"{len(metrics)}行を保存しました: {build_metrics_store(metrics, args.output)}")
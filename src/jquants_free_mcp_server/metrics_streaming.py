@@ -0,0 +1,193 @@
+import math
+import tempfile
+from pathlib import Path
+from typing import Any, Iterator
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from jquants_free_mcp_server import parquet_storage
+from jquants_free_mcp_server.calc_stock_metrics import PRICE_INPUT_COLUMNS, RAW_STOCK_CODE, add_stock_metrics
+
+# 既定のメモリ上限 (MB)
+DEFAULT_MEMORY_LIMIT_MB = 512
+
+# 一時ファイルに振り分けるときの銘柄グループ数 (計算時は上限に収まる範囲でまとめて読む。
+# 1回で計算できる行数を超えた一時ファイルは、さらに細かく振り分け直す)
+SPILL_PARTITIONS = 64
+
+# 振り分け直すときに、一時ファイルの行数 / 1回で計算できる行数 の何倍に分けるか (ハッシュの偏りの分の余裕)
+RESPLIT_FACTOR = 2
+
+# メトリクス計算中のメモリ使用量 / 読み込んだ株価のメモリ使用量 の見積もり
+# (追加される12列と、rolling/groupbyの一時領域を含む)
+METRICS_MEMORY_FACTOR = 6
+
+# CSVを読み込むときの1チャンクの行数の見積もりに使う、1行あたりのバイト数
+ESTIMATED_ROW_BYTES = 200
+
+ROW_INDEX_COL = "_row"
+
+
+def _read_chunks(price_path: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """株価を行番号付きのチャンクで読み込む (CSVはchunksize、Parquetは年月パーティション単位)"""
+    if price_path.is_dir():
+        offset = 0
+        for df in parquet_storage.iter_partitions(price_path.name, PRICE_INPUT_COLUMNS, root=price_path.parent):
+            df.index += offset
+            offset += len(df)
+            yield df.astype({col: "float64" for col in PRICE_INPUT_COLUMNS[2:]})
+    else:
+        # read_csvのchunksizeはindexを通し番号で振るので、全件を読み込んだ場合と同じ行番号になる
+        yield from pd.read_csv(price_path, chunksize=chunk_rows)
+
+
+def _spill_partition(codes: pd.Series, partitions: int, level: int = 0) -> pd.Series:
+    # チャンクによってCodeが整数/文字列のどちらで読まれても同じ振り分け先になるよう、文字列でハッシュする。
+    # 振り分け直すときは、同じ振り分けにならないよう段階ごとにハッシュのキーを変える
+    hashed = pd.util.hash_pandas_object(codes.astype(str), index=False, hash_key=f"stock_metrics{level:03d}")
+    return (hashed % partitions).astype(int)
+
+
+def _spill(chunks: Iterator[pd.DataFrame], paths: list[Path], level: int) -> list[int]:
+    """チャンクの行を銘柄コードのハッシュで一時ファイルに振り分け、ファイルごとの行数を返す"""
+    rows_per_path = [0] * len(paths)
+    for chunk in chunks:
+        for partition, rows in chunk.groupby(_spill_partition(chunk[RAW_STOCK_CODE], len(paths), level)):
+            rows.to_csv(paths[partition], mode="a", header=not rows_per_path[partition])
+            rows_per_path[partition] += len(rows)
+    return rows_per_path
+
+
+def _read_spill(path: Path, chunk_rows: int | None = None) -> Any:
+    return pd.read_csv(path, index_col=0, float_precision="round_trip", chunksize=chunk_rows)
+
+
+def _fit_partitions(spills: list[tuple[Path, int]], budget_rows: int, chunk_rows: int) -> list[tuple[Path, int]]:
+    """
+    1回で計算できる行数 (budget_rows) を超えた一時ファイルを、収まるまで細かく振り分け直す
+
+    Raises:
+        ValueError: 1銘柄の行数だけで budget_rows を超える場合
+    """
+    fitted = []
+    pending = [(path, rows, 1) for path, rows in spills]
+    while pending:
+        path, rows, level = pending.pop()
+        if rows <= budget_rows:
+            fitted.append((path, rows))
+            continue
+        parts = math.ceil(rows / budget_rows) * RESPLIT_FACTOR
+        paths = [path.with_name(f"{path.stem}-{i}.csv") for i in range(parts)]
+        split_rows = _spill(_read_spill(path, chunk_rows), paths, level)
+        path.unlink()
+        if max(split_rows) == rows:
+            # 全て同じファイルに振り分けられた場合は1銘柄だけの可能性がある
+            part = paths[split_rows.index(rows)]
+            codes = set().union(*(set(df[RAW_STOCK_CODE].astype(str)) for df in _read_spill(part, chunk_rows)))
+            if len(codes) == 1:
+                raise ValueError(f"銘柄{codes.pop()}の株価({rows}行)がメモリ上限に収まりません。"
+                                 f"memory_limit_mbを大きくしてください")
+        pending.extend((part, part_rows, level + 1) for part, part_rows in zip(paths, split_rows) if part_rows)
+    return sorted(fitted)
+
+
+class _ResultWriter:
+    """計算結果を1ファイルに追記する (拡張子 .parquet ならParquet、それ以外はCSV)"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.rows = 0
+        self._parquet = path.suffix == ".parquet"
+        self._writer: pq.ParquetWriter | None = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self._parquet:
+            table = parquet_storage.to_compact_table(df.reset_index(names=ROW_INDEX_COL))
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression="zstd")
+            self._writer.write_table(parquet_storage.conform_table(table, self._writer.schema))
+        else:
+            df.to_csv(self.path, mode="a" if self.rows else "w", header=not self.rows)
+        self.rows += len(df)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+def stream_stock_metrics(
+    price_path: str | Path,
+    output_path: str | Path,
+    memory_limit_mb: float = DEFAULT_MEMORY_LIMIT_MB,
+    distance: str = "index",
+    spill_partitions: int = SPILL_PARTITIONS,
+) -> dict[str, Any]:
+    """
+    株価を全件メモリに載せずに、銘柄のグループごとにメトリクスを計算して書き出す
+
+    1. 株価をチャンクで読み込み、銘柄コードのハッシュで一時ファイル (spill_partitions個) に振り分ける
+    2. 1回で計算できる行数を超えた一時ファイルは、収まるまで細かく振り分け直す
+    3. 行数の合計が memory_limit_mb に収まるように一時ファイルをまとめて読み、
+       add_stock_metrics で計算して output_path に追記する
+
+    ある銘柄の行はすべて同じ一時ファイルに入るので、結果は全件を一度に計算した場合と
+    同じ値・同じindex (行番号) になる。行の並びは銘柄グループ順になる。
+
+    Args:
+        price_path (str | Path): 株価CSV、またはParquetデータセットのディレクトリ
+        output_path (str | Path): 結果の保存先 (.parquet ならParquet、それ以外はCSV)
+        memory_limit_mb (float, optional): 1回に計算するデータのメモリ上限の目安 (MB)
+        distance (str, optional): terms_SMA_overの数え方. Defaults to "index".
+        spill_partitions (int, optional): 最初に振り分ける一時ファイルの数. Defaults to SPILL_PARTITIONS.
+
+    Returns:
+        dict[str, Any]: 行数、計算した回数、1回に計算した最大行数、1回で計算できる行数、一時ファイルの数
+
+    Raises:
+        ValueError: 1銘柄の行数だけで memory_limit_mb を超える場合
+    """
+    price_path = Path(price_path)
+    limit_bytes = memory_limit_mb * 1024 * 1024
+    chunk_rows = max(1000, int(limit_bytes / ESTIMATED_ROW_BYTES / METRICS_MEMORY_FACTOR))
+
+    with tempfile.TemporaryDirectory(prefix="stock_metrics_") as tmp:
+        spill_paths = [Path(tmp) / f"part-{i}.csv" for i in range(spill_partitions)]
+        row_bytes = None
+
+        def measured(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+            nonlocal row_bytes
+            for chunk in chunks:
+                if row_bytes is None and len(chunk):
+                    row_bytes = chunk.memory_usage(deep=True).sum() / len(chunk)
+                yield chunk
+
+        spill_rows = _spill(measured(_read_chunks(price_path, chunk_rows)), spill_paths, level=0)
+
+        # 1回の計算で扱える行数
+        budget_rows = max(1, math.floor(limit_bytes / ((row_bytes or ESTIMATED_ROW_BYTES) * METRICS_MEMORY_FACTOR)))
+        spills = _fit_partitions([(path, rows) for path, rows in zip(spill_paths, spill_rows) if rows],
+                                 budget_rows, min(chunk_rows, budget_rows))
+        batches, batch, batch_rows = [], [], 0
+        for path, rows in spills:
+            if batch and batch_rows + rows > budget_rows:
+                batches.append(batch)
+                batch, batch_rows = [], 0
+            batch.append(path)
+            batch_rows += rows
+        if batch:
+            batches.append(batch)
+
+        writer = _ResultWriter(Path(output_path))
+        max_batch_rows = 0
+        try:
+            for batch in batches:
+                df = pd.concat([_read_spill(path) for path in batch])
+                df.index.name = None
+                max_batch_rows = max(max_batch_rows, len(df))
+                writer.write(add_stock_metrics(df.sort_index(), distance=distance))
+        finally:
+            writer.close()
+
+    return {"rows": writer.rows, "batches": len(batches), "max_batch_rows": max_batch_rows,
+            "budget_rows": budget_rows, "spill_partitions": len(spills)}
@@ -0,0 +1,276 @@
+from datetime import date
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+# Parquetデータセットの保存先 (data/parquet/<データセット名>/year=YYYY/month=M/*.parquet)
+PARQUET_PATH = Path("data") / Path("parquet")
+
+# データセットごとの日付列 (年月パーティションの基準)
+DATASET_DATE_COLUMNS = {
+    "stock_list": "Date",
+    "stock_price": "Date",
+    "stock_fin": "DisclosedDate",
+    "markets_trades_spec": "PublishedDate",
+    "topix": "Date",
+    "option": "Date",
+    "margin_interest": "Date",
+    "short_selling": "Date",
+    "stock_metrics": "Date",
+}
+
+# 日付型(date32)で保存する列
+DATE_COLUMNS = {"Date", "DisclosedDate", "PublishedDate", "StartDate", "EndDate", "CurrentPeriodEndDate",
+                "CurrentFiscalYearStartDate", "CurrentFiscalYearEndDate", "HighVolumeDates"}
+
+# 辞書エンコード (pandasではcategorical) で保存する列
+CATEGORY_COLUMNS = {"Code", "Section", "Sector17Code", "Sector33Code", "MarketCode", "ScaleCategory",
+                    "TypeOfDocument", "TypeOfCurrentPeriod"}
+
+# float32で保存する価格の列 (出来高・売買代金はfloat64のまま)
+PRICE_COLUMNS = {"Open", "High", "Low", "Close", "AdjustmentOpen", "AdjustmentHigh", "AdjustmentLow",
+                 "AdjustmentClose", "MorningOpen", "MorningHigh", "MorningLow", "MorningClose",
+                 "AfternoonOpen", "AfternoonHigh", "AfternoonLow", "AfternoonClose", "WholeDayOpen",
+                 "WholeDayHigh", "WholeDayLow", "WholeDayClose", "SettlementPrice", "TheoreticalPrice"}
+
+PARTITION_COLUMNS = ("year", "month")
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16()), ("month", pa.int8())]), flavor="hive")
+
+
+def _date_column(dataset: str) -> str:
+    try:
+        return DATASET_DATE_COLUMNS[dataset]
+    except KeyError:
+        raise ValueError(f"未知のデータセットです: {dataset} (対応: {', '.join(DATASET_DATE_COLUMNS)})") from None
+
+
+def to_compact_table(df: Any) -> pa.Table:
+    """
+    DataFrameを保存用のArrowテーブルに変換する
+
+    銘柄コードなどは辞書エンコード、価格はfloat32、日付はdate32にする。
+
+    Args:
+        df (Any): pandasまたはpolarsのDataFrame
+
+    Returns:
+        pa.Table: 変換後のテーブル
+    """
+    table = df.to_arrow() if hasattr(df, "to_arrow") else pa.Table.from_pandas(df, preserve_index=False)
+    columns = []
+    for name, column in zip(table.column_names, table.columns):
+        if name in DATE_COLUMNS and not pa.types.is_date32(column.type):
+            if column.null_count == len(column):
+                column = pa.nulls(len(column), pa.date32())
+            elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+                # 空文字は欠損として扱う
+                column = pc.if_else(pc.equal(column, ""), pa.scalar(None, column.type), column)
+                column = pc.cast(pc.strptime(column, format="%Y-%m-%d", unit="s"), pa.date32())
+            else:
+                column = pc.cast(column, pa.date32())
+        elif name in CATEGORY_COLUMNS and not pa.types.is_dictionary(column.type):
+            column = pc.dictionary_encode(pc.cast(column, pa.string()))
+        elif name in PRICE_COLUMNS and pa.types.is_floating(column.type):
+            column = pc.cast(column, pa.float32())
+        columns.append(column)
+    return pa.table(columns, names=table.column_names)
+
+
+def conform_table(table: pa.Table, schema: pa.Schema) -> pa.Table:
+    """
+    チャンクごとに型がぶれる列 (全て欠損の列など) を最初のチャンクの型に揃える
+
+    schemaにない列は捨て、テーブルにない列は欠損で埋める。
+    """
+    columns = []
+    for field in schema:
+        if field.name not in table.column_names:
+            columns.append(pa.nulls(len(table), field.type))
+            continue
+        column = table.column(field.name)
+        if column.type != field.type:
+            column = pa.nulls(len(column), field.type) if column.null_count == len(column) else column.cast(field.type)
+        columns.append(column)
+    return pa.table(columns, schema=schema)
+
+
+def write_dataset(df: Any, dataset: str, root: str | Path = PARQUET_PATH) -> Path:
+    """
+    DataFrameを年月でパーティション分割したParquetとして保存する
+
+    書き込み対象の年月のパーティションは置き換える (他の年月はそのまま) ため、
+    同じ期間を何度書き込んでも行が重複しない。
+
+    Args:
+        df (Any): pandasまたはpolarsのDataFrame
+        dataset (str): データセット名 (DATASET_DATE_COLUMNS のキー)
+        root (str | Path, optional): 保存先. Defaults to PARQUET_PATH.
+
+    Returns:
+        Path: データセットのディレクトリ
+    """
+    date_col = _date_column(dataset)
+    table = to_compact_table(df)
+    dates = table.column(date_col)
+    table = table.append_column("year", pc.cast(pc.year(dates), pa.int16()))
+    table = table.append_column("month", pc.cast(pc.month(dates), pa.int8()))
+
+    path = Path(root) / dataset
+    ds.write_dataset(
+        table,
+        path,
+        format="parquet",
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        basename_template="part-{i}.parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        # 読み込み時に元の行順で返せるよう、パーティション内の行順を保つ
+        preserve_order=True,
+    )
+    return path
+
+
+def open_dataset(dataset: str, root: str | Path = PARQUET_PATH) -> ds.Dataset:
+    """保存済みのデータセットをメモリマップで開く"""
+    path = Path(root) / dataset
+    if not path.exists():
+        raise FileNotFoundError(f"データセットがありません: {path}")
+    return ds.dataset(
+        str(path),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def _to_date(value: str | date) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def build_filter(
+    dataset: str,
+    codes: Iterable[str | int] | None = None,
+    start: str | date | None = None,
+    end: str | date | None = None,
+) -> ds.Expression | None:
+    """
+    銘柄コードと期間の条件式を作る
+
+    期間の条件は年月パーティションの条件も付けるので、対象外の年月のファイルは開かない。
+    """
+    date_col = _date_column(dataset)
+    conditions = []
+    if start is not None:
+        start = _to_date(start)
+        conditions.append(
+            (ds.field("year") > start.year) | ((ds.field("year") == start.year) & (ds.field("month") >= start.month))
+        )
+        conditions.append(ds.field(date_col) >= pa.scalar(start, pa.date32()))
+    if end is not None:
+        end = _to_date(end)
+        conditions.append(
+            (ds.field("year") < end.year) | ((ds.field("year") == end.year) & (ds.field("month") <= end.month))
+        )
+        conditions.append(ds.field(date_col) <= pa.scalar(end, pa.date32()))
+    if codes is not None:
+        conditions.append(ds.field("Code").isin([str(code) for code in codes]))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_table(
+    dataset: str,
+    columns: list[str] | None = None,
+    codes: Iterable[str | int] | None = None,
+    start: str | date | None = None,
+    end: str | date | None = None,
+    root: str | Path = PARQUET_PATH,
+) -> pa.Table:
+    """
+    データセットから必要な列・行だけを読み込む
+
+    列の指定はParquetの列単位の読み込み、銘柄コード・期間の条件は
+    パーティションと行グループ統計による読み飛ばしに使われる。
+
+    Args:
+        dataset (str): データセット名
+        columns (list[str] | None, optional): 読み込む列. Noneの場合は全列 (year/monthは除く)
+        codes (Iterable[str | int] | None, optional): 銘柄コード
+        start (str | date | None, optional): 開始日 (この日を含む)
+        end (str | date | None, optional): 終了日 (この日を含む)
+        root (str | Path, optional): 保存先. Defaults to PARQUET_PATH.
+
+    Returns:
+        pa.Table: 読み込んだテーブル
+    """
+    dataset_obj = open_dataset(dataset, root)
+    if columns is None:
+        columns = [name for name in dataset_obj.schema.names if name not in PARTITION_COLUMNS]
+    expression = build_filter(dataset, codes, start, end)
+    table = dataset_obj.to_table(columns=columns, filter=expression)
+    # パーティションのディレクトリは文字列順 (month=10 が month=2 より前) に読まれるため、
+    # 日付で安定ソートして書き込んだときの行順に戻す
+    date_col = _date_column(dataset)
+    if date_col in table.column_names:
+        table = table.sort_by([(date_col, "ascending")])
+    return table
+
+
+def _to_pandas(table: pa.Table) -> pd.DataFrame:
+    df = table.to_pandas()
+    for name, column_type in zip(table.column_names, table.schema.types):
+        if pa.types.is_date32(column_type):
+            df[name] = pd.to_datetime(df[name]).dt.strftime("%Y-%m-%d")
+    return df
+
+
+def iter_partitions(
+    dataset: str, columns: list[str] | None = None, root: str | Path = PARQUET_PATH
+) -> Iterator[pd.DataFrame]:
+    """
+    データセットを年月パーティションごとに、古い順に読み込む
+
+    1度に読み込むのは1か月分だけなので、全期間を読み込むよりメモリが少なくて済む。
+    各DataFrameは read_dataset と同じ型・行順になる。
+    """
+    dataset_obj = open_dataset(dataset, root)
+    if columns is None:
+        columns = [name for name in dataset_obj.schema.names if name not in PARTITION_COLUMNS]
+    date_col = _date_column(dataset)
+
+    def partition_key(fragment: ds.Fragment) -> tuple[int, int]:
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        return keys["year"], keys["month"]
+
+    fragments = sorted(dataset_obj.get_fragments(), key=partition_key)
+    for key, group in groupby(fragments, key=partition_key):
+        table = pa.concat_tables(fragment.to_table(columns=columns, schema=dataset_obj.schema) for fragment in group)
+        if date_col in table.column_names:
+            table = table.sort_by([(date_col, "ascending")])
+        yield _to_pandas(table)
+
+
+def read_dataset(
+    dataset: str,
+    columns: list[str] | None = None,
+    codes: Iterable[str | int] | None = None,
+    start: str | date | None = None,
+    end: str | date | None = None,
+    root: str | Path = PARQUET_PATH,
+) -> pd.DataFrame:
+    """
+    read_table の結果をpandas.DataFrameで返す
+
+    辞書エンコードした列はcategorical、日付列は文字列 (YYYY-MM-DD) になる。
+    日付を文字列に戻すのは、CSVから読み込んだ場合と同じように扱えるようにするため。
+    """
+    return _to_pandas(read_table(dataset, columns, codes, start, end, root))
@@ -0,0 +1,107 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable
+
+# J-Quants APIのプラン別レート制限 (リクエスト/分)
+PLAN_RATE_LIMITS = {"free": 5, "light": 60, "standard": 120, "premium": 500}
+
+
+def requests_per_minute_from_env() -> float:
+    """JQUANTS_RATE_LIMIT_PER_MINUTE の値 (未指定なら JQUANTS_PLAN のプランの上限) を返す"""
+    plan = os.environ.get("JQUANTS_PLAN", "free").lower()
+    return float(os.environ.get("JQUANTS_RATE_LIMIT_PER_MINUTE", PLAN_RATE_LIMITS.get(plan, 5)))
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレートリミッタ (asyncio用)
+
+    rate件/秒でトークンを補充し、最大capacity件まで貯める。
+    トークンが足りない場合は補充されるまで待機する。
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rateは正の値を指定してください")
+        if capacity < 1:
+            raise ValueError("capacityは1以上を指定してください")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float, burst: float = 1.0) -> "TokenBucket":
+        """1分あたりのリクエスト数からリミッタを作る"""
+        return cls(requests_per_minute / 60.0, burst)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """
+        トークンを取得する (不足時は待機)
+
+        Args:
+            tokens (float, optional): 消費するトークン数. Defaults to 1.0.
+        """
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class BlockingTokenBucket:
+    """
+    TokenBucket のスレッド版
+
+    同期的なクライアント (jquantsapi) を複数のスレッドから呼ぶ場合に、
+    全スレッドのリクエストの合計をrate件/秒に抑える。
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rateは正の値を指定してください")
+        if capacity < 1:
+            raise ValueError("capacityは1以上を指定してください")
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float, burst: float = 1.0) -> "BlockingTokenBucket":
+        """1分あたりのリクエスト数からリミッタを作る"""
+        return cls(requests_per_minute / 60.0, burst)
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """トークンを取得する (不足時は待機。待機中は他のスレッドも順番を待つ)"""
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                time.sleep((tokens - self._tokens) / self.rate)
+
+    def wrap(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        """呼び出すたびにトークンを1つ取得してからfuncを呼ぶ関数を返す"""
+
+        @functools.wraps(func)
+        def limited(*args: Any, **kwargs: Any) -> Any:
+            self.acquire()
+            return func(*args, **kwargs)
+
+        return limited
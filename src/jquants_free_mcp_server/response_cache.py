@@ -0,0 +1,141 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from jquants_free_mcp_server import json_backend
+
+
+class ResponseCache:
+    """
+    J-Quants APIレスポンスの永続キャッシュ (SQLite)
+
+    エントリは有効期限付き (TTL) か、期限なし (不変データ) のどちらかで保存する。
+    ヒット/ミスの件数はプロセス内で集計し、stats() で参照できる。
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                body BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+        self._conn.commit()
+        self._counters: dict[str, dict[str, int]] = {}
+        self.purge_expired()
+
+    def _count(self, endpoint: str, name: str) -> None:
+        counters = self._counters.setdefault(endpoint, {"hits": 0, "misses": 0, "expired": 0, "stores": 0})
+        counters[name] += 1
+
+    def get(self, key: str, endpoint: str) -> dict[str, Any] | None:
+        """
+        キャッシュ済みレスポンスを返す
+
+        Args:
+            key (str): 正規化したリクエストキー
+            endpoint (str): 集計用のエンドポイント名
+
+        Returns:
+            dict[str, Any] | None: レスポンス、未登録または期限切れの場合はNone
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._count(endpoint, "misses")
+                return None
+            body, expires_at = row
+            if expires_at is not None and expires_at <= time.time():
+                self._count(endpoint, "expired")
+                self._count(endpoint, "misses")
+                return None
+            self._count(endpoint, "hits")
+        return json_backend.loads(body)
+
+    def set(self, key: str, endpoint: str, value: dict[str, Any], ttl: float | None) -> None:
+        """
+        レスポンスを保存する
+
+        Args:
+            key (str): 正規化したリクエストキー
+            endpoint (str): エンドポイント名
+            value (dict[str, Any]): レスポンス
+            ttl (float | None): 有効期間(秒)。Noneの場合は不変データとして期限なしで保存する
+        """
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        body = json_backend.dumps_bytes(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, body, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, endpoint, body, now, expires_at),
+            )
+            self._conn.commit()
+            self._count(endpoint, "stores")
+
+    def purge_expired(self) -> int:
+        """期限切れのエントリを削除し、削除件数を返す"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> dict[str, Any]:
+        """
+        キャッシュの統計情報を返す
+
+        Returns:
+            dict[str, Any]: 起動後のヒット/ミス件数と、エンドポイント別の保存件数
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT endpoint,
+                       COUNT(*),
+                       SUM(CASE WHEN expires_at IS NULL THEN 1 ELSE 0 END),
+                       SUM(LENGTH(body))
+                FROM responses GROUP BY endpoint
+                """
+            ).fetchall()
+            counters = {endpoint: dict(c) for endpoint, c in self._counters.items()}
+
+        endpoints: dict[str, dict[str, Any]] = {}
+        for endpoint, entries, immutable_entries, size in rows:
+            endpoints[endpoint] = {
+                "entries": entries,
+                "immutable_entries": immutable_entries,
+                "bytes": size,
+            }
+        for endpoint, c in counters.items():
+            endpoints.setdefault(endpoint, {"entries": 0, "immutable_entries": 0, "bytes": 0}).update(c)
+
+        hits = sum(c["hits"] for c in counters.values())
+        misses = sum(c["misses"] for c in counters.values())
+        return {
+            "path": str(self.path),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "endpoints": endpoints,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -1,42 +1,380 @@
 import asyncio
 import os
 import json
-from datetime import datetime, timedelta
+import random
+from time import perf_counter
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from datetime import datetime, time, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from typing import Any
+from urllib.parse import parse_qsl, urlencode
 import httpx
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
+
+from jquants_free_mcp_server import json_backend
+from jquants_free_mcp_server.company_search import JST, CompanySearchIndex, next_daily_refresh
+from jquants_free_mcp_server.metrics_store import MetricsStore
+from jquants_free_mcp_server.rate_limiter import TokenBucket, requests_per_minute_from_env
+from jquants_free_mcp_server.response_cache import ResponseCache
 
 # Dify APIクライアント設定
 DIFY_API_KEY = os.environ.get("DIFY_API_KEY", "")
 DIFY_API_URL = os.environ.get("DIFY_API_URL", "https://api.dify.ai/v1")
 
-mcp_server = FastMCP("JQuants-MCP-server")
+# HTTPコネクションプール設定 (上流APIごとに1つのクライアントを使い回す)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "").lower() in ("1", "true", "yes")
+
+# 銘柄一覧キャッシュの更新時刻 (JST, HH:MM)。J-Quantsの日次更新に合わせて期限切れにする
+LISTED_INFO_REFRESH_TIME = time.fromisoformat(os.environ.get("LISTED_INFO_REFRESH_TIME", "17:30"))
+
+# レスポンスの永続キャッシュ設定
+RESPONSE_CACHE_ENABLED = os.environ.get("JQUANTS_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+RESPONSE_CACHE_PATH = os.environ.get(
+    "JQUANTS_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "jquants-free-mcp-server", "responses.sqlite3"),
+)
+# 無料プランは12週間前までのデータのみ提供されるため、それより古い期間のデータは変化しない
+DATA_DELAY = timedelta(weeks=int(os.environ.get("JQUANTS_DATA_DELAY_WEEKS", "12")))
+
+# J-Quants APIのレート制限 (リクエスト/分。未指定ならプラン別の上限)
+JQUANTS_RATE_LIMIT_PER_MINUTE = requests_per_minute_from_env()
+JQUANTS_RATE_LIMIT_BURST = float(os.environ.get("JQUANTS_RATE_LIMIT_BURST", "1"))
+
+# リトライ設定 (指数バックオフ + ジッター、Retry-Afterヘッダを優先)
+RETRY_MAX_ATTEMPTS = int(os.environ.get("HTTP_RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.environ.get("HTTP_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.environ.get("HTTP_RETRY_MAX_DELAY", "60.0"))
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# 複数銘柄ツールで同時に実行する銘柄数
+BATCH_CONCURRENCY = int(os.environ.get("JQUANTS_BATCH_CONCURRENCY", "5"))
+
+JQUANTS_CLIENT = "jquants"
+DIFY_CLIENT = "dify"
+
+_http_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _create_http_client() -> httpx.AsyncClient:
+    """
+    keep-aliveで接続を再利用するhttpx.AsyncClientを生成
+
+    HTTP/2はh2パッケージがインストールされている場合のみ有効になる。
+    """
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, http2=http2)
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """
+    上流API名に対応する共有クライアントを返す
+
+    サーバーのlifespan外 (スクリプトからツール関数を直接呼ぶ場合など) では
+    初回呼び出し時に生成する。
+
+    Args:
+        name (str): 上流API名 (JQUANTS_CLIENT または DIFY_CLIENT)
+
+    Returns:
+        httpx.AsyncClient: 共有クライアント
+    """
+    client = _http_clients.get(name)
+    if client is None or client.is_closed:
+        client = _create_http_client()
+        _http_clients[name] = client
+    return client
+
+
+async def close_http_clients() -> None:
+    """共有クライアントをすべて閉じる"""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+_jquants_rate_limiter: TokenBucket | None = None
+
+
+def get_jquants_rate_limiter() -> TokenBucket:
+    """J-Quants APIへの全リクエストで共有するレートリミッタを返す"""
+    global _jquants_rate_limiter
+    if _jquants_rate_limiter is None:
+        _jquants_rate_limiter = TokenBucket.per_minute(JQUANTS_RATE_LIMIT_PER_MINUTE, JQUANTS_RATE_LIMIT_BURST)
+    return _jquants_rate_limiter
+
+
+def _retry_delay(attempt: int, response: httpx.Response | None) -> float:
+    """
+    次のリトライまでの待機秒数を返す
+
+    Retry-Afterヘッダ (秒数またはHTTP日付) があればそれに従い、
+    なければフルジッター付きの指数バックオフとする。
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def send_with_retry(
+        client: httpx.AsyncClient,
+        method: str,
+        url: str,
+        limiter: TokenBucket | None = None,
+        retry_timeouts: bool = True,
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> httpx.Response:
+    """
+    429/5xxや接続エラー時にバックオフしながらリクエストを再送する
+
+    Args:
+        client (httpx.AsyncClient): 送信に使うクライアント
+        method (str): HTTPメソッド
+        url (str): URL for the request
+        limiter (TokenBucket, optional): 送信前に待機するレートリミッタ
+        retry_timeouts (bool, optional): タイムアウト時も再送するかどうか. Defaults to True.
+        stream (bool, optional): 本文を読み込まずに返すかどうか。Trueの場合は呼び出し元で
+            response.aclose() すること. Defaults to False.
+        **kwargs: httpx.AsyncClient.build_request に渡す引数
+
+    Returns:
+        httpx.Response: 最後に受け取ったレスポンス (最終試行の例外はそのまま送出する)
+    """
+    retry_exceptions: tuple[type[Exception], ...] = (httpx.ConnectError, httpx.RemoteProtocolError)
+    if retry_timeouts:
+        retry_exceptions += (httpx.TimeoutException,)
+
+    for attempt in range(RETRY_MAX_ATTEMPTS):
+        is_last = attempt == RETRY_MAX_ATTEMPTS - 1
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            request = client.build_request(method, url, **kwargs)
+            response = await client.send(request, stream=stream)
+        except retry_exceptions:
+            if is_last:
+                raise
+            await asyncio.sleep(_retry_delay(attempt, None))
+            continue
+        if is_last or response.status_code not in RETRY_STATUS_CODES:
+            return response
+        if stream:
+            await response.aclose()
+        await asyncio.sleep(_retry_delay(attempt, response))
+    raise RuntimeError("RETRY_MAX_ATTEMPTSは1以上を指定してください")
+
+
+_response_cache: ResponseCache | None = None
+
+# 計算済みテクニカル指標のストア (python -m jquants_free_mcp_server.metrics_store で作成)
+METRICS_STORE_PATH = os.environ.get("JQUANTS_METRICS_STORE_PATH", os.path.join("data", "stock_metrics.sqlite3"))
+# screen_stock_metrics で1回に返す銘柄数の上限
+SCREEN_MAX_LIMIT = int(os.environ.get("JQUANTS_SCREEN_MAX_LIMIT", "1000"))
+_metrics_store: MetricsStore | None = None
+
+
+def get_response_cache() -> ResponseCache | None:
+    """
+    レスポンスキャッシュを返す (初回呼び出し時に開く)
+
+    Returns:
+        ResponseCache | None: キャッシュ、無効化されている場合はNone
+    """
+    global _response_cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(RESPONSE_CACHE_PATH)
+    return _response_cache
+
+
+def close_response_cache() -> None:
+    """レスポンスキャッシュを閉じる"""
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+        _response_cache = None
+
+
+def get_metrics_store() -> MetricsStore | None:
+    """
+    メトリクスのストアを返す (初回呼び出し時に開く)
+
+    Returns:
+        MetricsStore | None: ストア、まだ作成されていない場合はNone
+    """
+    global _metrics_store
+    # ストアが作り直されていたら、新しいファイルを開き直す
+    if _metrics_store is not None and _metrics_store.is_stale():
+        close_metrics_store()
+    if _metrics_store is None and os.path.exists(METRICS_STORE_PATH):
+        _metrics_store = MetricsStore(METRICS_STORE_PATH)
+    return _metrics_store
+
+
+def close_metrics_store() -> None:
+    """メトリクスのストアを閉じる"""
+    global _metrics_store
+    if _metrics_store is not None:
+        _metrics_store.close()
+        _metrics_store = None
+
 
-async def make_requests(url: str,timeout: int = 30) -> dict[str, Any]:
+@asynccontextmanager
+async def lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """サーバー起動時に共有クライアントとキャッシュを用意し、終了時に閉じる"""
+    get_http_client(JQUANTS_CLIENT)
+    get_http_client(DIFY_CLIENT)
+    get_response_cache()
+    try:
+        yield
+    finally:
+        await close_http_clients()
+        close_response_cache()
+        close_metrics_store()
+
+
+mcp_server = FastMCP("JQuants-MCP-server", lifespan=lifespan)
+
+_inflight_requests: dict[str, asyncio.Task] = {}
+
+
+def canonical_request_key(url: str, params: dict[str, str] | None = None) -> str:
+    """
+    URLとクエリパラメータを正規化したキーを返す
+
+    パラメータの順序やURL中/params引数のどちらに書いたかに依存しない。
+    """
+    request_url = httpx.URL(url).copy_merge_params(params or {})
+    query = urlencode(sorted(parse_qsl(request_url.query.decode(), keep_blank_values=True)))
+    return str(request_url.copy_with(query=None)) + ("?" + query if query else "")
+
+
+async def make_requests(url: str,timeout: int = 30, params: dict[str, str] | None = None) -> dict[str, Any]:
     """
     Function to process requests
 
+    Concurrent calls for the same URL and parameters share a single upstream request.
+
     Args:
         url (str): URL for the request
         timeout (int, optional): Timeout in seconds. Default is 30 seconds.
+        params (dict[str, str], optional): Query parameters for the request.
 
     Returns:
         str: API response text
     """
+    # 送信するURLとキーを同じ方法で組み立て、キャッシュとリクエスト内容を一致させる
+    request_url = str(httpx.URL(url).copy_merge_params(params or {}))
+    key = canonical_request_key(request_url)
+    task = _inflight_requests.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_cached_fetch(key, request_url, timeout, None))
+        _inflight_requests[key] = task
+        task.add_done_callback(lambda _: _inflight_requests.pop(key, None))
+    # 呼び出し元がキャンセルされても共有中のリクエストは止めない
+    return await asyncio.shield(task)
+
+
+def _parse_date(value: str) -> datetime | None:
+    """YYYY-MM-DD または YYYYMMDD 形式の日付を解釈する"""
+    for fmt in ("%Y-%m-%d", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=JST)
+        except ValueError:
+            continue
+    return None
+
+
+def cache_ttl(url: str, params: dict[str, str] | None, now: datetime) -> float | None:
+    """
+    レスポンスのキャッシュ有効期間を決める
+
+    無料プランの提供範囲 (DATA_DELAY) より前で閉じた期間の株価・財務情報は
+    不変として扱う。それ以外は次の日次更新時刻までを有効期間とする。
+
+    Args:
+        url (str): URL for the request
+        params (dict[str, str], optional): Query parameters for the request.
+        now (datetime): 現在時刻 (タイムゾーン付き)
+
+    Returns:
+        float | None: 有効期間(秒)。Noneの場合は期限なし
+    """
+    request_url = httpx.URL(url).copy_merge_params(params or {})
+    params = dict(request_url.params)
+    path = request_url.path
+    if path.endswith(("/prices/daily_quotes", "/fins/statements")):
+        window_end = params.get("to") or params.get("date")
+        end = _parse_date(window_end) if window_end else None
+        if end is not None and end < now - DATA_DELAY:
+            return None
+    return (next_daily_refresh(now, LISTED_INFO_REFRESH_TIME) - now).total_seconds()
+
+
+async def _cached_fetch(key: str, url: str, timeout: int, params: dict[str, str] | None) -> dict[str, Any]:
+    """レスポンスキャッシュを参照し、なければAPIから取得して保存する"""
+    cache = get_response_cache()
+    if cache is None:
+        return await _fetch_json(url, timeout, params)
+
+    endpoint = httpx.URL(url).path
+    cached = await asyncio.to_thread(cache.get, key, endpoint)
+    if cached is not None:
+        return cached
+
+    response = await _fetch_json(url, timeout, params)
+    if "error" not in response:
+        ttl = cache_ttl(url, params, datetime.now(timezone.utc))
+        await asyncio.to_thread(cache.set, key, endpoint, response, ttl)
+    return response
+
+
+async def _fetch_json(url: str, timeout: int, params: dict[str, str] | None) -> dict[str, Any]:
+    """J-Quants APIへGETリクエストを送り、JSONレスポンスまたはエラー内容を返す"""
     try:
         idToken = os.environ.get("JQUANTS_ID_TOKEN", "")
         if not idToken:
             return {"error": "JQUANTS_ID_TOKENが設定されていません。", "status": "id_token_error"}
 
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            headers = {'Authorization': 'Bearer {}'.format(idToken)}
-            response = await client.get(url, headers=headers)
-            if response.status_code != 200:
-                return {"error": f"APIリクエストに失敗しました。ステータスコード: {response.status_code}", "status": "request_error"}
-            if response.headers.get("Content-Type") != "application/json":
-                return {"error": "APIレスポンスがJSON形式ではありません。", "status": "response_format_error"}
+        client = get_http_client(JQUANTS_CLIENT)
+        headers = {'Authorization': 'Bearer {}'.format(idToken)}
+        response = await send_with_retry(
+            client, "GET", url,
+            limiter=get_jquants_rate_limiter(),
+            headers=headers, params=params, timeout=timeout,
+        )
+        if response.status_code != 200:
+            return {"error": f"APIリクエストに失敗しました。ステータスコード: {response.status_code}", "status": "request_error"}
+        if response.headers.get("Content-Type") != "application/json":
+            return {"error": "APIレスポンスがJSON形式ではありません。", "status": "response_format_error"}
 
-            return json.loads(response.text)
+        return json_backend.loads(response.content)
 
     except Exception as e:
         if isinstance(e, httpx.TimeoutException):
@@ -52,6 +390,72 @@ async def make_requests(url: str,timeout: int = 30) -> dict[str, Any]:
             error_msg = f"予期せぬエラーが発生しました: {str(e)}"
             return {"error": error_msg, "status": "unexpected_error"}
 
+async def iter_pages(
+        url: str,
+        params: dict[str, str] | None = None,
+        timeout: int = 30,
+    ) -> AsyncIterator[dict[str, Any]]:
+    """
+    J-Quants APIのページを順に取得する
+
+    レスポンスに pagination_key が含まれる間、次ページを要求し続ける。
+    エラー時はエラー内容を1件yieldして終了する。
+
+    Args:
+        url (str): URL for the request
+        params (dict[str, str], optional): Query parameters for the request.
+        timeout (int, optional): Timeout in seconds. Default is 30 seconds.
+
+    Yields:
+        dict[str, Any]: 1ページ分のAPIレスポンス
+    """
+    # URLに書かれたクエリもページ送りの間ずっと引き継ぐ
+    request_url = httpx.URL(url)
+    page_params = dict(parse_qsl(request_url.query.decode(), keep_blank_values=True))
+    page_params.update(params or {})
+    url = str(request_url.copy_with(query=None))
+    while True:
+        response = await make_requests(url, timeout=timeout, params=page_params)
+        yield response
+        if "error" in response:
+            return
+        pagination_key = response.get("pagination_key")
+        if not pagination_key:
+            return
+        page_params["pagination_key"] = pagination_key
+
+
+async def collect_records(
+        url: str,
+        data_key: str,
+        params: dict[str, str] | None = None,
+        max_records: int | None = None,
+    ) -> list[dict[str, Any]] | dict[str, Any]:
+    """
+    全ページのレコードを集める
+
+    max_records件集まった時点で以降のページは取得しない。
+
+    Args:
+        url (str): URL for the request
+        data_key (str): レコードが格納されているキー (例: "daily_quotes")
+        params (dict[str, str], optional): Query parameters for the request.
+        max_records (int, optional): 取得するレコード数の上限. Defaults to None (全件).
+
+    Returns:
+        list[dict[str, Any]] | dict[str, Any]: レコードのリスト、失敗時はエラー内容
+    """
+    records: list[dict[str, Any]] = []
+    async for page in iter_pages(url, params):
+        if "error" in page:
+            return page
+        records.extend(page.get(data_key, []))
+        if max_records is not None and len(records) >= max_records:
+            del records[max_records:]
+            break
+    return records
+
+
 async def make_dify_request(prompt: str, context: str = "", timeout: int = 60) -> dict[str, Any]:
     """
     Dify APIにリクエストを送信し、LLM推論結果を取得
@@ -68,35 +472,312 @@ async def make_dify_request(prompt: str, context: str = "", timeout: int = 60) -
         return {"error": "DIFY_API_KEYが設定されていません", "status": "api_key_error"}
     
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            headers = {
-                'Authorization': f'Bearer {DIFY_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            data = {
-                "inputs": {"prompt": prompt, "context": context},
-                "response_mode": "blocking"
+        client = get_http_client(DIFY_CLIENT)
+        headers = {
+            'Authorization': f'Bearer {DIFY_API_KEY}',
+            'Content-Type': 'application/json'
+        }
+        data = {
+            "inputs": {"prompt": prompt, "context": context},
+            "response_mode": "blocking"
+        }
+        # 推論のやり直しは高くつくため、タイムアウト時は再送しない
+        response = await send_with_retry(
+            client, "POST", f"{DIFY_API_URL}/completion-messages",
+            retry_timeouts=False,
+            headers=headers,
+            json=data,
+            timeout=timeout
+        )
+
+        if response.status_code != 200:
+            return {
+                "error": f"Dify APIリクエスト失敗. ステータスコード: {response.status_code}",
+                "status": "request_error"
             }
-            response = await client.post(
-                f"{DIFY_API_URL}/completion-messages",
-                headers=headers,
-                json=data
-            )
+
+        return json_backend.loads(response.content)
             
+    except Exception as e:
+        return {
+            "error": f"Dify APIリクエスト中にエラー: {str(e)}",
+            "status": "api_error"
+        }
+
+
+async def stream_dify_request(
+        prompt: str,
+        context: str = "",
+        on_chunk: Callable[[str], Awaitable[None]] | None = None,
+        timeout: int = 60,
+    ) -> dict[str, Any]:
+    """
+    Dify APIにストリーミングモードでリクエストを送信し、SSEを逐次読み込む
+
+    timeout はイベント間の最大待ち時間として扱うため、長い回答でも途中で打ち切られない。
+
+    Args:
+        prompt (str): LLMへのプロンプト
+        context (str, optional): 追加コンテキスト. Defaults to "".
+        on_chunk (Callable[[str], Awaitable[None]], optional): 回答の断片を受け取るたびに
+            その断片を渡して呼ばれるコールバック. Defaults to None.
+        timeout (int, optional): イベント間のタイムアウト秒数. Defaults to 60.
+
+    Returns:
+        dict[str, Any]: 回答全体 (answer)、メッセージID、初回トークンまでの時間と総時間 (ミリ秒)。
+            message_end を受け取る前にストリームが終わった場合はエラーとし、途中までの回答を含める
+    """
+    if not DIFY_API_KEY:
+        return {"error": "DIFY_API_KEYが設定されていません", "status": "api_key_error"}
+
+    started_at = perf_counter()
+    first_token_ms: float | None = None
+    completed = False
+    answer_parts: list[str] = []
+    result: dict[str, Any] = {}
+    try:
+        client = get_http_client(DIFY_CLIENT)
+        headers = {
+            'Authorization': f'Bearer {DIFY_API_KEY}',
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        }
+        data = {
+            "inputs": {"prompt": prompt, "context": context},
+            "response_mode": "streaming"
+        }
+        response = await send_with_retry(
+            client, "POST", f"{DIFY_API_URL}/completion-messages",
+            retry_timeouts=False,
+            stream=True,
+            headers=headers,
+            json=data,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+        )
+        try:
             if response.status_code != 200:
                 return {
                     "error": f"Dify APIリクエスト失敗. ステータスコード: {response.status_code}",
                     "status": "request_error"
                 }
-                
-            return response.json()
-            
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json_backend.loads(line[len("data:"):].strip())
+                event_type = event.get("event")
+                if event_type in ("message", "agent_message"):
+                    chunk = event.get("answer", "")
+                    if not chunk:
+                        continue
+                    if first_token_ms is None:
+                        first_token_ms = (perf_counter() - started_at) * 1000
+                    answer_parts.append(chunk)
+                    result["message_id"] = event.get("message_id")
+                    if on_chunk is not None:
+                        await on_chunk(chunk)
+                elif event_type == "message_end":
+                    result["message_id"] = event.get("message_id", result.get("message_id"))
+                    result["metadata"] = event.get("metadata", {})
+                    completed = True
+                    break
+                elif event_type == "error":
+                    return {
+                        "error": f"Dify APIストリーミング中にエラー: {event.get('message', '')}",
+                        "status": "stream_error",
+                        "answer": "".join(answer_parts),
+                    }
+        finally:
+            await response.aclose()
+
     except Exception as e:
         return {
             "error": f"Dify APIリクエスト中にエラー: {str(e)}",
-            "status": "api_error"
+            "status": "api_error",
+            "answer": "".join(answer_parts),
+        }
+
+    if not completed:
+        return {
+            "error": "Dify APIのストリームがmessage_endを受け取る前に終了しました",
+            "status": "stream_incomplete",
+            "answer": "".join(answer_parts),
         }
 
+    result["answer"] = "".join(answer_parts)
+    result["time_to_first_token_ms"] = first_token_ms
+    result["total_ms"] = (perf_counter() - started_at) * 1000
+    return result
+
+
+# 株価・財務情報ツールの fields 引数で指定できるプリセット
+QUOTE_KEY_FIELDS = ["Date", "Code"]
+QUOTE_FIELD_PRESETS = {
+    "ohlc": ["Open", "High", "Low", "Close", "Volume"],
+    "adjusted": [
+        "AdjustmentOpen", "AdjustmentHigh", "AdjustmentLow", "AdjustmentClose", "AdjustmentVolume",
+    ],
+    "close": ["Close", "AdjustmentClose", "Volume"],
+    "turnover": ["Volume", "TurnoverValue"],
+}
+STATEMENT_KEY_FIELDS = ["DisclosedDate", "LocalCode", "TypeOfDocument", "TypeOfCurrentPeriod", "CurrentFiscalYearEndDate"]
+STATEMENT_FIELD_PRESETS = {
+    "balance_sheet": ["TotalAssets", "Equity", "EquityToAssetRatio", "BookValuePerShare"],
+    "pl": ["NetSales", "OperatingProfit", "OrdinaryProfit", "Profit"],
+    "per_share": [
+        "EarningsPerShare", "DilutedEarningsPerShare", "BookValuePerShare",
+        "ResultDividendPerShareAnnual", "ForecastEarningsPerShare", "ForecastDividendPerShareAnnual",
+    ],
+    "cash_flow": [
+        "CashFlowsFromOperatingActivities", "CashFlowsFromInvestingActivities",
+        "CashFlowsFromFinancingActivities", "CashAndEquivalents",
+    ],
+    "forecast": [
+        "ForecastNetSales", "ForecastOperatingProfit", "ForecastOrdinaryProfit", "ForecastProfit",
+        "ForecastEarningsPerShare",
+    ],
+}
+METRIC_KEY_FIELDS = ["Code", "Date"]
+METRIC_FIELD_PRESETS = {
+    "sma": ["AdjustmentClose", "SMA5", "SMA25", "SMA75"],
+    "deviation": ["SMA5_乖離率", "SMA25_乖離率", "SMA75_乖離率"],
+    "trend": ["PerfectOrder", "HigherLowDays", "HighVolumeDates", "is_tanki_SMA_over", "terms_SMA_over"],
+}
+OUTPUT_FORMATS = ("records", "columnar")
+
+
+def resolve_fields(
+        fields: list[str] | None,
+        presets: dict[str, list[str]],
+        key_fields: list[str],
+    ) -> list[str] | None:
+    """
+    fields 引数 (プリセット名または項目名のリスト) を項目名のリストに展開する
+
+    識別用の項目 (日付・銘柄コードなど) は常に先頭に含める。
+
+    Returns:
+        list[str] | None: 出力する項目名。fieldsが未指定の場合はNone (全項目)
+    """
+    if not fields:
+        return None
+    resolved = list(key_fields)
+    for field in fields:
+        resolved.extend(presets.get(field, [field]))
+    return list(dict.fromkeys(resolved))
+
+
+def shape_records(
+        records: list[dict[str, Any]],
+        fields: list[str] | None = None,
+        output_format: str = "records",
+        drop_empty: bool = False,
+    ) -> list[dict[str, Any]] | dict[str, list[Any]]:
+    """
+    レコードを指定項目に絞り、出力形式を整える
+
+    Args:
+        records (list[dict[str, Any]]): APIレスポンスのレコード
+        fields (list[str], optional): 出力する項目. Defaults to None (全項目).
+        output_format (str, optional): "records" (レコードのリスト) または
+            "columnar" (項目名→値の配列). Defaults to "records".
+        drop_empty (bool, optional): 空文字の項目を除くかどうか. Defaults to False.
+
+    Returns:
+        list[dict[str, Any]] | dict[str, list[Any]]: 整形後のデータ
+    """
+    if fields is not None:
+        rows = [
+            {f: r[f] for f in fields if f in r and not (drop_empty and r[f] == "")}
+            for r in records
+        ]
+    elif drop_empty:
+        rows = [{k: v for k, v in r.items() if v != ""} for r in records]
+    else:
+        rows = records
+
+    if output_format != "columnar":
+        return rows
+    columns = fields if fields is not None else list(dict.fromkeys(k for r in rows for k in r))
+    return {c: [r.get(c) for r in rows] for c in columns if any(c in r for r in rows)}
+
+
+def _invalid_fields(
+        fields: list[str] | None,
+        presets: dict[str, list[str]],
+        records: list[dict[str, Any]],
+    ) -> dict[str, Any] | None:
+    """
+    fields 引数にプリセットでも実在する項目でもない名前があればエラー内容を返す
+
+    項目名はAPIレスポンスに含まれる項目と照合する (J-Quantsは空の項目も返すため、
+    1件でもレコードがあれば全項目名がわかる)。
+    """
+    if not fields or not records:
+        return None
+    known = set(presets).union(*(r.keys() for r in records))
+    unknown = [f for f in fields if f not in known]
+    if not unknown:
+        return None
+    return {
+        "error": f"不明なfieldsです: {', '.join(unknown)} (プリセット: {', '.join(presets)})",
+        "status": "invalid_parameter",
+    }
+
+
+def _invalid_output_format(output_format: str) -> dict[str, Any] | None:
+    if output_format in OUTPUT_FORMATS:
+        return None
+    return {
+        "error": f"output_formatには{', '.join(OUTPUT_FORMATS)}のいずれかを指定してください: {output_format}",
+        "status": "invalid_parameter",
+    }
+
+
+def _invalid_limit(limit: int) -> dict[str, Any] | None:
+    # SQLiteのLIMITは負の値だと上限なしになるため、1未満は受け付けない
+    if limit >= 1:
+        return None
+    return {
+        "error": f"limitには1以上を指定してください: {limit}",
+        "status": "invalid_parameter",
+    }
+
+
+_company_index: CompanySearchIndex | None = None
+_company_index_lock = asyncio.Lock()
+
+
+async def get_company_index() -> CompanySearchIndex | dict[str, Any]:
+    """
+    銘柄一覧の検索インデックスを返す
+
+    一覧はプロセス内にキャッシュし、次の日次更新時刻を過ぎたら取り直す。
+
+    Returns:
+        CompanySearchIndex | dict[str, Any]: 検索インデックス、取得失敗時はエラー内容
+    """
+    global _company_index
+    now = datetime.now(timezone.utc)
+    if _company_index is not None and not _company_index.is_expired(now):
+        return _company_index
+
+    async with _company_index_lock:
+        now = datetime.now(timezone.utc)
+        if _company_index is not None and not _company_index.is_expired(now):
+            return _company_index
+
+        url = "https://api.jquants.com/v1/listed/info"
+        records = await collect_records(url, "info")
+        if isinstance(records, dict):
+            return records
+
+        _company_index = CompanySearchIndex(
+            records,
+            expires_at=next_daily_refresh(now, LISTED_INFO_REFRESH_TIME),
+        )
+        return _company_index
+
 
 @mcp_server.tool()
 async def search_company(
@@ -105,35 +786,28 @@ async def search_company(
         start_position : int = 0,
     ) -> str:
     """
-    Search for listed stocks by company name.
+    Search for listed stocks by company name or stock code.
+    Results are ranked: exact code match, exact name match, prefix match, then substring match.
 
     Args:
-        query (str): Query parameter for searching company names. Specify a string contained in the company name.
+        query (str): Query parameter for searching company names. Specify a string contained in the company name,
+            or a stock code.
             Example: Specifying "トヨタ" will search for stocks with "トヨタ" in the company name.
-            Must be in Japanese.
+            Full-width/half-width characters and katakana/hiragana are treated as equivalent.
         limit (int, optional): Maximum number of results to retrieve. Defaults to 10.
         start_position (int, optional): The starting position for the search. Defaults to 0.
 
     Returns:
         str: API response text
     """
-    url = "https://api.jquants.com/v1/listed/info"
-    response = await make_requests(url)
-    if "error" in response:
-        return json.dumps(response, ensure_ascii=False)
-
-    response_json_list = response.get("info", [])
-    response_json_list = [
-        r for r in response_json_list
-        if (
-            query.lower() in r.get("CompanyName", "").lower()
-            or
-            query.lower() in r.get("CompanyNameEnglish", "").lower()
-        )
-    ][start_position:start_position + limit]
+    index = await get_company_index()
+    if isinstance(index, dict):
+        return json_backend.dumps(index)
+
+    response_json_list = index.search(query, limit=limit, start_position=start_position)
 
     response_json = {'info': response_json_list}
-    return json.dumps(response_json, ensure_ascii=False)
+    return json_backend.dumps(response_json)
 
 
 
@@ -144,6 +818,8 @@ async def get_daily_quotes(
         to_date : str,
         limit : int = 10,
         start_position : int = 0,
+        fields : list[str] | None = None,
+        output_format : str = "records",
     ) -> str:
     """
     Retrieve daily stock price data for a specified stock code.
@@ -155,23 +831,86 @@ async def get_daily_quotes(
         to_date (str): Specify the end date. Example: "2023-01-31" must be in YYYY-MM-DD format
         limit (int, optional): Maximum number of results to retrieve. Defaults to 10.
         start_position (int, optional): The starting position for the search. Defaults to 0.
+        fields (list[str], optional): Field names or presets to return. Date and Code are always included.
+            Presets: "ohlc", "adjusted", "close", "turnover". Example: ["close"]. Unknown names are rejected. Defaults to all fields.
+        output_format (str, optional): "records" (list of objects) or "columnar"
+            (field name to array of values, more compact). Defaults to "records".
 
     Returns:
         str: API response text
     """
+    error = _invalid_output_format(output_format)
+    if error:
+        return json_backend.dumps(error)
 
-    url = "https://api.jquants.com/v1/prices/daily_quotes?code={}&from={}&to={}".format(
-        code,
-        from_date,
-        to_date
-    )
-    response = await make_requests(url)
-    if "error" in response:
-        return json.dumps(response, ensure_ascii=False)
-    response_json_list = response.get("daily_quotes", [])
-    response_json_list = response_json_list[start_position:start_position + limit]
-    response_json = {'daily_quotes': response_json_list}
-    return json.dumps(response_json, ensure_ascii=False)
+    url = "https://api.jquants.com/v1/prices/daily_quotes"
+    params = {"code": code, "from": from_date, "to": to_date}
+    records = await collect_records(url, "daily_quotes", params, max_records=start_position + limit)
+    if isinstance(records, dict):
+        return json_backend.dumps(records)
+    error = _invalid_fields(fields, QUOTE_FIELD_PRESETS, records)
+    if error:
+        return json_backend.dumps(error)
+    response_json: dict[str, Any] = {'daily_quotes': shape_records(
+        records[start_position:start_position + limit],
+        resolve_fields(fields, QUOTE_FIELD_PRESETS, QUOTE_KEY_FIELDS),
+        output_format,
+    )}
+    if output_format == "columnar":
+        response_json['format'] = output_format
+    return json_backend.dumps(response_json)
+
+
+@mcp_server.tool()
+async def get_daily_quotes_batch(
+        codes : list[str],
+        from_date : str,
+        to_date : str,
+        limit : int = 10,
+        start_position : int = 0,
+    ) -> str:
+    """
+    Retrieve daily stock price data for multiple stock codes in one call.
+    Use this instead of calling get_daily_quotes repeatedly when comparing several stocks.
+    The available data spans from 2 years prior to today up until 12 weeks ago.
+
+    Args:
+        codes (list[str]): Specify the stock codes. Example: ["72030", "72670"]
+        from_date (str): Specify the start date. Example: "2023-01-01" must be in YYYY-MM-DD format
+        to_date (str): Specify the end date. Example: "2023-01-31" must be in YYYY-MM-DD format
+        limit (int, optional): Maximum number of results to retrieve per code. Defaults to 10.
+        start_position (int, optional): The starting position for each code. Defaults to 0.
+
+    Returns:
+        str: Daily quotes keyed by stock code (the Code field is omitted from each record),
+            and errors keyed by stock code for codes that could not be retrieved.
+    """
+    url = "https://api.jquants.com/v1/prices/daily_quotes"
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch(code: str) -> list[dict[str, Any]] | dict[str, Any]:
+        async with semaphore:
+            params = {"code": code, "from": from_date, "to": to_date}
+            return await collect_records(url, "daily_quotes", params, max_records=start_position + limit)
+
+    codes = list(dict.fromkeys(codes))
+    results = await asyncio.gather(*(fetch(code) for code in codes))
+
+    quotes: dict[str, list[dict[str, Any]]] = {}
+    errors: dict[str, dict[str, Any]] = {}
+    for code, records in zip(codes, results):
+        if isinstance(records, dict):
+            errors[code] = records
+            continue
+        quotes[code] = [
+            {k: v for k, v in r.items() if k != "Code"}
+            for r in records[start_position:start_position + limit]
+        ]
+
+    response_json: dict[str, Any] = {'daily_quotes': quotes}
+    if errors:
+        response_json['errors'] = errors
+    return json_backend.dumps(response_json)
 
 
 @mcp_server.tool()
@@ -179,35 +918,175 @@ async def get_financial_statements(
         code : str,
         limit : int = 10,
         start_position : int = 0,
+        fields : list[str] | None = None,
+        output_format : str = "records",
     ) -> str:
     """
     Retrieve financial statements for a specified stock code.
     The available data spans from 2 years prior to today up until 12 weeks ago.
     You can obtain quarterly financial summary reports and disclosure information regarding
     revisions to performance and dividend information (mainly numerical data) for listed companies.
+    Empty fields are omitted.
 
     Args:
         code (str): Specify the stock code. Example: "72030" (トヨタ自動車)
         limit (int, optional): Maximum number of results to retrieve. Defaults to 10.
         start_position (int, optional): The starting position for the search. Defaults to 0.
+        fields (list[str], optional): Field names or presets to return. DisclosedDate, LocalCode, TypeOfDocument,
+            TypeOfCurrentPeriod and CurrentFiscalYearEndDate are always included.
+            Presets: "balance_sheet", "pl", "per_share", "cash_flow", "forecast".
+            Example: ["balance_sheet", "NetSales"]. Unknown names are rejected. Defaults to all fields.
+        output_format (str, optional): "records" (list of objects) or "columnar"
+            (field name to array of values, more compact). Defaults to "records".
     """
-    url = "https://api.jquants.com/v1/fins/statements?code={}".format(code)
-    response = await make_requests(url)
-    if "error" in response:
-        return json.dumps(response, ensure_ascii=False)
-    response_json_list = response.get("statements", [])
-    response_json_list = [
-        {k:v for k,v in r.items() if v != ""}
-        for r in response_json_list
-    ][start_position:start_position + limit]
-    response_json = {'statements': response_json_list}
-    return json.dumps(response_json, ensure_ascii=False)
+    error = _invalid_output_format(output_format)
+    if error:
+        return json_backend.dumps(error)
+
+    url = "https://api.jquants.com/v1/fins/statements"
+    params = {"code": code}
+    records = await collect_records(url, "statements", params, max_records=start_position + limit)
+    if isinstance(records, dict):
+        return json_backend.dumps(records)
+    error = _invalid_fields(fields, STATEMENT_FIELD_PRESETS, records)
+    if error:
+        return json_backend.dumps(error)
+    response_json: dict[str, Any] = {'statements': shape_records(
+        records[start_position:start_position + limit],
+        resolve_fields(fields, STATEMENT_FIELD_PRESETS, STATEMENT_KEY_FIELDS),
+        output_format,
+        drop_empty=True,
+    )}
+    if output_format == "columnar":
+        response_json['format'] = output_format
+    return json_backend.dumps(response_json)
+
+
+def _metrics_store_unavailable() -> dict[str, Any]:
+    return {
+        "error": f"メトリクスのストアがありません: {METRICS_STORE_PATH} "
+                 "(calc_stock_metrics の結果から python -m jquants_free_mcp_server.metrics_store で作成してください)",
+        "status": "metrics_unavailable",
+    }
+
+
+def _invalid_metric_fields(fields: list[str] | None, store: MetricsStore) -> dict[str, Any] | None:
+    unknown = store.unknown_fields([f for f in fields or [] if f not in METRIC_FIELD_PRESETS])
+    if not unknown:
+        return None
+    return {
+        "error": f"不明なfieldsです: {', '.join(unknown)} (プリセット: {', '.join(METRIC_FIELD_PRESETS)})",
+        "status": "invalid_parameter",
+    }
+
+
+@mcp_server.tool()
+async def get_stock_metrics(
+        code : str,
+        from_date : str | None = None,
+        to_date : str | None = None,
+        fields : list[str] | None = None,
+        output_format : str = "records",
+    ) -> str:
+    """
+    Retrieve precomputed technical metrics (moving averages, deviation rates, perfect order, etc.)
+    for a specified stock code from the local metrics store. No J-Quants API call is made.
+
+    Args:
+        code (str): Specify the stock code. Example: "72030" or "7203" (トヨタ自動車)
+        from_date (str, optional): Start date (inclusive), YYYY-MM-DD. Defaults to the oldest date.
+        to_date (str, optional): End date (inclusive), YYYY-MM-DD. Defaults to the latest date.
+        fields (list[str], optional): Field names or presets to return. Code and Date are always included.
+            Presets: "sma", "deviation", "trend". Example: ["trend", "SMA25"]. Unknown names are rejected.
+            Defaults to all fields.
+        output_format (str, optional): "records" (list of objects) or "columnar"
+            (field name to array of values, more compact). Defaults to "records".
+
+    Returns:
+        str: Metrics in date order (JSON string)
+    """
+    error = _invalid_output_format(output_format)
+    if error:
+        return json_backend.dumps(error)
+    store = get_metrics_store()
+    if store is None:
+        return json_backend.dumps(_metrics_store_unavailable())
+    error = _invalid_metric_fields(fields, store)
+    if error:
+        return json_backend.dumps(error)
+
+    resolved = resolve_fields(fields, METRIC_FIELD_PRESETS, METRIC_KEY_FIELDS)
+    records = store.get(code, from_date, to_date, resolved)
+    response_json: dict[str, Any] = {'stock_metrics': shape_records(records, resolved, output_format)}
+    if output_format == "columnar":
+        response_json['format'] = output_format
+    return json_backend.dumps(response_json)
+
+
+@mcp_server.tool()
+async def screen_stock_metrics(
+        conditions : dict[str, Any],
+        date : str | None = None,
+        fields : list[str] | None = None,
+        limit : int = 100,
+    ) -> str:
+    """
+    Find stocks whose precomputed technical metrics match the given conditions on a date,
+    using the local metrics store. No J-Quants API call is made.
+
+    Args:
+        conditions (dict[str, Any]): Field name to a value (equality) or to a range
+            {"min": x, "max": y, "gt": x, "lt": y}.
+            Example: {"PerfectOrder": 1, "SMA25_乖離率": {"max": -10}}
+        date (str, optional): Date to screen, YYYY-MM-DD. Defaults to the latest date in the store.
+        fields (list[str], optional): Field names or presets to return in addition to Code and Date.
+            Presets: "sma", "deviation", "trend". Defaults to the fields used in conditions.
+        limit (int, optional): Maximum number of stocks to return (1 or more, at most 1000 by default;
+            larger values are capped). Defaults to 100.
+
+    Returns:
+        str: Matching stocks in code order (JSON string)
+    """
+    error = _invalid_limit(limit)
+    if error:
+        return json_backend.dumps(error)
+    limit = min(limit, SCREEN_MAX_LIMIT)
+    store = get_metrics_store()
+    if store is None:
+        return json_backend.dumps(_metrics_store_unavailable())
+    error = _invalid_metric_fields(fields, store)
+    if error:
+        return json_backend.dumps(error)
+
+    date = date or store.latest_date()
+    try:
+        records = store.screen(date, conditions, resolve_fields(fields, METRIC_FIELD_PRESETS, []), limit)
+    except ValueError as e:
+        return json_backend.dumps({"error": str(e), "status": "invalid_parameter"})
+    return json_backend.dumps({'date': date, 'stock_metrics': records})
+
+
+@mcp_server.tool()
+async def get_cache_stats() -> str:
+    """
+    Return hit/miss statistics of the local J-Quants response cache.
+
+    Returns:
+        str: Cache statistics (JSON string)
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return json_backend.dumps({"status": "disabled"})
+    stats = await asyncio.to_thread(cache.stats)
+    return json_backend.dumps(stats)
 
 
 @mcp_server.tool()
 async def analyze_with_dify(
         data: str,
         prompt: str = "この金融データを分析してください",
+        stream: bool = False,
+        ctx: Context = None,
     ) -> str:
     """
     Dify APIを使用してLLMでデータ分析を実行
@@ -215,35 +1094,53 @@ async def analyze_with_dify(
     Args:
         data (str): 分析対象のデータ (JSON文字列)
         prompt (str, optional): LLMへのプロンプト. Defaults to "この金融データを分析してください".
+        stream (bool, optional): Trueの場合はストリーミングモードで実行し、回答の断片を
+            進捗通知で送る。長い分析でもタイムアウトしにくい. Defaults to False.
         
     Returns:
         str: LLM分析結果 (JSON文字列)
     """
     try:
         # データをJSONとしてパースしてコンテキスト作成
-        json_data = json.loads(data)
-        context = f"分析対象データ: {json.dumps(json_data, ensure_ascii=False)}"
+        json_data = json_backend.loads(data)
+        context = f"分析対象データ: {json_backend.dumps(json_data)}"
         
         # Dify API呼び出し
-        result = await make_dify_request(prompt, context)
+        if stream:
+            chunks = 0
+
+            # 通知には新しい断片のみを載せる (回答全体を毎回送ると通信量が回答長の2乗で増える)
+            async def report_chunk(chunk: str) -> None:
+                nonlocal chunks
+                chunks += 1
+                if ctx is not None:
+                    await ctx.report_progress(chunks, message=chunk)
+
+            result = await stream_dify_request(prompt, context, on_chunk=report_chunk)
+        else:
+            result = await make_dify_request(prompt, context)
         if "error" in result:
-            return json.dumps(result, ensure_ascii=False)
-            
-        return json.dumps({
+            return json_backend.dumps(result)
+
+        response_json = {
             "analysis": result.get("answer", ""),
             "status": "success"
-        }, ensure_ascii=False)
+        }
+        if stream:
+            response_json["time_to_first_token_ms"] = result.get("time_to_first_token_ms")
+            response_json["total_ms"] = result.get("total_ms")
+        return json_backend.dumps(response_json)
         
     except json.JSONDecodeError:
-        return json.dumps({
+        return json_backend.dumps({
             "error": "無効なJSONデータです",
             "status": "invalid_json"
-        }, ensure_ascii=False)
+        })
     except Exception as e:
-        return json.dumps({
+        return json_backend.dumps({
             "error": f"分析中にエラーが発生しました: {str(e)}",
             "status": "analysis_error"
-        }, ensure_ascii=False)
+        })
 
 def main() -> None:
     print("Starting J-Quants MCP server!")
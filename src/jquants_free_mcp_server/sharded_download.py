@@ -0,0 +1,157 @@
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pandas as pd
+
+# 取得済みの日のデータ (チェックポイント) の保存先。データセットごとに 日付.parquet で保存する
+SHARDS_PATH = Path("data") / Path("shards")
+
+# 同時に取得する日数 (APIへのリクエスト数はクライアント側のレートリミッタで抑える)
+SHARD_WORKERS = int(os.environ.get("JQUANTS_SHARD_WORKERS", "4"))
+
+# 日付 -> その日のデータ (pandas/polarsのDataFrame)
+DayFetcher = Callable[[date], Any]
+
+
+def _to_pandas(df: Any) -> pd.DataFrame:
+    return df.to_pandas() if hasattr(df, "to_pandas") else df
+
+
+def trading_days(start: date | datetime, end: date | datetime) -> list[date]:
+    """
+    start から end までの営業日 (土日を除く日) を返す
+
+    祝日は除かない (祝日の分は空のデータが返るだけなので、取引カレンダーを別に取得しない)。
+    """
+    return [day.date() for day in pd.bdate_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize())]
+
+
+def _shard_path(shard_dir: Path, day: date) -> Path:
+    return shard_dir / f"{day.isoformat()}.parquet"
+
+
+def _save_shard(df: pd.DataFrame, path: Path) -> None:
+    # 書き込み途中で中断しても、次回は取得済みと見なさないよう一時ファイルから置き換える
+    tmp_path = path.with_name(path.name + ".tmp")
+    df.to_parquet(tmp_path, index=False)
+    tmp_path.replace(path)
+
+
+def download_days(
+    dataset: str,
+    fetch_day: DayFetcher,
+    days: list[date],
+    shards_root: str | Path = SHARDS_PATH,
+    workers: int = SHARD_WORKERS,
+) -> dict[date, str]:
+    """
+    1日ずつ取得して、取得できた日から順にチェックポイントに保存する
+
+    チェックポイントがある日は取得しないので、中断した後に同じ呼び出しをすると残りの日だけを取得する。
+
+    Args:
+        dataset (str): データセット名 (チェックポイントのディレクトリ名)
+        fetch_day (DayFetcher): 日付を受け取ってその日のデータを返す関数
+        days (list[date]): 取得する日
+        shards_root (str | Path, optional): チェックポイントの保存先. Defaults to SHARDS_PATH.
+        workers (int, optional): 同時に取得する日数. Defaults to SHARD_WORKERS.
+
+    Returns:
+        dict[date, str]: 取得に失敗した日 -> エラー (失敗した日のチェックポイントは作らない)
+    """
+    if workers < 1:
+        raise ValueError(f"workersは1以上を指定してください: {workers}")
+    shard_dir = Path(shards_root) / dataset
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    pending = [day for day in days if not _shard_path(shard_dir, day).exists()]
+
+    def fetch_and_save(day: date) -> None:
+        _save_shard(_to_pandas(fetch_day(day)), _shard_path(shard_dir, day))
+
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"shard-{dataset}") as pool:
+        futures = {pool.submit(fetch_and_save, day): day for day in pending}
+        for future in as_completed(futures):
+            if (e := future.exception()) is not None:
+                failed[futures[future]] = f"{type(e).__name__}: {e}"
+    return dict(sorted(failed.items()))
+
+
+def assemble(dataset: str, days: list[date], shards_root: str | Path = SHARDS_PATH) -> pd.DataFrame:
+    """チェックポイントを日付順に連結する (全ての日のチェックポイントがあること)"""
+    shard_dir = Path(shards_root) / dataset
+    frames = [pd.read_parquet(_shard_path(shard_dir, day)) for day in sorted(days)]
+    frames = [df for df in frames if len(df)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def download_range(
+    dataset: str,
+    fetch_day: DayFetcher,
+    start: date | datetime,
+    end: date | datetime,
+    shards_root: str | Path = SHARDS_PATH,
+    workers: int = SHARD_WORKERS,
+    keep_shards: bool = False,
+) -> pd.DataFrame:
+    """
+    期間を営業日ごとに分けて並行して取得し、日付順に並べて返す
+
+    get_price_range などで期間全体を1回で取得すると、終わり近くで失敗した場合に全て取り直しになる。
+    ここでは1日ずつ取得してチェックポイントに保存するので、失敗した場合は例外を送出し、
+    もう一度呼び出すと失敗した日と未取得の日だけを取得する。全ての日がそろったら
+    チェックポイントを削除する (keep_shards=Trueの場合は残す)。
+
+    Args:
+        dataset (str): データセット名 (チェックポイントのディレクトリ名)
+        fetch_day (DayFetcher): 日付を受け取ってその日のデータを返す関数
+        start (date | datetime): 開始日
+        end (date | datetime): 終了日
+        shards_root (str | Path, optional): チェックポイントの保存先. Defaults to SHARDS_PATH.
+        workers (int, optional): 同時に取得する日数. Defaults to SHARD_WORKERS.
+        keep_shards (bool, optional): 取得後もチェックポイントを残すか. Defaults to False.
+
+    Returns:
+        pd.DataFrame: 期間のデータ (日付順)
+
+    Raises:
+        RuntimeError: 取得に失敗した日があった場合 (取得できた日のチェックポイントは残る)
+    """
+    days = trading_days(start, end)
+    failed = download_days(dataset, fetch_day, days, shards_root, workers)
+    if failed:
+        first_day, first_error = next(iter(failed.items()))
+        raise RuntimeError(f"{dataset}: {len(failed)}日分の取得に失敗しました "
+                           f"(最初の失敗: {first_day.isoformat()} {first_error})。再実行すると続きから取得します")
+    df = assemble(dataset, days, shards_root)
+    if not keep_shards:
+        shutil.rmtree(Path(shards_root) / dataset, ignore_errors=True)
+    return df
+
+
+def iter_days(
+    fetch_day: DayFetcher,
+    start: date | datetime,
+    end: date | datetime,
+    workers: int = SHARD_WORKERS,
+) -> Iterator[pd.DataFrame]:
+    """
+    期間を営業日ごとに並行して取得し、日付順に1日ずつ返す (チェックポイントは作らない)
+
+    先に取得しておくのはworkers日分までなので、呼び出し側が処理し終えた日のデータは保持しない。
+    """
+    if workers < 1:
+        raise ValueError(f"workersは1以上を指定してください: {workers}")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-iter") as pool:
+        pending: deque = deque()
+        for day in trading_days(start, end):
+            pending.append(pool.submit(fetch_day, day))
+            if len(pending) >= workers:
+                yield _to_pandas(pending.popleft().result())
+        while pending:
+            yield _to_pandas(pending.popleft().result())
@@ -0,0 +1,313 @@
+import os
+import shutil
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from jquants_free_mcp_server import bulk_writer, delta_ingest, parquet_storage, sharded_download
+
+# 1回に書き込む行数。取得したデータはこの行数まで溜めてから全ての保存先に書き込むので、
+# メモリに置くのはおおよそこの行数分 (と先読みしている日の分) になる
+BATCH_ROWS = int(os.environ.get("JQUANTS_STREAM_BATCH_ROWS", "200000"))
+
+
+def _to_pandas(df: Any) -> pd.DataFrame:
+    return df.to_pandas() if hasattr(df, "to_pandas") else df
+
+
+def rebatch(frames: Iterable[Any], batch_rows: int = BATCH_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    取得したデータ (1日分・1ページ分など) を batch_rows 行以上にまとめて返す
+
+    batch_rows 行を超える1つのデータは分割せずにそのまま返す。空のデータは飛ばす。
+    """
+    if batch_rows < 1:
+        raise ValueError(f"batch_rowsは1以上を指定してください: {batch_rows}")
+    buffer: list[pd.DataFrame] = []
+    rows = 0
+    for df in frames:
+        df = _to_pandas(df)
+        if len(df) == 0:
+            continue
+        buffer.append(df)
+        rows += len(df)
+        if rows >= batch_rows:
+            yield pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+            buffer, rows = [], 0
+    if buffer:
+        yield pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+
+
+class CsvSink:
+    """
+    CSVに追記する。close() するまでは一時ファイルに書き込み、元のCSVは変えない
+
+    from_date を指定した場合は、元のCSVの from_date より前の行をチャンクごとに読んで先に書き込む。
+    後から書き込んだデータに新しい列がある場合は、それまでに書き込んだ行を読み直して列を広げる
+    (delta_ingest で pd.concat した場合と同じく、新しい列は後ろに追加し、それまでの行は空にする)。
+    """
+
+    def __init__(self, path: str | Path, date_col: str, from_date: date | None, chunk_rows: int = BATCH_ROWS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self._chunk_rows = chunk_rows
+        self._columns: list[str] | None = None
+        if from_date is not None and self.path.exists():
+            for chunk in pd.read_csv(self.path, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+                self._append(chunk[~(delta_ingest.to_dates(chunk[date_col]) >= pd.Timestamp(from_date))])
+
+    def _append(self, df: pd.DataFrame) -> None:
+        first = self._columns is None
+        if first:
+            self._columns = list(df.columns)
+        else:
+            added = [col for col in df.columns if col not in self._columns]
+            if added:
+                self._widen(added)
+            df = df.reindex(columns=self._columns)
+        df.to_csv(self._tmp_path, mode="w" if first else "a", header=first, index=False)
+
+    def _widen(self, added: list[str]) -> None:
+        # 書き込み済みの行を列を増やして書き直す (列が増えたときだけなので、毎回は行わない)
+        self._columns = self._columns + added
+        widened_path = self._tmp_path.with_name(self._tmp_path.name + ".widen")
+        chunks = pd.read_csv(self._tmp_path, dtype=str, keep_default_na=False, chunksize=self._chunk_rows)
+        for i, chunk in enumerate(chunks):
+            chunk.reindex(columns=self._columns).to_csv(widened_path, mode="a" if i else "w", header=not i,
+                                                        index=False)
+        if not widened_path.exists():
+            pd.DataFrame(columns=self._columns).to_csv(widened_path, index=False)
+        widened_path.replace(self._tmp_path)
+
+    def write(self, df: pd.DataFrame) -> None:
+        self._append(delta_ingest.dates_to_str(df))
+
+    def close(self) -> None:
+        self._tmp_path.replace(self.path)
+
+    def abort(self) -> None:
+        self._tmp_path.unlink(missing_ok=True)
+
+
+class ParquetSink:
+    """
+    年月パーティションのParquetデータセットに追記する
+
+    年月ごとに1つのファイルを開いて行グループ単位で書き込み、close() で書き込んだ年月の
+    パーティションを置き換える (from_dateがNoneならデータセット全体を置き換える)。
+    from_date を指定した場合は、from_date を含む月の from_date より前の行を先に書き込む。
+    """
+
+    def __init__(self, dataset: str, from_date: date | None, root: str | Path = parquet_storage.PARQUET_PATH):
+        self.dataset = dataset
+        self.root = Path(root)
+        self._date_col = parquet_storage.DATASET_DATE_COLUMNS[dataset]
+        self._tmp_root = self.root / f".{dataset}.tmp"
+        self._full = from_date is None
+        self._writers: dict[tuple[int, int], pq.ParquetWriter] = {}
+        shutil.rmtree(self._tmp_root, ignore_errors=True)
+        if from_date is not None and (self.root / dataset).exists():
+            head = parquet_storage.read_dataset(dataset, start=from_date.replace(day=1),
+                                                end=from_date - timedelta(days=1), root=root)
+            if len(head):
+                self.write(head.astype({c: "object" for c in head.select_dtypes("category")}))
+
+    def _partition(self, year: int, month: int) -> Path:
+        return Path(f"year={year}") / f"month={month}"
+
+    def write(self, df: pd.DataFrame) -> None:
+        table = parquet_storage.to_compact_table(df)
+        dates = table.column(self._date_col)
+        years, months = pc.year(dates), pc.month(dates)
+        keys = pa.table({"year": years, "month": months}).group_by(["year", "month"]).aggregate([])
+        for year, month in zip(keys.column("year").to_pylist(), keys.column("month").to_pylist()):
+            part = table.filter(pc.and_(pc.equal(years, year), pc.equal(months, month)))
+            writer = self._writers.get((year, month))
+            if writer is None:
+                path = self._tmp_root / self._partition(year, month) / "part-0.parquet"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                writer = self._writers[(year, month)] = pq.ParquetWriter(path, part.schema, compression="zstd")
+            writer.write_table(parquet_storage.conform_table(part, writer.schema))
+
+    def _close_writers(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def close(self) -> None:
+        months = list(self._writers)
+        self._close_writers()
+        target = self.root / self.dataset
+        if self._full:
+            shutil.rmtree(target, ignore_errors=True)
+            self._tmp_root.rename(target)
+            return
+        for year, month in months:
+            partition = target / self._partition(year, month)
+            shutil.rmtree(partition, ignore_errors=True)
+            partition.parent.mkdir(parents=True, exist_ok=True)
+            (self._tmp_root / self._partition(year, month)).rename(partition)
+        shutil.rmtree(self._tmp_root, ignore_errors=True)
+
+    def abort(self) -> None:
+        self._close_writers()
+        shutil.rmtree(self._tmp_root, ignore_errors=True)
+
+
+class DbSink:
+    """
+    DBのテーブルにバッチごとに一括で書き込む (PostgreSQLはバッチごとのCOPY)
+
+    全てのバッチを1つのトランザクションで書き込み、索引は close() で最後に作成する。
+    from_date を指定した場合は from_date 以降の行を削除してから追加し、
+    Noneの場合 (またはテーブルがない場合) は最初のバッチでテーブルを作り直す。
+    """
+
+    def __init__(self, table: str, engine: Any, date_col: str, from_date: date | None):
+        from sqlalchemy import inspect, text
+
+        self.table = table
+        self._conn = engine.connect()
+        self._transaction = self._conn.begin()
+        self._if_exists = "replace"
+        if from_date is not None and inspect(self._conn).has_table(table):
+            quote = self._conn.dialect.identifier_preparer.quote
+            self._conn.execute(text(f"DELETE FROM {quote(table)} WHERE {quote(date_col)} >= :from_date"),
+                               {"from_date": from_date.isoformat()})
+            self._if_exists = "append"
+
+    def write(self, df: pd.DataFrame) -> None:
+        bulk_writer.write_table(df, self.table, self._conn, if_exists=self._if_exists, index_columns=[])
+        self._if_exists = "append"
+
+    def close(self) -> None:
+        bulk_writer.create_index(self.table, self._conn)
+        self._transaction.commit()
+        self._conn.close()
+
+    def abort(self) -> None:
+        self._transaction.rollback()
+        self._conn.close()
+
+
+def store_stream(
+    dataset: str,
+    frames: Iterable[Any],
+    replace_from: date | None,
+    csv_path: str | Path | None = None,
+    engine: Any = None,
+    formats: list[str] | tuple[str, ...] = ("csv",),
+    batch_rows: int = BATCH_ROWS,
+    watermarks_path: str | Path = delta_ingest.WATERMARKS_PATH,
+    parquet_root: str | Path = parquet_storage.PARQUET_PATH,
+) -> int:
+    """
+    取得したデータを batch_rows 行ずつ CSV/Parquet/DB に追記し、全て書き終えたら置き換える
+
+    delta_ingest.store_delta と同じく replace_from 以降 (Noneなら全体) を置き換えるが、
+    データ全体をメモリに置かない。途中で失敗した場合やデータがなかった場合は、
+    どの保存先も元のままにしてハイウォーターマークも更新しない。
+
+    Args:
+        dataset (str): データセット名 (delta_ingest.DATASET_DATE_COLUMNS のキー、DBのテーブル名)
+        frames (Iterable[Any]): 取得したデータ (pandas/polarsのDataFrame) を日付順に返すイテラブル
+        replace_from (date | None): 置き換える開始日. Noneの場合は全体を置き換える
+        csv_path (str | Path | None, optional): CSVの保存先 (formatsに"csv"がある場合)
+        engine (Any, optional): SQLAlchemyのエンジン. Noneの場合はDBに書き込まない
+        formats (list[str] | tuple[str, ...], optional): ローカルの保存形式 ("csv", "parquet")
+        batch_rows (int, optional): 1回に書き込む行数. Defaults to BATCH_ROWS.
+        watermarks_path (str | Path, optional): ハイウォーターマークの保存先
+        parquet_root (str | Path, optional): Parquetの保存先
+
+    Returns:
+        int: 書き込んだ行数
+    """
+    date_col = delta_ingest.date_column(dataset)
+    sinks: list[Any] = []
+    rows = 0
+    latest = None
+    try:
+        if "csv" in formats and csv_path is not None:
+            sinks.append(CsvSink(csv_path, date_col, replace_from, chunk_rows=batch_rows))
+        if "parquet" in formats:
+            sinks.append(ParquetSink(dataset, replace_from, root=parquet_root))
+        if engine is not None:
+            sinks.append(DbSink(dataset, engine, date_col, replace_from))
+        for batch in rebatch(frames, batch_rows):
+            for sink in sinks:
+                sink.write(batch)
+            rows += len(batch)
+            batch_latest = delta_ingest.to_dates(batch[date_col]).max()
+            latest = batch_latest if latest is None or batch_latest > latest else latest
+            del batch
+    except BaseException:
+        for sink in sinks:
+            sink.abort()
+        raise
+    if rows == 0:
+        for sink in sinks:
+            sink.abort()
+        return 0
+    for sink in sinks:
+        sink.close()
+    delta_ingest.update_watermark(dataset, latest.date(), replace_from is not None, watermarks_path)
+    return rows
+
+
+def fetch_stream(
+    dataset: str,
+    fetch_day: sharded_download.DayFetcher,
+    start_dt: datetime,
+    end_dt: datetime,
+    full_rebuild: bool = False,
+    watermarks_path: str | Path = delta_ingest.WATERMARKS_PATH,
+    workers: int = sharded_download.SHARD_WORKERS,
+) -> tuple[Iterator[pd.DataFrame], date | None] | None:
+    """
+    delta_ingest.fetch_delta のストリーミング版
+
+    今回取得する期間を決めて、その期間を1日ずつ取得するイテレータを返す (取得はイテレータを読むときに行う)。
+
+    Returns:
+        tuple[Iterator[pd.DataFrame], date | None] | None: (1日分ずつのデータのイテレータ, 置き換える開始日)。
+            取得するものがなければNone
+    """
+    watermarks = delta_ingest.load_watermarks(watermarks_path)
+    window = delta_ingest.delta_range(dataset, watermarks, start_dt, end_dt, full_rebuild)
+    if window is None:
+        return None
+    from_dt, to_dt = window
+    replace_from = None if full_rebuild or dataset not in watermarks else from_dt.date()
+    return sharded_download.iter_days(fetch_day, from_dt, to_dt, workers), replace_from
+
+
+def ingest(
+    dataset: str,
+    fetch_day: sharded_download.DayFetcher,
+    start_dt: datetime,
+    end_dt: datetime,
+    csv_path: str | Path | None = None,
+    engine: Any = None,
+    formats: list[str] | tuple[str, ...] = ("csv",),
+    full_rebuild: bool = False,
+    batch_rows: int = BATCH_ROWS,
+    watermarks_path: str | Path = delta_ingest.WATERMARKS_PATH,
+    parquet_root: str | Path = parquet_storage.PARQUET_PATH,
+) -> int:
+    """
+    delta_ingest.ingest のストリーミング版 (1日ずつ取得し、batch_rows 行ずつ書き込む)
+
+    Returns:
+        int: 今回取得した行数
+    """
+    stream = fetch_stream(dataset, fetch_day, start_dt, end_dt, full_rebuild, watermarks_path)
+    if stream is None:
+        return 0
+    return store_stream(dataset, *stream, csv_path=csv_path, engine=engine, formats=formats,
+                        batch_rows=batch_rows, watermarks_path=watermarks_path, parquet_root=parquet_root)
@@ -0,0 +1,37 @@
+import httpx
+import pytest
+
+from jquants_free_mcp_server import server
+from jquants_free_mcp_server.rate_limiter import TokenBucket
+
+
+@pytest.fixture
+def jquants_api(monkeypatch, tmp_path):
+    """
+    J-Quants APIをhttpx.MockTransportに差し替える
+
+    handlerを設定すると、そのhandlerでリクエストに応答する。
+    受け取ったリクエストは requests に記録される。
+    """
+
+    class MockAPI:
+        def __init__(self):
+            self.requests: list[httpx.Request] = []
+            self.handler = lambda request: httpx.Response(200, json={})
+
+        def _handle(self, request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return self.handler(request)
+
+    api = MockAPI()
+    monkeypatch.setenv("JQUANTS_ID_TOKEN", "test-token")
+    monkeypatch.setattr(server, "RESPONSE_CACHE_PATH", str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(server, "RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(server, "_response_cache", None)
+    monkeypatch.setattr(server, "_company_index", None)
+    monkeypatch.setattr(server, "_jquants_rate_limiter", TokenBucket(rate=1000.0, capacity=1000.0))
+    monkeypatch.setattr(server, "_http_clients", {
+        server.JQUANTS_CLIENT: httpx.AsyncClient(transport=httpx.MockTransport(api._handle)),
+    })
+    yield api
+    server.close_response_cache()
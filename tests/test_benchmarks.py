@@ -0,0 +1,63 @@
+import json
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "benchmarks"))
+
+from run_benchmarks import compare, run_suite  # noqa: E402
+from synthetic_data import make_datasets  # noqa: E402
+
+from jquants_free_mcp_server.custom_metrics.base import CustomMetricBase  # noqa: E402
+
+
+def test_synthetic_data_is_reproducible_and_shaped_like_the_api():
+    first = make_datasets(codes=20, days=40, seed=1)
+    second = make_datasets(codes=20, days=40, seed=1)
+
+    for name, df in first.items():
+        pd.testing.assert_frame_equal(df, second[name])
+    quotes = first["stock_price"]
+    assert quotes["Code"].nunique() == 20
+    assert (quotes["Code"] % 10 == 0).all()
+    assert quotes.groupby("Date")["Code"].is_monotonic_increasing.all()
+    assert first["stock_fin"]["NetSales"].map(type).eq(str).all()
+
+
+def test_suite_reports_every_benchmark_as_json():
+    suite = run_suite(codes=30, days=60, repeat=1)
+
+    names = [r["name"] for r in suite["results"]]
+    assert "calc_stock_metrics.add_stock_metrics" in names
+    assert "company_search.search" in names
+    assert sum(name.startswith("custom_metrics.") for name in names) == 5
+    for result in suite["results"]:
+        assert result["seconds"] > 0
+        assert result["peak_memory_mb"] >= 0
+    assert json.loads(json.dumps(suite)) == suite
+
+
+def test_compare_flags_only_slower_benchmarks():
+    baseline = {"parameters": {"codes": 10, "days": 10},
+                "results": [{"name": "a", "seconds": 1.0}, {"name": "b", "seconds": 1.0}]}
+    current = {"parameters": {"codes": 10, "days": 10},
+               "results": [{"name": "a", "seconds": 1.5}, {"name": "b", "seconds": 1.1}, {"name": "c", "seconds": 9}]}
+
+    regressions = compare(current, baseline, threshold=0.2)
+
+    assert [r["name"] for r in regressions] == ["a"]
+    with pytest.raises(ValueError):
+        compare(current, {**baseline, "parameters": {"codes": 20, "days": 10}})
+
+
+def test_custom_metrics_share_the_base_class():
+    from jquants_free_mcp_server.custom_metrics import (
+        credit_reverse_signal, foreigners_flow_signal, quality_value_signal, sector_momentum_signal,
+        short_squeeze_signal,
+    )
+
+    for module in (credit_reverse_signal, foreigners_flow_signal, quality_value_signal, sector_momentum_signal,
+                   short_squeeze_signal):
+        assert isinstance(getattr(module, module.__name__.rsplit(".", 1)[1]), CustomMetricBase)
@@ -0,0 +1,135 @@
+import csv
+import io
+
+import pandas as pd
+import polars as pl
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from jquants_free_mcp_server import bulk_writer
+
+
+def make_quotes(rows=7):
+    return pd.DataFrame({
+        "Date": pd.bdate_range("2024-08-01", periods=rows),
+        "Code": [f"{13010 + i * 10}" for i in range(rows)],
+        "Close": [1000.5 + i for i in range(rows - 1)] + [None],
+        "Volume": list(range(rows)),
+        "Upper": [True, False] * (rows // 2) + [True] * (rows % 2),
+        "Note": ['a,"b"', "", "x"] + ["y"] * (rows - 3),
+    })
+
+
+def test_column_types():
+    df = make_quotes().assign(Time=pd.Timestamp("2024-08-01 09:30"))
+
+    types = bulk_writer.column_types(df, "postgresql")
+
+    assert types == {"Date": "DATE", "Code": "TEXT", "Close": "DOUBLE PRECISION", "Volume": "BIGINT",
+                     "Upper": "BOOLEAN", "Note": "TEXT", "Time": "TIMESTAMP"}
+
+
+def test_sqlite_round_trip_and_index_after_load():
+    engine = create_engine("sqlite://")
+    df = make_quotes()
+
+    assert bulk_writer.write_table(df, "stock_price", engine, if_exists="replace") == len(df)
+    bulk_writer.write_table(df.iloc[:2], "stock_price", engine)
+
+    stored = pd.read_sql('SELECT * FROM stock_price', engine)
+    assert len(stored) == len(df) + 2
+    assert stored["Date"].iloc[0] == "2024-08-01"
+    assert stored["Close"].isna().sum() == 1
+    assert stored["Note"].iloc[0] == 'a,"b"'
+    indexes = inspect(engine).get_indexes("stock_price")
+    assert [ix["column_names"] for ix in indexes] == [["Code", "Date"]]
+
+
+def test_replace_recreates_the_table_with_new_columns():
+    engine = create_engine("sqlite://")
+    bulk_writer.write_table(make_quotes(), "stock_list", engine)
+
+    bulk_writer.write_table(pl.DataFrame({"Code": ["13010"], "CompanyName": ["極洋"]}), "stock_list", engine,
+                            if_exists="replace")
+
+    assert pd.read_sql("SELECT * FROM stock_list", engine).to_dict("records") == [
+        {"Code": "13010", "CompanyName": "極洋"}]
+
+
+def test_csv_chunks_cover_all_rows_with_null_marker():
+    df = make_quotes(rows=5)
+
+    chunks = list(bulk_writer.iter_csv_chunks(df, chunk_rows=2))
+
+    assert len(chunks) == 3
+    rows = list(csv.reader(io.StringIO("".join(chunks))))
+    assert len(rows) == 5
+    assert rows[0][0] == "2024-08-01 00:00:00"
+    assert rows[0][5] == 'a,"b"'
+    assert rows[4][2] == bulk_writer.COPY_NULL
+
+
+class FakePsycopg2Cursor:
+    def __init__(self, reads):
+        self.reads = reads
+        self.closed = False
+
+    def copy_expert(self, sql, file, size=8192):
+        self.reads.append(sql)
+        while data := file.read(size):
+            self.reads.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePsycopg3Cursor:
+    def __init__(self, reads):
+        self.reads = reads
+
+    def copy(self, sql):
+        self.reads.append(sql)
+        reads = self.reads
+
+        class Copy:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def write(self, data):
+                reads.append(data)
+
+        return Copy()
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("cursor_class", [FakePsycopg2Cursor, FakePsycopg3Cursor])
+def test_copy_from_stdin_streams_csv(cursor_class):
+    reads = []
+
+    class Connection:
+        def cursor(self):
+            return cursor_class(reads)
+
+    df = make_quotes(rows=5)
+    bulk_writer.copy_from_stdin(Connection(), "stock_price", df, chunk_rows=2)
+
+    sql, data = reads[0], "".join(reads[1:])
+    assert sql.startswith('COPY "stock_price" ("Date", "Code", "Close", "Volume", "Upper", "Note") FROM STDIN')
+    assert "FORMAT csv" in sql
+    assert data == "".join(bulk_writer.iter_csv_chunks(df))
+
+
+def test_csv_stream_reads_in_requested_sizes():
+    stream = bulk_writer.CsvStream(iter(["abc", "defg", "h"]))
+
+    assert [stream.read(3), stream.read(3), stream.read(3), stream.read(3)] == ["abc", "def", "gh", ""]
+
+
+def test_rejects_unknown_if_exists():
+    with pytest.raises(ValueError):
+        bulk_writer.write_table(make_quotes(), "stock_price", create_engine("sqlite://"), if_exists="fail")
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+
+
+def make_prices(codes=6, days=120, seed=0):
+    """銘柄が日付ごとに交互に並ぶ (APIの日付指定取得と同じ) 株価データを作る"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2023-01-02", periods=days).strftime("%Y-%m-%d")
+    frames = []
+    for i in range(codes):
+        close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+        volume = rng.lognormal(10, 1, days)
+        low = close * (1 - rng.uniform(0, 0.02, days))
+        low[rng.random(days) < 0.05] = np.nan
+        frames.append(pd.DataFrame({
+            "Date": dates,
+            "Code": 10000 + i * 10,
+            "AdjustmentClose": close,
+            "AdjustmentLow": low,
+            "AdjustmentVolume": volume,
+        }))
+    # 途中から上場した銘柄 (行数が移動平均の期間に満たない)
+    frames[-1] = frames[-1].iloc[-20:]
+    df = pd.concat(frames).sort_values(["Date", "Code"], kind="stable")
+    return df.reset_index(drop=True)
+
+
+def reference_terms_SMA_over(is_SMA_over):
+    """各行ごとに上回った日の一覧を走査する従来の get_days"""
+    dates_SMA_over = is_SMA_over.index[is_SMA_over == 1].astype("int")
+
+    def get_days(x):
+        if dates_SMA_over[dates_SMA_over <= x].size > 0:
+            return x - dates_SMA_over[dates_SMA_over <= x][-1]
+        return None
+
+    return is_SMA_over.index.to_series(index=is_SMA_over.index).apply(get_days)
+
+
+def reference_add_stock_metrics(df):
+    """銘柄ごとに抜き出して rolling().mean() で計算し、結合し直す従来の実装"""
+    close, low, volume = "AdjustmentClose", "AdjustmentLow", "AdjustmentVolume"
+    frames = []
+    for code in df[csm.RAW_STOCK_CODE].unique():
+        df_filter = df[df[csm.RAW_STOCK_CODE] == code].copy()
+        # add_ma_dev_rate(short=5, middle=25, long=75)
+        for n in (5, 25, 75):
+            df_filter[f"SMA{n}"] = df_filter[close].rolling(window=n).mean()
+        for n in (5, 25, 75):
+            df_filter[f"SMA{n}_乖離率"] = (df_filter[close] - df_filter[f"SMA{n}"]) / df_filter[f"SMA{n}"] * 100
+        df_filter["PerfectOrder"] = np.where((df_filter["SMA5"] > df_filter["SMA25"]) &
+                                             (df_filter["SMA25"] > df_filter["SMA75"]), 1, 0)
+        # add_metrics_kaidan(30)
+        df_filter[low] = df_filter[low].ffill()
+        df_filter["HigherLowDays"] = (df_filter[low] >= df_filter[low].shift(1)).cumsum()
+        volume_mean = df_filter[volume].rolling(window=30).mean()
+        df_filter["HighVolumeDates"] = df_filter["Date"].where(df_filter[volume] >= volume_mean * 5).ffill()
+        # SMA_over(5)
+        df_filter["tanki_SMA"] = df_filter[close].rolling(window=5).mean()
+        df_filter["is_tanki_SMA_over"] = (df_filter[close] > df_filter["tanki_SMA"]).astype(int)
+        df_filter["terms_SMA_over"] = reference_terms_SMA_over(df_filter["is_tanki_SMA_over"])
+        frames.append(df_filter)
+    return pd.concat(frames)
+
+
+def test_add_stock_metrics_matches_per_code_loop():
+    df = make_prices()
+
+    expected = reference_add_stock_metrics(df)
+    actual = csm.add_stock_metrics(df.copy())
+
+    # 移動平均は累積和の差で求めるので、rolling().mean() とは丸め誤差の分だけ異なる
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, rtol=1e-12)
+
+
+def test_add_stock_metrics_does_not_modify_input():
+    df = make_prices(codes=2, days=40)
+    original = df.copy()
+
+    csm.add_stock_metrics(df)
+
+    pd.testing.assert_frame_equal(df, original)
+
+
+def test_terms_SMA_over_counts_trading_days_per_code():
+    df = make_prices(codes=3, days=60)
+
+    actual = csm.add_stock_metrics(df.copy(), distance="trading_days")
+
+    for code, group in actual.groupby("Code"):
+        # 銘柄単体でindexを振り直せば、indexの差 = 営業日数の差
+        single = csm.SMA_over(df[df["Code"] == code].reset_index(drop=True), 5)
+        expected = reference_terms_SMA_over(single["is_tanki_SMA_over"])
+        np.testing.assert_array_equal(group["terms_SMA_over"].to_numpy(), expected.to_numpy(dtype=float))
+
+
+def test_terms_SMA_over_rejects_unknown_distance():
+    with pytest.raises(ValueError):
+        csm.add_stock_metrics(make_prices(codes=1, days=10), distance="calendar")
@@ -0,0 +1,45 @@
+from jquants_free_mcp_server.company_search import CompanySearchIndex, normalize_text
+
+RECORDS = [
+    {"Code": "62010", "CompanyName": "豊田自動織機", "CompanyNameEnglish": "TOYOTA INDUSTRIES CORPORATION"},
+    {"Code": "72030", "CompanyName": "トヨタ自動車", "CompanyNameEnglish": "TOYOTA MOTOR CORPORATION"},
+    {"Code": "99990", "CompanyName": "ネッツトヨタ", "CompanyNameEnglish": "NETZ TOYOTA"},
+    {"Code": "130A0", "CompanyName": "ベリフォー", "CompanyNameEnglish": "Veritas In Silico"},
+    {"Code": "30000", "CompanyName": "ﾄﾖﾀ", "CompanyNameEnglish": ""},
+]
+
+
+def codes(records):
+    return [r["Code"] for r in records]
+
+
+def test_normalize_text_folds_width_case_and_kana():
+    assert normalize_text("ﾄﾖﾀ Ｍｏｔｏｒ") == normalize_text("とよたmotor")
+
+
+def test_search_ranks_exact_then_prefix_then_substring():
+    index = CompanySearchIndex(RECORDS)
+
+    # 完全一致 (ﾄﾖﾀ) > 前方一致 (トヨタ自動車) > 部分一致 (ネッツトヨタ)
+    assert codes(index.search("トヨタ")) == ["30000", "72030", "99990"]
+
+
+def test_search_matches_code_first():
+    index = CompanySearchIndex(RECORDS)
+
+    assert codes(index.search("7203")) == ["72030"]
+    assert codes(index.search("72030")) == ["72030"]
+
+
+def test_search_matches_alphanumeric_code():
+    index = CompanySearchIndex(RECORDS)
+
+    assert codes(index.search("130A0")) == ["130A0"]
+    assert codes(index.search("130A")) == ["130A0"]
+    assert codes(index.search("130a")) == ["130A0"]
+
+
+def test_search_applies_start_position_and_limit():
+    index = CompanySearchIndex(RECORDS)
+
+    assert codes(index.search("toyota", limit=2, start_position=1)) == codes(index.search("toyota"))[1:3]
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from jquants_free_mcp_server import delta_ingest, parquet_storage
+
+
+def make_source(days=60, codes=3):
+    """J-Quants APIの株価 (jquantsapiと同じく日付はdatetime64)"""
+    dates = pd.bdate_range("2024-08-01", periods=days)
+    return pd.DataFrame({
+        "Date": dates.repeat(codes),
+        "Code": [str(13010 + i * 10) for i in range(codes)] * days,
+        "Close": [float(i) for i in range(days * codes)],
+    })
+
+
+class FakeAPI:
+    def __init__(self, source):
+        self.source = source
+        self.calls = []
+
+    def fetch(self, from_dt, to_dt):
+        self.calls.append((from_dt.date(), to_dt.date()))
+        dates = self.source["Date"]
+        return self.source[(dates >= pd.Timestamp(from_dt.date())) & (dates <= pd.Timestamp(to_dt.date()))]
+
+
+START = datetime(2024, 8, 1, 9)
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {
+        "csv_path": tmp_path / "stock_price.csv",
+        "watermarks_path": tmp_path / "watermarks.json",
+        "parquet_root": tmp_path / "parquet",
+    }
+
+
+def test_second_run_fetches_only_the_missing_range(paths):
+    api = FakeAPI(make_source())
+    first_end, second_end = datetime(2024, 9, 2, 9), datetime(2024, 10, 22, 9)
+
+    delta_ingest.ingest("stock_price", api.fetch, START, first_end, **paths)
+    delta_ingest.ingest("stock_price", api.fetch, START, second_end, **paths)
+
+    assert api.calls[0][0] == START.date()
+    # 前回の最終日 (9/2) から REFETCH_DAYS 日さかのぼって取り直す
+    assert api.calls[1][0] == datetime(2024, 8, 26).date()
+    assert delta_ingest.load_watermarks(paths["watermarks_path"]) == {"stock_price": "2024-10-22"}
+
+    full = FakeAPI(make_source()).fetch(START, second_end)
+    stored = pd.read_csv(paths["csv_path"])
+    assert len(stored) == len(full)
+    assert stored["Close"].tolist() == full["Close"].tolist()
+    assert stored["Date"].iloc[0] == "2024-08-01"
+
+
+def test_rerunning_is_idempotent(paths):
+    api = FakeAPI(make_source())
+    end = datetime(2024, 9, 30, 9)
+
+    delta_ingest.ingest("stock_price", api.fetch, START, end, **paths)
+    first = paths["csv_path"].read_bytes()
+    delta_ingest.ingest("stock_price", api.fetch, START, end, **paths)
+
+    assert paths["csv_path"].read_bytes() == first
+
+
+def test_full_rebuild_ignores_the_watermark(paths):
+    api = FakeAPI(make_source())
+    delta_ingest.ingest("stock_price", api.fetch, START, datetime(2024, 9, 30, 9), **paths)
+
+    delta_ingest.ingest("stock_price", api.fetch, START, datetime(2024, 8, 9, 9), full_rebuild=True, **paths)
+
+    assert api.calls[-1][0] == START.date()
+    assert pd.read_csv(paths["csv_path"])["Date"].max() == "2024-08-09"
+    assert delta_ingest.load_watermarks(paths["watermarks_path"]) == {"stock_price": "2024-08-09"}
+
+
+def test_failed_fetch_does_not_advance_the_watermark(paths):
+    api = FakeAPI(make_source())
+    delta_ingest.ingest("stock_price", api.fetch, START, datetime(2024, 9, 2, 9), **paths)
+
+    def failing(from_dt, to_dt):
+        raise RuntimeError("network")
+
+    with pytest.raises(RuntimeError):
+        delta_ingest.ingest("stock_price", failing, START, datetime(2024, 9, 30, 9), **paths)
+
+    assert delta_ingest.load_watermarks(paths["watermarks_path"]) == {"stock_price": "2024-09-02"}
+
+
+def test_parquet_keeps_the_earlier_part_of_a_partially_refetched_month(paths):
+    api = FakeAPI(make_source())
+    end = datetime(2024, 10, 22, 9)
+
+    delta_ingest.ingest("stock_price", api.fetch, START, datetime(2024, 9, 16, 9), formats=("parquet",), **paths)
+    delta_ingest.ingest("stock_price", api.fetch, START, end, formats=("parquet",), **paths)
+
+    stored = parquet_storage.read_dataset("stock_price", root=paths["parquet_root"])
+    full = api.fetch(START, end)
+    assert len(stored) == len(full)
+    assert stored["Close"].tolist() == full["Close"].tolist()
+
+
+def test_db_rows_in_the_refetched_range_are_replaced(paths):
+    engine = create_engine("sqlite://")
+    api = FakeAPI(make_source())
+    end = datetime(2024, 10, 22, 9)
+
+    delta_ingest.ingest("stock_price", api.fetch, START, datetime(2024, 9, 2, 9), engine=engine, **paths)
+    delta_ingest.ingest("stock_price", api.fetch, START, end, engine=engine, **paths)
+    delta_ingest.ingest("stock_price", api.fetch, START, end, engine=engine, **paths)
+
+    stored = pd.read_sql("SELECT * FROM stock_price ORDER BY Date, Code", engine)
+    assert stored["Close"].tolist() == api.fetch(START, end)["Close"].tolist()
+
+
+def test_unknown_dataset_is_rejected(paths):
+    with pytest.raises(ValueError):
+        delta_ingest.ingest("stock_list", FakeAPI(make_source()).fetch, START, START, **paths)
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from jquants_free_mcp_server import server
+
+
+def sse(*events: dict) -> bytes:
+    lines = ["event: ping", ""]
+    for event in events:
+        lines += ["data: " + json.dumps(event, ensure_ascii=False), ""]
+    return "\n".join(lines).encode()
+
+
+@pytest.fixture
+def dify_api(monkeypatch):
+    """Dify APIを、設定したSSE本文を返すhttpx.MockTransportに差し替える"""
+
+    class MockDify:
+        def __init__(self):
+            self.body = b""
+            self.requests: list[httpx.Request] = []
+
+        def _handle(self, request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=self.body)
+
+    api = MockDify()
+    monkeypatch.setattr(server, "DIFY_API_KEY", "test-key")
+    monkeypatch.setattr(server, "_http_clients", {
+        server.DIFY_CLIENT: httpx.AsyncClient(transport=httpx.MockTransport(api._handle)),
+    })
+    return api
+
+
+class FakeContext:
+    def __init__(self):
+        self.progress = []
+
+    async def report_progress(self, progress, total=None, message=None):
+        self.progress.append((progress, message))
+
+
+def test_stream_collects_chunks_in_order(dify_api):
+    dify_api.body = sse(
+        {"event": "message", "message_id": "m1", "answer": "売上"},
+        {"event": "message", "message_id": "m1", "answer": "は"},
+        {"event": "message", "message_id": "m1", "answer": "増加"},
+        {"event": "message_end", "message_id": "m1", "metadata": {"usage": {"total_tokens": 3}}},
+    )
+    chunks = []
+
+    async def on_chunk(chunk):
+        chunks.append(chunk)
+
+    result = asyncio.run(server.stream_dify_request("prompt", on_chunk=on_chunk))
+
+    assert chunks == ["売上", "は", "増加"]
+    assert result["answer"] == "売上は増加"
+    assert result["message_id"] == "m1"
+    assert result["metadata"] == {"usage": {"total_tokens": 3}}
+    assert 0 <= result["time_to_first_token_ms"] <= result["total_ms"]
+    assert json.loads(dify_api.requests[0].content)["response_mode"] == "streaming"
+
+
+def test_analyze_with_dify_reports_each_chunk_as_progress(dify_api):
+    dify_api.body = sse(
+        {"event": "message", "answer": "a"},
+        {"event": "message", "answer": "b"},
+        {"event": "message_end"},
+    )
+    ctx = FakeContext()
+
+    result = json.loads(asyncio.run(server.analyze_with_dify('{"x": 1}', stream=True, ctx=ctx)))
+
+    assert result["status"] == "success"
+    assert result["analysis"] == "ab"
+    assert result["total_ms"] >= result["time_to_first_token_ms"]
+    assert ctx.progress == [(1, "a"), (2, "b")]
+
+
+def test_stream_error_event(dify_api):
+    dify_api.body = sse(
+        {"event": "message", "answer": "途中"},
+        {"event": "error", "status": 400, "message": "quota exceeded"},
+    )
+
+    result = asyncio.run(server.stream_dify_request("prompt"))
+
+    assert result["status"] == "stream_error"
+    assert "quota exceeded" in result["error"]
+    assert result["answer"] == "途中"
+
+
+def test_stream_without_message_end_is_an_error(dify_api):
+    dify_api.body = sse({"event": "message", "answer": "途中まで"})
+
+    result = asyncio.run(server.stream_dify_request("prompt"))
+
+    assert result["status"] == "stream_incomplete"
+    assert result["answer"] == "途中まで"
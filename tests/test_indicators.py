@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from jquants_free_mcp_server.indicators import add_indicators, compute_indicators
+from test_calc_stock_metrics import make_prices
+
+INDICATORS = {
+    "sma": [5, 25, 75, 200],
+    "ema": [12],
+    "volume_mean": [30],
+    "deviation": [25, 75],
+    "perfect_order": [5, 25, 75],
+}
+
+
+def reference(df):
+    """銘柄ごとに rolling / ewm で1列ずつ計算する"""
+    grouped = df.groupby("Code", sort=False)
+    close = grouped["AdjustmentClose"]
+    out = pd.DataFrame(index=df.index)
+    for w in INDICATORS["sma"]:
+        out[f"SMA{w}"] = close.rolling(w).mean().droplevel(0)
+    out["EMA12"] = close.ewm(span=12, adjust=False, min_periods=12).mean().droplevel(0)
+    out["VolumeMean30"] = grouped["AdjustmentVolume"].rolling(30).mean().droplevel(0)
+    for w in INDICATORS["deviation"]:
+        out[f"SMA{w}_乖離率"] = (df["AdjustmentClose"] - out[f"SMA{w}"]) / out[f"SMA{w}"] * 100
+    out["PerfectOrder"] = ((out["SMA5"] > out["SMA25"]) & (out["SMA25"] > out["SMA75"])).astype(int)
+    return out
+
+
+def test_matches_rolling_per_code():
+    df = make_prices(codes=6, days=260)
+    df.loc[df.sample(frac=0.02, random_state=0).index, "AdjustmentClose"] = np.nan
+
+    actual = pd.DataFrame(compute_indicators(df, INDICATORS, by="Code"), index=df.index)
+
+    expected = reference(df).loc[df.index]
+    assert list(actual.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, rtol=1e-10)
+
+
+def test_rows_do_not_need_to_be_grouped_by_code():
+    df = make_prices(codes=4, days=120)
+    grouped = df.sort_values("Code", kind="stable")
+
+    interleaved = pd.DataFrame(compute_indicators(df, INDICATORS, by="Code"), index=df.index)
+    contiguous = pd.DataFrame(compute_indicators(grouped, INDICATORS, by="Code"), index=grouped.index)
+
+    pd.testing.assert_frame_equal(interleaved, contiguous.loc[df.index])
+
+
+def test_flat_prices_keep_moving_averages_exactly_equal():
+    df = pd.DataFrame({"AdjustmentClose": np.r_[np.full(100, 1234.56), np.full(100, 987.65)]})
+
+    result = compute_indicators(df, {"sma": [5, 25, 75], "perfect_order": [5, 25, 75]})
+
+    flat = slice(175, 200)
+    assert (result["SMA5"][flat] == result["SMA75"][flat]).all()
+    assert (result["PerfectOrder"] == 0).all()
+
+
+def test_add_indicators_appends_columns_in_request_order():
+    df = make_prices(codes=2, days=40)
+
+    add_indicators(df, {"perfect_order": [5, 20], "sma": [20, 5]}, by="Code")
+
+    assert list(df.columns[-3:]) == ["PerfectOrder", "SMA20", "SMA5"]
+
+
+@pytest.mark.parametrize("indicators", [{"macd": [12]}, {"sma": [0]}, {"perfect_order": [25]}])
+def test_rejects_invalid_indicators(indicators):
+    with pytest.raises(ValueError):
+        compute_indicators(make_prices(codes=1, days=10), indicators)
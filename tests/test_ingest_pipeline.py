@@ -0,0 +1,121 @@
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from jquants_free_mcp_server import delta_ingest
+from jquants_free_mcp_server.ingest_pipeline import format_timings, run_pipeline
+
+
+def sleeping_job(name, fetch_seconds, write_seconds, written=None):
+    def fetch():
+        time.sleep(fetch_seconds)
+        return name
+
+    def write(data):
+        time.sleep(write_seconds)
+        if written is not None:
+            written.append(data)
+        return 1
+
+    return name, fetch, write
+
+
+def test_fetch_and_write_overlap():
+    jobs = [sleeping_job(f"d{i}", 0.15, 0.1) for i in range(4)]
+
+    report = run_pipeline(jobs, fetch_workers=4, write_workers=2, queue_size=2)
+
+    assert [r["rows"] for r in report["datasets"]] == [1, 1, 1, 1]
+    assert report["serial_seconds"] >= 1.0
+    # 取得は4つ同時、保存は2つずつ: 0.15 + 0.1 * 2 程度
+    assert report["wall_seconds"] < 0.6
+
+
+def test_queue_bounds_fetched_data_waiting_to_be_written():
+    lock = threading.Lock()
+    state = {"pending": 0, "max_pending": 0}
+
+    def job(i):
+        def fetch():
+            with lock:
+                state["pending"] += 1
+                state["max_pending"] = max(state["max_pending"], state["pending"])
+            return i
+
+        def write(data):
+            time.sleep(0.02)
+            with lock:
+                state["pending"] -= 1
+            return 1
+
+        return f"d{i}", fetch, write
+
+    run_pipeline([job(i) for i in range(10)], fetch_workers=2, write_workers=1, queue_size=2)
+
+    # 保存中の1つ + キューの2つ + put で待っている取得スレッドの2つ (上限がなければ10件全てが溜まる)
+    assert state["max_pending"] <= 1 + 2 + 2
+    assert state["pending"] == 0
+
+
+def test_failure_is_reported_without_stopping_other_datasets():
+    written = []
+
+    def failing_fetch():
+        raise RuntimeError("HTTP 500")
+
+    def failing_write(data):
+        raise ValueError("disk full")
+
+    jobs = [
+        ("broken_fetch", failing_fetch, lambda data: 1),
+        sleeping_job("ok", 0, 0, written),
+        ("broken_write", lambda: "x", failing_write),
+        ("nothing_new", lambda: None, lambda data: pytest.fail("保存されない")),
+    ]
+
+    report = run_pipeline(jobs, fetch_workers=2, write_workers=2)
+
+    errors = {r["dataset"]: r["error"] for r in report["datasets"]}
+    assert errors == {"broken_fetch": "RuntimeError: HTTP 500", "ok": None,
+                      "broken_write": "ValueError: disk full", "nothing_new": None}
+    assert written == ["ok"]
+    assert "broken_fetch" in format_timings(report)
+
+
+def test_rejects_invalid_workers():
+    with pytest.raises(ValueError):
+        run_pipeline([], fetch_workers=0)
+
+
+def test_concurrent_store_delta_keeps_every_watermark(tmp_path):
+    watermarks_path = tmp_path / "watermarks.json"
+    datasets = list(delta_ingest.DATASET_DATE_COLUMNS)
+
+    def store(dataset):
+        date_col = delta_ingest.DATASET_DATE_COLUMNS[dataset]
+        df = pd.DataFrame({date_col: ["2024-09-02", "2024-09-03"], "Value": [1, 2]})
+        for _ in range(5):
+            delta_ingest.store_delta(dataset, df, None, csv_path=tmp_path / f"{dataset}.csv",
+                                     watermarks_path=watermarks_path)
+
+    threads = [threading.Thread(target=store, args=(dataset,)) for dataset in datasets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert delta_ingest.load_watermarks(watermarks_path) == {dataset: "2024-09-03" for dataset in datasets}
+
+
+def test_store_delta_keeps_a_later_watermark_on_partial_refetch(tmp_path):
+    watermarks_path = tmp_path / "watermarks.json"
+    delta_ingest.save_watermarks({"stock_price": "2024-09-10"}, watermarks_path)
+    df = pd.DataFrame({"Date": ["2024-09-03"], "Code": ["13010"]})
+
+    delta_ingest.store_delta("stock_price", df, date(2024, 9, 3), csv_path=tmp_path / "stock_price.csv",
+                             watermarks_path=watermarks_path)
+
+    assert delta_ingest.load_watermarks(watermarks_path) == {"stock_price": "2024-09-10"}
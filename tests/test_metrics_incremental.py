@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+from jquants_free_mcp_server import metrics_incremental
+from test_calc_stock_metrics import make_prices
+
+
+def run_in_batches(df, bounds, distance, tmp_path):
+    """bounds の行範囲ごとに、状態を保存・読み込みしながら差分計算する"""
+    state_path = tmp_path / "state.pkl"
+    frames = []
+    for start, stop in bounds:
+        state = metrics_incremental.load_state(state_path)
+        result, state = metrics_incremental.update_stock_metrics(df.iloc[start:stop].copy(), state, distance)
+        metrics_incremental.save_state(state, state_path)
+        frames.append(result)
+    return pd.concat(frames), metrics_incremental.load_state(state_path)
+
+
+@pytest.mark.parametrize("distance", csm.SMA_OVER_DISTANCES)
+def test_incremental_update_matches_full_recompute(tmp_path, distance):
+    df = make_prices(codes=5, days=150)
+    # 途中で上場する銘柄 (make_pricesの最後の銘柄) の前後、1日だけの追加を含める
+    bounds = [(0, 300), (300, 301), (301, 650), (650, len(df))]
+
+    actual, state = run_in_batches(df, bounds, distance, tmp_path)
+    expected = csm.add_stock_metrics(df.copy(), distance=distance)
+
+    assert state["rows"] == len(df)
+    pd.testing.assert_frame_equal(actual.sort_index(), expected.sort_index(), check_dtype=False, rtol=1e-9)
+
+
+def test_update_without_state_equals_add_stock_metrics():
+    df = make_prices(codes=3, days=80)
+
+    actual, _ = metrics_incremental.update_stock_metrics(df.copy())
+
+    pd.testing.assert_frame_equal(actual, csm.add_stock_metrics(df.copy()), check_dtype=False)
+
+
+def test_state_keeps_only_the_tail_window():
+    df = make_prices(codes=2, days=200)
+
+    _, state = metrics_incremental.update_stock_metrics(df.copy())
+
+    assert state["tail"].groupby("Code").size().max() == metrics_incremental.TAIL_DAYS
+
+
+def read_and_update(path, state):
+    """calc_stock_metrics.py --incremental と同じ手順で、追加された行を読み込んで状態を更新する"""
+    if state is not None and not metrics_incremental.state_matches(state, path):
+        state = None
+    new, position = metrics_incremental.read_new_prices(path, state)
+    result, state = metrics_incremental.update_stock_metrics(new, state)
+    state.update(position)
+    return new, result, state
+
+
+def test_read_new_prices_skips_processed_rows(tmp_path):
+    df = make_prices(codes=2, days=10)
+    path = tmp_path / "stock_price.csv"
+    df.iloc[:15].to_csv(path, index=False)
+    _, _, state = read_and_update(path, None)
+    df.to_csv(path, index=False)
+
+    assert metrics_incremental.state_matches(state, path)
+    new, _, state = read_and_update(path, state)
+
+    assert list(new.index) == list(range(15, len(df)))
+    assert new["Code"].tolist() == df["Code"].iloc[15:].tolist()
+    assert state["rows"] == len(df)
+    assert state["offset"] == path.stat().st_size
+    # 行が追加されていなければ何も読み込まない
+    assert read_and_update(path, state)[0].empty
+
+
+def test_rewritten_rows_do_not_match_the_state(tmp_path):
+    df = make_prices(codes=2, days=10)
+    path = tmp_path / "stock_price.csv"
+    df.iloc[:15].to_csv(path, index=False)
+    _, _, state = read_and_update(path, None)
+
+    # 直近の取り直しで処理済みの行の値が変わり、行数もずれた
+    refetched = df.drop(index=3).copy()
+    refetched.loc[12, "AdjustmentClose"] += 1
+    refetched.to_csv(path, index=False)
+    assert not metrics_incremental.state_matches(state, path)
+    # 作り直して短くなった場合も同じ
+    df.iloc[:10].to_csv(path, index=False)
+    assert not metrics_incremental.state_matches(state, path)
+
+    refetched.to_csv(path, index=False)
+    new, result, state = read_and_update(path, state)
+
+    assert len(new) == len(refetched)
+    pd.testing.assert_frame_equal(result.reset_index(drop=True),
+                                  csm.add_stock_metrics(pd.read_csv(path)).reset_index(drop=True), check_dtype=False)
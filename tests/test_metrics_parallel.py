@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+from jquants_free_mcp_server.metrics_parallel import partition_codes, run_per_code_parallel
+from test_calc_stock_metrics import make_prices
+
+
+def test_partition_codes_splits_only_at_code_boundaries():
+    codes = np.repeat([1, 2, 3, 4, 5], [10, 1, 7, 3, 9])
+
+    chunks = partition_codes(codes, 3)
+
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(codes)
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+    for start, stop in chunks[1:]:
+        assert codes[start] != codes[start - 1]
+
+
+def test_partition_codes_never_returns_more_chunks_than_codes():
+    assert partition_codes(np.array([7, 7, 7]), 4) == [(0, 3)]
+    assert partition_codes(np.array([], dtype=int), 4) == []
+
+
+def test_parallel_matches_serial():
+    df = make_prices(codes=7, days=90)
+
+    expected = csm.add_stock_metrics(df.copy(), distance="trading_days")
+    actual = run_per_code_parallel(df.copy(), workers=2, distance="trading_days")
+
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_exact=True)
+
+
+def test_parallel_restores_string_codes():
+    df = make_prices(codes=3, days=40)
+    df["Code"] = df["Code"].astype(str).str.replace("0$", "A", regex=True)
+
+    actual = run_per_code_parallel(df.copy(), workers=2)
+
+    assert actual["Code"].tolist() == csm.add_stock_metrics(df.copy())["Code"].tolist()
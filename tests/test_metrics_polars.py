@@ -0,0 +1,28 @@
+import pytest
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+from test_calc_stock_metrics import make_prices
+
+pl = pytest.importorskip("polars")
+metrics_polars = pytest.importorskip("jquants_free_mcp_server.metrics_polars")
+
+
+@pytest.fixture
+def price_csv(tmp_path):
+    path = tmp_path / "stock_price.csv"
+    make_prices().to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize("distance", csm.SMA_OVER_DISTANCES)
+def test_polars_backend_matches_pandas(price_csv, distance):
+    expected = csm.calc_stock_metrics_file(price_csv, backend="pandas", distance=distance)
+    actual = csm.calc_stock_metrics_file(price_csv, backend="polars", distance=distance)
+
+    assert list(actual.columns) == list(expected.columns)
+    metrics_polars.verify_against_pandas(expected, actual)
+
+
+def test_unknown_backend_is_rejected(price_csv):
+    with pytest.raises(ValueError):
+        csm.calc_stock_metrics_file(price_csv, backend="spark")
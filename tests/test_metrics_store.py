@@ -0,0 +1,151 @@
+import asyncio
+import json
+import math
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+from jquants_free_mcp_server import server
+from jquants_free_mcp_server.metrics_store import MetricsStore, build_metrics_store
+from test_calc_stock_metrics import make_prices
+
+
+@pytest.fixture
+def metrics():
+    return csm.add_stock_metrics(make_prices(codes=6, days=120))
+
+
+@pytest.fixture
+def store(tmp_path, metrics):
+    store = MetricsStore(build_metrics_store(metrics, tmp_path / "metrics.sqlite3"))
+    yield store
+    store.close()
+
+
+def test_get_returns_the_rows_of_one_code_in_date_order(store, metrics):
+    expected = metrics[metrics["Code"] == 10010].sort_values("Date")
+    expected = expected[expected["Date"].between("2023-03-01", "2023-03-31")]
+
+    records = store.get("1001", "2023-03-01", "2023-03-31", ["SMA25", "PerfectOrder"])
+
+    assert [r["Date"] for r in records] == expected["Date"].tolist()
+    assert {r["Code"] for r in records} == {"10010"}
+    assert list(records[0]) == ["Code", "Date", "SMA25", "PerfectOrder"]
+    assert [r["SMA25"] for r in records] == pytest.approx(expected["SMA25"].tolist())
+
+
+def test_missing_values_are_returned_as_none(store):
+    first = store.get("10000", fields=["SMA75"])[0]
+
+    assert first["SMA75"] is None
+
+
+def test_screen_filters_by_date_and_conditions(store, metrics):
+    date = metrics["Date"].max()
+    day = metrics[metrics["Date"] == date]
+    expected = day[(day["PerfectOrder"] == 1) & (day["SMA25_乖離率"] > 0)]["Code"].astype(str).tolist()
+
+    records = store.screen(date, {"PerfectOrder": 1, "SMA25_乖離率": {"gt": 0}})
+
+    assert [r["Code"] for r in records] == sorted(expected)
+    assert all(r["Date"] == date and r["PerfectOrder"] == 1 for r in records)
+
+
+def test_screen_rejects_unknown_columns_and_operators(store):
+    with pytest.raises(ValueError):
+        store.screen("2023-06-01", {"PerfectOrder; DROP TABLE stock_metrics": 1})
+    with pytest.raises(ValueError):
+        store.screen("2023-06-01", {"SMA25": {"between": 1}})
+
+
+def test_rebuilding_replaces_the_store(tmp_path, metrics):
+    path = tmp_path / "metrics.sqlite3"
+    build_metrics_store(metrics, path)
+    build_metrics_store(metrics[metrics["Date"] < "2023-02-01"], path)
+
+    store = MetricsStore(path)
+    try:
+        assert store.latest_date() < "2023-02-01"
+    finally:
+        store.close()
+
+
+def test_tools_read_from_the_store(tmp_path, metrics, monkeypatch):
+    path = build_metrics_store(metrics, tmp_path / "metrics.sqlite3")
+    monkeypatch.setattr(server, "METRICS_STORE_PATH", str(path))
+    monkeypatch.setattr(server, "_metrics_store", None)
+    try:
+        quotes = json.loads(asyncio.run(server.get_stock_metrics(
+            "10000", "2023-06-01", "2023-06-09", fields=["trend"], output_format="columnar",
+        )))
+        screened = json.loads(asyncio.run(server.screen_stock_metrics({"PerfectOrder": 1}, fields=["sma"])))
+        invalid = json.loads(asyncio.run(server.get_stock_metrics("10000", fields=["SMA26"])))
+    finally:
+        server.close_metrics_store()
+
+    assert quotes["format"] == "columnar"
+    assert quotes["stock_metrics"]["Date"][0] == "2023-06-01"
+    assert "terms_SMA_over" in quotes["stock_metrics"]
+    assert screened["date"] == metrics["Date"].max()
+    assert all(not math.isnan(r["SMA75"]) for r in screened["stock_metrics"])
+    assert invalid["status"] == "invalid_parameter"
+
+
+def test_screen_rejects_a_non_positive_limit_and_caps_large_ones(tmp_path, metrics, monkeypatch):
+    path = build_metrics_store(metrics, tmp_path / "metrics.sqlite3")
+    monkeypatch.setattr(server, "METRICS_STORE_PATH", str(path))
+    monkeypatch.setattr(server, "_metrics_store", None)
+    monkeypatch.setattr(server, "SCREEN_MAX_LIMIT", 2)
+    try:
+        invalid = [json.loads(asyncio.run(server.screen_stock_metrics({}, limit=limit))) for limit in (0, -1)]
+        capped = json.loads(asyncio.run(server.screen_stock_metrics({}, limit=10)))
+    finally:
+        server.close_metrics_store()
+
+    assert [r["status"] for r in invalid] == ["invalid_parameter", "invalid_parameter"]
+    assert len(capped["stock_metrics"]) == 2
+
+
+def test_server_reopens_a_rebuilt_store(tmp_path, metrics, monkeypatch):
+    path = tmp_path / "metrics.sqlite3"
+    build_metrics_store(metrics[metrics["Date"] < "2023-02-01"], path)
+    monkeypatch.setattr(server, "METRICS_STORE_PATH", str(path))
+    monkeypatch.setattr(server, "_metrics_store", None)
+    try:
+        before = json.loads(asyncio.run(server.screen_stock_metrics({"PerfectOrder": 1})))
+        build_metrics_store(metrics, path)
+        after = json.loads(asyncio.run(server.screen_stock_metrics({"PerfectOrder": 1})))
+    finally:
+        server.close_metrics_store()
+
+    assert before["date"] < "2023-02-01"
+    assert after["date"] == metrics["Date"].max()
+
+
+def test_server_imports_without_pandas():
+    blocker = (
+        "import sys\n"
+        "class Block:\n"
+        "    def find_spec(self, name, path=None, target=None):\n"
+        "        if name.split('.')[0] in ('pandas', 'numpy', 'pyarrow', 'polars'):\n"
+        "            raise ImportError(name)\n"
+        "sys.meta_path.insert(0, Block())\n"
+        "import jquants_free_mcp_server.server\n"
+    )
+    src = Path(__file__).resolve().parents[1] / "src"
+    result = subprocess.run([sys.executable, "-c", blocker], capture_output=True, text=True,
+                            env={"PYTHONPATH": str(src), "PATH": ""})
+
+    assert result.returncode == 0, result.stderr
+
+
+def test_tools_report_a_missing_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_STORE_PATH", str(tmp_path / "missing.sqlite3"))
+    monkeypatch.setattr(server, "_metrics_store", None)
+
+    result = json.loads(asyncio.run(server.screen_stock_metrics({"PerfectOrder": 1})))
+
+    assert result["status"] == "metrics_unavailable"
@@ -0,0 +1,78 @@
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+from jquants_free_mcp_server import parquet_storage
+from jquants_free_mcp_server.metrics_streaming import stream_stock_metrics
+from test_calc_stock_metrics import make_prices
+
+
+@pytest.fixture
+def price_csv(tmp_path):
+    path = tmp_path / "stock_price.csv"
+    make_prices(codes=8, days=120).to_csv(path, index=False)
+    return path
+
+
+def read_result(path):
+    return pd.read_csv(path, index_col=0, float_precision="round_trip").sort_index()
+
+
+@pytest.mark.parametrize("distance", csm.SMA_OVER_DISTANCES)
+def test_streaming_matches_in_memory(tmp_path, price_csv, distance):
+    output = tmp_path / "result.csv"
+
+    # 上限を小さくして、複数回に分けて計算させる
+    stats = stream_stock_metrics(price_csv, output, memory_limit_mb=0.05, distance=distance, spill_partitions=8)
+
+    expected = csm.calc_stock_metrics_file(price_csv, distance=distance)
+    assert stats["rows"] == len(expected)
+    assert stats["batches"] > 1
+    assert stats["max_batch_rows"] < len(expected)
+    pd.testing.assert_frame_equal(read_result(output), expected.sort_index(), check_dtype=False, rtol=1e-12)
+
+
+def test_streaming_with_a_large_limit_runs_once(tmp_path, price_csv):
+    stats = stream_stock_metrics(price_csv, tmp_path / "result.csv", memory_limit_mb=512)
+
+    assert stats["batches"] == 1
+
+
+def test_streaming_from_parquet_to_parquet(tmp_path, price_csv):
+    prices = pd.read_csv(price_csv)
+    prices["AdjustmentOpen"] = prices["AdjustmentHigh"] = prices["AdjustmentClose"]
+    parquet_storage.write_dataset(prices, "stock_price", root=tmp_path)
+    output = tmp_path / "result.parquet"
+
+    stats = stream_stock_metrics(tmp_path / "stock_price", output, memory_limit_mb=0.05, spill_partitions=8)
+
+    expected = csm.calc_stock_metrics_file(tmp_path / "stock_price")
+    actual = pq.read_table(output).to_pandas().set_index("_row").rename_axis(None).sort_index()
+    assert stats["rows"] == len(expected)
+    assert actual.index.tolist() == sorted(expected.index)
+    pd.testing.assert_series_equal(
+        actual["terms_SMA_over"], expected["terms_SMA_over"].sort_index(), check_dtype=False
+    )
+    pd.testing.assert_series_equal(actual["SMA25"], expected["SMA25"].sort_index(), check_dtype=False)
+
+
+def test_oversized_partition_is_split_to_fit_the_limit(tmp_path, price_csv):
+    output = tmp_path / "result.csv"
+
+    # 一時ファイル1つに全銘柄が入り、1回で計算できる行数を超える
+    stats = stream_stock_metrics(price_csv, output, memory_limit_mb=0.05, spill_partitions=1)
+
+    expected = csm.calc_stock_metrics_file(price_csv)
+    assert stats["budget_rows"] < len(expected)
+    assert stats["spill_partitions"] > 1
+    assert stats["max_batch_rows"] <= stats["budget_rows"]
+    pd.testing.assert_frame_equal(read_result(output), expected.sort_index(), check_dtype=False, rtol=1e-12)
+
+
+def test_single_code_over_the_limit_raises(tmp_path):
+    path = tmp_path / "stock_price.csv"
+    make_prices(codes=2, days=400).to_csv(path, index=False)
+
+    with pytest.raises(ValueError, match="memory_limit_mb"):
+        stream_stock_metrics(path, tmp_path / "result.csv", memory_limit_mb=0.05, spill_partitions=1)
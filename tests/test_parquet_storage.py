@@ -0,0 +1,80 @@
+import pandas as pd
+import pytest
+
+from jquants_free_mcp_server import calc_stock_metrics as csm
+from jquants_free_mcp_server import parquet_storage
+from test_calc_stock_metrics import make_prices
+
+
+@pytest.fixture
+def prices():
+    df = make_prices(codes=4, days=200)
+    df["Code"] = df["Code"].astype(str)
+    df["AdjustmentOpen"] = df["AdjustmentClose"]
+    df["AdjustmentHigh"] = df["AdjustmentClose"]
+    return df
+
+
+def test_write_partitions_by_year_and_month(tmp_path, prices):
+    path = parquet_storage.write_dataset(prices, "stock_price", root=tmp_path)
+
+    assert (path / "year=2023" / "month=1").is_dir()
+    assert (path / "year=2023" / "month=10").is_dir()
+
+
+def test_round_trip_uses_compact_types_and_keeps_row_order(tmp_path, prices):
+    parquet_storage.write_dataset(prices, "stock_price", root=tmp_path)
+
+    table = parquet_storage.read_table("stock_price", root=tmp_path)
+    df = parquet_storage.read_dataset("stock_price", root=tmp_path)
+
+    assert str(table.schema.field("Date").type) == "date32[day]"
+    assert str(table.schema.field("AdjustmentClose").type) == "float"
+    assert str(table.schema.field("AdjustmentVolume").type) == "double"
+    assert isinstance(df["Code"].dtype, pd.CategoricalDtype)
+    assert df["Date"].tolist() == prices["Date"].tolist()
+    assert df["Code"].astype(str).tolist() == prices["Code"].tolist()
+
+
+def test_read_projects_columns_and_filters_rows(tmp_path, prices):
+    parquet_storage.write_dataset(prices, "stock_price", root=tmp_path)
+
+    df = parquet_storage.read_dataset(
+        "stock_price", columns=["Date", "Code"], codes=[10010], start="2023-03-01", end="2023-03-31", root=tmp_path
+    )
+
+    expected = prices[(prices["Code"] == "10010") & prices["Date"].between("2023-03-01", "2023-03-31")]
+    assert list(df.columns) == ["Date", "Code"]
+    assert df["Date"].tolist() == expected["Date"].tolist()
+
+
+def test_rewriting_a_period_replaces_its_partitions(tmp_path, prices):
+    parquet_storage.write_dataset(prices, "stock_price", root=tmp_path)
+    parquet_storage.write_dataset(prices[prices["Date"] >= "2023-06-01"], "stock_price", root=tmp_path)
+
+    assert parquet_storage.read_table("stock_price", root=tmp_path).num_rows == len(prices)
+
+
+def test_unknown_dataset_is_rejected(tmp_path, prices):
+    with pytest.raises(ValueError):
+        parquet_storage.write_dataset(prices, "quotes", root=tmp_path)
+
+
+@pytest.mark.parametrize("backend", csm.METRICS_BACKENDS)
+def test_metrics_from_parquet_match_csv(tmp_path, prices, backend):
+    csv_path = tmp_path / "stock_price.csv"
+    prices.to_csv(csv_path, index=False)
+    # float32で保存した価格と同じ値をCSV側にも使う
+    csv_prices = pd.read_csv(csv_path)
+    for col in ["AdjustmentOpen", "AdjustmentHigh", "AdjustmentLow", "AdjustmentClose"]:
+        csv_prices[col] = csv_prices[col].astype("float32").astype("float64")
+    csv_prices.to_csv(csv_path, index=False)
+    parquet_storage.write_dataset(prices, "stock_price", root=tmp_path)
+
+    expected = csm.calc_stock_metrics_file(csv_path, backend=backend)
+    actual = csm.calc_stock_metrics_file(tmp_path / "stock_price", backend=backend)
+
+    expected = expected[list(actual.columns)]
+    expected["Code"] = expected["Code"].astype(str)
+    actual["Code"] = actual["Code"].astype(str)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_categorical=False, rtol=1e-6)
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from jquants_free_mcp_server.rate_limiter import BlockingTokenBucket, TokenBucket, requests_per_minute_from_env
+
+
+def test_token_bucket_paces_requests_after_burst():
+    bucket = TokenBucket(rate=50.0, capacity=2)
+
+    async def run():
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # 2件はバースト、残り3件は 1/50 秒ずつ待つ
+    assert asyncio.run(run()) >= 3 / 50 * 0.9
+
+
+def test_token_bucket_per_minute():
+    bucket = TokenBucket.per_minute(120)
+
+    assert bucket.rate == pytest.approx(2.0)
+    assert bucket.capacity == 1
+
+
+def test_token_bucket_rejects_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_blocking_token_bucket_paces_requests_across_threads():
+    bucket = BlockingTokenBucket(rate=50.0, capacity=2)
+    calls = []
+    limited = bucket.wrap(lambda i: calls.append(i))
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=limited, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 2件はバースト、残り4件はスレッドをまたいで 1/50 秒ずつ待つ
+    assert time.monotonic() - started >= 4 / 50 * 0.9
+    assert sorted(calls) == list(range(6))
+
+
+def test_requests_per_minute_from_env(monkeypatch):
+    monkeypatch.delenv("JQUANTS_RATE_LIMIT_PER_MINUTE", raising=False)
+    monkeypatch.setenv("JQUANTS_PLAN", "Standard")
+    assert requests_per_minute_from_env() == 120
+
+    monkeypatch.setenv("JQUANTS_RATE_LIMIT_PER_MINUTE", "30")
+    assert requests_per_minute_from_env() == 30
@@ -0,0 +1,150 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import httpx
+
+from jquants_free_mcp_server import server
+
+QUOTES_URL = "https://api.jquants.com/v1/prices/daily_quotes"
+STATEMENTS_URL = "https://api.jquants.com/v1/fins/statements"
+LISTED_URL = "https://api.jquants.com/v1/listed/info"
+
+
+def test_request_key_and_sent_url_agree(jquants_api):
+    jquants_api.handler = lambda request: httpx.Response(200, json={"daily_quotes": []})
+
+    asyncio.run(server.make_requests(QUOTES_URL + "?code=1&from=a", params={"to": "b"}))
+
+    sent = jquants_api.requests[0].url
+    assert dict(sent.params) == {"code": "1", "from": "a", "to": "b"}
+    assert server.canonical_request_key(str(sent)) == server.canonical_request_key(
+        QUOTES_URL, {"to": "b", "from": "a", "code": "1"}
+    )
+
+
+STATEMENT = {
+    "DisclosedDate": "2024-05-08", "LocalCode": "72030", "TypeOfDocument": "FYFinancialStatements",
+    "TotalAssets": "90000", "Equity": "35000", "NetSales": "45000", "EarningsPerShare": "",
+}
+
+
+def test_financial_statements_fields_preset_and_columnar(jquants_api):
+    jquants_api.handler = lambda request: httpx.Response(200, json={"statements": [STATEMENT]})
+
+    result = json.loads(asyncio.run(server.get_financial_statements(
+        "72030", fields=["balance_sheet"], output_format="columnar",
+    )))
+
+    assert result["format"] == "columnar"
+    assert result["statements"] == {
+        "DisclosedDate": ["2024-05-08"], "LocalCode": ["72030"],
+        "TypeOfDocument": ["FYFinancialStatements"], "TotalAssets": ["90000"], "Equity": ["35000"],
+    }
+
+
+def test_financial_statements_rejects_unknown_fields(jquants_api):
+    jquants_api.handler = lambda request: httpx.Response(200, json={"statements": [STATEMENT]})
+
+    result = json.loads(asyncio.run(server.get_financial_statements("72030", fields=["balance-sheet"])))
+
+    assert result["status"] == "invalid_parameter"
+    assert "balance-sheet" in result["error"]
+
+
+NOW = datetime(2025, 6, 2, 12, 0, tzinfo=timezone.utc)
+
+
+def test_cache_ttl_marks_windows_before_delay_horizon_immutable():
+    old_window = {"code": "72030", "from": "2024-01-01", "to": "2024-12-31"}
+    recent_window = {"code": "72030", "from": "2025-05-01", "to": "2025-05-30"}
+
+    assert server.cache_ttl(QUOTES_URL, old_window, NOW) is None
+    assert server.cache_ttl(STATEMENTS_URL, {"date": "20240508"}, NOW) is None
+    # 期間が遅延ホライズンより新しい、または期間指定がなければ次の日次更新まで
+    assert 0 < server.cache_ttl(QUOTES_URL, recent_window, NOW) <= 24 * 3600
+    assert 0 < server.cache_ttl(STATEMENTS_URL, {"code": "72030"}, NOW) <= 24 * 3600
+    assert 0 < server.cache_ttl(LISTED_URL, None, NOW) <= 24 * 3600
+
+
+def test_cache_counts_hits_and_misses(jquants_api):
+    jquants_api.handler = lambda request: httpx.Response(200, json={"daily_quotes": [{"Close": 1}]})
+    params = {"code": "72030", "from": "2024-01-01", "to": "2024-01-31"}
+
+    async def run():
+        for _ in range(3):
+            assert await server.make_requests(QUOTES_URL, params=params) == {"daily_quotes": [{"Close": 1}]}
+
+    asyncio.run(run())
+    stats = json.loads(asyncio.run(server.get_cache_stats()))
+
+    assert len(jquants_api.requests) == 1
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["endpoints"]["/v1/prices/daily_quotes"]["immutable_entries"] == 1
+
+
+def test_concurrent_identical_requests_share_one_upstream_call(jquants_api, monkeypatch):
+    monkeypatch.setattr(server, "RESPONSE_CACHE_ENABLED", False)
+    jquants_api.handler = lambda request: httpx.Response(200, json={"info": []})
+
+    async def run():
+        return await asyncio.gather(*(server.make_requests(LISTED_URL, params={"code": "7203"}) for _ in range(10)))
+
+    results = asyncio.run(run())
+
+    assert len(jquants_api.requests) == 1
+    assert results == [{"info": []}] * 10
+    assert server._inflight_requests == {}
+
+
+def test_pagination_stops_once_enough_records_are_collected(jquants_api):
+    def handler(request):
+        page = int(request.url.params.get("pagination_key", "0"))
+        return httpx.Response(200, json={
+            "daily_quotes": [{"Date": f"{page}-{i}"} for i in range(3)],
+            "pagination_key": str(page + 1),
+        })
+
+    jquants_api.handler = handler
+
+    result = json.loads(asyncio.run(server.get_daily_quotes(
+        "72030", "2024-01-01", "2024-12-31", limit=2, start_position=3,
+    )))
+
+    assert [r["Date"] for r in result["daily_quotes"]] == ["1-0", "1-1"]
+    assert len(jquants_api.requests) == 2
+    assert all(r.url.params["code"] == "72030" for r in jquants_api.requests)
+
+
+def test_retry_honors_retry_after(jquants_api, monkeypatch):
+    monkeypatch.setattr(server, "RESPONSE_CACHE_ENABLED", False)
+    responses = [
+        httpx.Response(429, headers={"Retry-After": "2"}),
+        httpx.Response(503),
+        httpx.Response(200, json={"info": [{"Code": "72030"}]}),
+    ]
+    jquants_api.handler = lambda request: responses.pop(0)
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(server.asyncio, "sleep", fake_sleep)
+
+    result = asyncio.run(server.make_requests(LISTED_URL))
+
+    assert result == {"info": [{"Code": "72030"}]}
+    assert len(jquants_api.requests) == 3
+    assert delays[0] == 2.0
+    # Retry-Afterがない場合はジッター付きバックオフ (attempt=1 の上限は base * 2)
+    assert 0 <= delays[1] <= server.RETRY_BASE_DELAY * 2
+
+
+def test_retry_gives_up_after_max_attempts(jquants_api, monkeypatch):
+    monkeypatch.setattr(server, "RESPONSE_CACHE_ENABLED", False)
+    jquants_api.handler = lambda request: httpx.Response(500)
+
+    result = asyncio.run(server.make_requests(LISTED_URL))
+
+    assert result["status"] == "request_error"
+    assert len(jquants_api.requests) == server.RETRY_MAX_ATTEMPTS
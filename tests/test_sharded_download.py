@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+from jquants_free_mcp_server import sharded_download
+
+CODES = ["13010", "13050", "72030"]
+
+
+def daily_quotes(day):
+    """モックのAPIが返すその日の株価 (銘柄コード順)"""
+    return [{"Date": day.isoformat(), "Code": code, "Close": float(day.day * 100 + i)} for i, code in enumerate(CODES)]
+
+
+class MockJQuants(BaseHTTPRequestHandler):
+    """J-Quants APIの /prices/daily_quotes?date=YYYY-MM-DD だけを返すモック (failing_days は500を返す)"""
+
+    failing_days: set[str] = set()
+    requested: list[str] = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        day = parse_qs(url.query)["date"][0]
+        self.requested.append(day)
+        if url.path != "/v1/prices/daily_quotes" or day in self.failing_days:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps({"daily_quotes": daily_quotes(date.fromisoformat(day))}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_api():
+    MockJQuants.failing_days = set()
+    MockJQuants.requested = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockJQuants)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    def fetch_day(day):
+        response = requests.get(f"{base_url}/prices/daily_quotes", params={"date": day.strftime("%Y-%m-%d")}, timeout=5)
+        response.raise_for_status()
+        df = pd.DataFrame(response.json()["daily_quotes"])
+        df["Date"] = pd.to_datetime(df["Date"])
+        return df
+
+    yield fetch_day
+    server.shutdown()
+
+
+def test_trading_days_skip_weekends():
+    days = sharded_download.trading_days(date(2024, 8, 30), date(2024, 9, 3))
+
+    assert days == [date(2024, 8, 30), date(2024, 9, 2), date(2024, 9, 3)]
+
+
+def test_download_range_assembles_days_in_date_order(mock_api, tmp_path):
+    df = sharded_download.download_range("stock_price", mock_api, date(2024, 8, 1), date(2024, 8, 31),
+                                         shards_root=tmp_path, workers=4)
+
+    days = sharded_download.trading_days(date(2024, 8, 1), date(2024, 8, 31))
+    expected = pd.DataFrame([row for day in days for row in daily_quotes(day)])
+    assert df["Date"].dt.strftime("%Y-%m-%d").tolist() == expected["Date"].tolist()
+    assert df["Code"].tolist() == expected["Code"].tolist()
+    assert df["Close"].tolist() == expected["Close"].tolist()
+    # 全ての日がそろったらチェックポイントは削除する
+    assert not (tmp_path / "stock_price").exists()
+
+
+def test_interrupted_download_resumes_from_checkpoints(mock_api, tmp_path):
+    start, end = date(2024, 8, 1), date(2024, 8, 14)
+    MockJQuants.failing_days = {"2024-08-07", "2024-08-08"}
+
+    with pytest.raises(RuntimeError, match="2日分"):
+        sharded_download.download_range("stock_price", mock_api, start, end, shards_root=tmp_path, workers=3)
+
+    assert len(list((tmp_path / "stock_price").glob("*.parquet"))) == 8
+    MockJQuants.failing_days = set()
+    MockJQuants.requested = []
+
+    df = sharded_download.download_range("stock_price", mock_api, start, end, shards_root=tmp_path, workers=3)
+
+    assert sorted(MockJQuants.requested) == ["2024-08-07", "2024-08-08"]
+    assert len(df) == 10 * len(CODES)
+    assert df["Date"].is_monotonic_increasing
+
+
+def test_workers_bound_concurrent_requests(tmp_path):
+    lock = threading.Lock()
+    state = {"running": 0, "max_running": 0}
+
+    def fetch_day(day):
+        with lock:
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+        return pd.DataFrame({"Date": [pd.Timestamp(day)]})
+
+    df = sharded_download.download_range("topix", fetch_day, date(2024, 8, 1), date(2024, 8, 30),
+                                         shards_root=tmp_path, workers=2, keep_shards=True)
+
+    assert state["max_running"] == 2
+    assert len(df) == 22
+    assert len(list((tmp_path / "topix").glob("*.parquet"))) == 22
+
+
+def test_empty_days_are_checkpointed(tmp_path):
+    calls = []
+
+    def fetch_day(day):
+        calls.append(day)
+        return pd.DataFrame()
+
+    for _ in range(2):
+        df = sharded_download.download_range("stock_fin", fetch_day, date(2024, 8, 12), date(2024, 8, 12),
+                                             shards_root=tmp_path, keep_shards=True)
+
+    assert calls == [date(2024, 8, 12)]
+    assert df.empty
@@ -0,0 +1,156 @@
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from jquants_free_mcp_server import delta_ingest, parquet_storage, streaming_ingest
+from test_delta_ingest import START, FakeAPI, make_source
+
+
+def per_day(api):
+    """FakeAPI を1日ずつ取得する関数にする"""
+    return lambda day: api.fetch(datetime.combine(day, START.time()), datetime.combine(day, START.time()))
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {
+        "csv_path": tmp_path / "stock_price.csv",
+        "watermarks_path": tmp_path / "watermarks.json",
+        "parquet_root": tmp_path / "parquet",
+    }
+
+
+def other_paths(tmp_path):
+    return {
+        "csv_path": tmp_path / "delta" / "stock_price.csv",
+        "watermarks_path": tmp_path / "delta" / "watermarks.json",
+        "parquet_root": tmp_path / "delta" / "parquet",
+    }
+
+
+def test_rebatch_groups_frames_up_to_batch_rows():
+    frames = [pd.DataFrame({"x": range(n)}) for n in (3, 0, 4, 2, 5, 1)]
+
+    batches = list(streaming_ingest.rebatch(frames, batch_rows=6))
+
+    assert [len(b) for b in batches] == [7, 7, 1]
+    assert pd.concat(batches)["x"].tolist() == pd.concat(frames)["x"].tolist()
+
+
+def test_streaming_matches_delta_ingest(paths, tmp_path):
+    api = FakeAPI(make_source())
+    formats = ("csv", "parquet")
+    stream_engine, delta_engine = create_engine("sqlite://"), create_engine("sqlite://")
+    delta = other_paths(tmp_path)
+
+    for end in (datetime(2024, 9, 2, 9), datetime(2024, 10, 22, 9)):
+        streaming_ingest.ingest("stock_price", per_day(api), START, end, engine=stream_engine, formats=formats,
+                                batch_rows=10, **paths)
+        delta_ingest.ingest("stock_price", api.fetch, START, end, engine=delta_engine, formats=formats, **delta)
+
+    assert paths["csv_path"].read_bytes() == delta["csv_path"].read_bytes()
+    pd.testing.assert_frame_equal(
+        parquet_storage.read_dataset("stock_price", root=paths["parquet_root"]),
+        parquet_storage.read_dataset("stock_price", root=delta["parquet_root"]),
+    )
+    query = "SELECT * FROM stock_price ORDER BY Date, Code"
+    pd.testing.assert_frame_equal(pd.read_sql(query, stream_engine), pd.read_sql(query, delta_engine))
+    assert delta_ingest.load_watermarks(paths["watermarks_path"]) == {"stock_price": "2024-10-22"}
+
+
+def test_failure_mid_stream_leaves_every_target_unchanged(paths):
+    api = FakeAPI(make_source())
+    engine = create_engine("sqlite://")
+    end = datetime(2024, 9, 30, 9)
+    streaming_ingest.ingest("stock_price", per_day(api), START, datetime(2024, 9, 2, 9), engine=engine,
+                            formats=("csv", "parquet"), batch_rows=10, **paths)
+    csv_before = paths["csv_path"].read_bytes()
+    parquet_before = parquet_storage.read_dataset("stock_price", root=paths["parquet_root"])
+    db_before = pd.read_sql("SELECT * FROM stock_price", engine)
+
+    def failing_day(day):
+        if day >= datetime(2024, 9, 20).date():
+            raise RuntimeError("network")
+        return per_day(api)(day)
+
+    with pytest.raises(RuntimeError):
+        streaming_ingest.ingest("stock_price", failing_day, START, end, engine=engine, formats=("csv", "parquet"),
+                                batch_rows=10, **paths)
+
+    assert paths["csv_path"].read_bytes() == csv_before
+    pd.testing.assert_frame_equal(parquet_storage.read_dataset("stock_price", root=paths["parquet_root"]),
+                                  parquet_before)
+    pd.testing.assert_frame_equal(pd.read_sql("SELECT * FROM stock_price", engine), db_before)
+    assert delta_ingest.load_watermarks(paths["watermarks_path"]) == {"stock_price": "2024-09-02"}
+    assert not (paths["parquet_root"] / ".stock_price.tmp").exists()
+
+
+def test_no_new_rows_keeps_existing_data(paths):
+    api = FakeAPI(make_source())
+    streaming_ingest.ingest("stock_price", per_day(api), START, datetime(2024, 9, 2, 9), **paths)
+    before = paths["csv_path"].read_bytes()
+
+    rows = streaming_ingest.ingest("stock_price", lambda day: pd.DataFrame(), START, datetime(2024, 9, 2, 9),
+                                   full_rebuild=True, **paths)
+
+    assert rows == 0
+    assert paths["csv_path"].read_bytes() == before
+
+
+def test_csv_sink_widens_the_header_for_new_columns(tmp_path):
+    path = tmp_path / "stock_price.csv"
+    existing = pd.DataFrame({"Date": ["2024-09-02"], "Code": ["13010"], "Close": [1.0]})
+    existing.to_csv(path, index=False)
+    batches = [
+        pd.DataFrame({"Date": pd.to_datetime(["2024-09-03"] * 2), "Code": ["13010", "13050"], "Close": [2.0, 3.0]}),
+        pd.DataFrame({"Date": pd.to_datetime(["2024-09-04"]), "Code": ["13010"], "Close": [4.0], "Volume": [100]}),
+        pd.DataFrame({"Date": pd.to_datetime(["2024-09-05"]), "Code": ["13010"], "Volume": [200]}),
+    ]
+
+    sink = streaming_ingest.CsvSink(path, "Date", from_date=datetime(2024, 9, 3).date(), chunk_rows=1)
+    for df in batches:
+        sink.write(df)
+    sink.close()
+
+    # 後から増えた列は落とさず、pd.concat で結合した場合と同じCSVにする
+    expected = pd.concat([existing, *[delta_ingest.dates_to_str(df) for df in batches]], ignore_index=True)
+    actual = pd.read_csv(path, dtype={"Code": str})
+    assert actual.columns.tolist() == ["Date", "Code", "Close", "Volume"]
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_peak_memory_does_not_grow_with_the_period(tmp_path):
+    codes = 1000
+    rng = np.random.default_rng(0)
+
+    def fetch_day(day):
+        return pd.DataFrame({
+            "Date": pd.Timestamp(day),
+            "Code": [str(13010 + i * 10) for i in range(codes)],
+            "Close": rng.random(codes),
+            "Volume": rng.integers(0, 10**6, codes),
+        })
+
+    def peak_memory(days):
+        end = START + pd.offsets.BDay(days - 1)
+        tracemalloc.start()
+        try:
+            rows = streaming_ingest.ingest("stock_price", fetch_day, START, end, batch_rows=codes * 2,
+                                           csv_path=tmp_path / f"{days}.csv",
+                                           watermarks_path=tmp_path / f"{days}.json")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert rows == codes * days
+        return peak
+
+    short, long = peak_memory(15), peak_memory(60)
+
+    # 期間を4倍にしても、メモリに置くのはバッチと先読みの分だけ
+    full_size = fetch_day(START.date()).memory_usage(deep=True).sum() * 60
+    assert long < short * 1.5
+    assert long < full_size / 2